@@ -0,0 +1,6 @@
+"""
+Benchmarks for the fitting code in the resonator package.
+
+Each module in this package is a script that can be run from the repository root, for example
+  $ python -m benchmarks.jacobian
+"""
@@ -0,0 +1,79 @@
+"""
+Compare the wall time and the peak memory allocated by NumPy during a fit with the lean engine, which reads the whole
+data set into memory, to those of a fit with the chunked engine of data stored in np.memmap arrays, and check that the
+two engines agree. The pages of the memory maps are not counted by tracemalloc, so the peak memory of the chunked fits
+is that of the chunks and of the decimated data used for the guess.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from . import suite
+
+
+def write_memmap(directory, name, array):
+    """Write the given array to a file in the given directory and return a read-only memory map of it."""
+    path = os.path.join(directory, name + '.bin')
+    array.tofile(path)
+    return np.memmap(path, dtype=array.dtype, mode='r', shape=array.shape)
+
+
+def fit(case, frequency, data, fitter_kwds, **kwds):
+    """Return the fitter, the wall time, and the peak memory traced while creating and fitting it."""
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        fitter = case.fitter_class(frequency=frequency, data=data, **dict(fitter_kwds, **kwds))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return fitter, elapsed, peak
+
+
+def max_pull_difference(lean_fitter, chunked_fitter):
+    """Return the largest difference in best-fit values in units of the lean standard error."""
+    difference = 0
+    for name, p in lean_fitter.result.params.items():
+        if p.stderr:
+            difference = max(difference, abs(p.value - chunked_fitter.result.params[name].value) / p.stderr)
+    return difference
+
+
+def main(sizes=(10 ** 5, 10 ** 6, 10 ** 7), chunk_size=2 ** 16, background_name='MagnitudePhaseDelay', snr=100,
+         quality_factor=1e5):
+    cases = [case for case in suite.cases if case.fitter_class.__name__ in ('LinearShuntFitter', 'KerrShuntFitter')]
+    print("{:20s} {:>10s} {:>10s} {:>14s} {:>10s} {:>14s} {:>8s}".format(
+        'fitter', 'points', 'lean / s', 'lean / MB', 'chunked / s', 'chunked / MB', 'd value'))
+    directory = tempfile.mkdtemp()
+    try:
+        for case in cases:
+            for num_points in sizes:
+                frequency, data, true_values, fitter_kwds = suite.synthetic_data(
+                    case=case, background_name=background_name, num_points=num_points, snr=snr,
+                    quality_factor=quality_factor)
+                frequency_map = write_memmap(directory=directory, name='frequency', array=frequency)
+                data_map = write_memmap(directory=directory, name='data', array=data)
+                del frequency, data
+                lean_fitter, lean_time, lean_peak = fit(case=case, frequency=np.array(frequency_map),
+                                                        data=np.array(data_map), fitter_kwds=fitter_kwds,
+                                                        engine='lean')
+                chunked_fitter, chunked_time, chunked_peak = fit(case=case, frequency=frequency_map, data=data_map,
+                                                                 fitter_kwds=fitter_kwds, engine='chunked',
+                                                                 chunk_size=chunk_size)
+                print("{:20s} {:10d} {:10.2f} {:14.1f} {:10.2f} {:14.1f} {:8.2g}".format(
+                    case.fitter_class.__name__, num_points, lean_time, lean_peak / 1e6, chunked_time,
+                    chunked_peak / 1e6, max_pull_difference(lean_fitter=lean_fitter, chunked_fitter=chunked_fitter)))
+                del frequency_map, data_map
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
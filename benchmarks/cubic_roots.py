@@ -0,0 +1,146 @@
+"""
+Compare the real roots calculated by `cubic.real_roots` with those calculated by `np.roots` for random cubic polynomials
+whose coefficients differ by up to 16 orders of magnitude, so that many of them have roots that also differ by many
+orders of magnitude. This prints the number of polynomials for which the number of real roots differs and the largest
+relative difference of the roots, and raises an AssertionError if either exceeds its tolerance.
+
+It then compares the root returned by `kerr.kerr_detuning_shift` with the root chosen from those of `np.roots` for
+random losses, coupling coefficients, and inputs from far below to far above bifurcation, including inputs exactly at
+bifurcation, with detuning points spread over the resonance and clustered on both sides of the edges of the bistable
+interval, for several `choose` functions. Near the edges two roots nearly coincide and are ill-conditioned, so the
+difference is measured in units of the error caused by rounding the coefficients, and points where two roots are
+closer than `double_root_tolerance` times the largest root may have a different number of real roots.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from resonator import cubic, kerr
+
+
+def reference_roots(coefficients, newton_steps=3):
+    """
+    Return the sorted real roots of the cubic polynomial with the given coefficients, calculated by `np.roots` and
+    polished by Newton steps in extended precision.
+    """
+    roots = np.roots(coefficients)
+    roots = roots[roots.imag == 0].real.astype(np.longdouble)
+    a, b, c, d = coefficients.astype(np.longdouble)
+    for _ in range(newton_steps):
+        slope = (3 * a * roots + 2 * b) * roots + c
+        polished = roots - (((a * roots + b) * roots + c) * roots + d) / np.where(slope == 0, 1, slope)
+        roots = np.where(slope == 0, roots, polished)
+    return np.sort(roots.astype(float))
+
+
+def compare(roots, reference_coefficients):
+    """
+    Return the number of points at which the number of real roots differs from that found by `np.roots`, and the
+    largest relative difference of the roots at the other points; see `reference_roots`.
+
+    :param roots: an array with shape (3, num_points) returned by `cubic.real_roots`.
+    :param reference_coefficients: an array with shape (4, num_points) of the coefficients of the same polynomials.
+    :return: tuple[int, float]
+    """
+    num_mismatched = 0
+    largest_difference = 0
+    for index in range(roots.shape[1]):
+        reference = reference_roots(reference_coefficients[:, index])
+        calculated = roots[:, index][~np.isnan(roots[:, index])]
+        if calculated.size != reference.size:
+            num_mismatched += 1
+        elif reference.size:
+            largest_difference = max(largest_difference,
+                                     np.max(np.abs(calculated - reference) / np.abs(reference)))
+    return num_mismatched, largest_difference
+
+
+def max_abs(roots, axis=0):
+    """Return the root with the largest magnitude at each point; this is a `choose` function for the comparison."""
+    return np.take_along_axis(roots, np.argmax(np.abs(roots), axis=0)[np.newaxis], axis=0)[0]
+
+
+def min_abs(roots, axis=0):
+    """Return the root with the smallest magnitude at each point; see `max_abs`."""
+    return np.take_along_axis(roots, np.argmin(np.abs(roots), axis=0)[np.newaxis], axis=0)[0]
+
+
+def condition_bound(coefficients, root):
+    """
+    Return the error of the given simple root of the cubic with the given coefficients that is caused by relative errors
+    of the machine precision in the coefficients, to first order; this is large near a double root.
+    """
+    powers = root ** np.arange(3, -1, -1)
+    slope = np.polyval(np.polyder(coefficients), root)
+    return np.finfo(float).eps * np.sum(np.abs(coefficients * powers)) / np.abs(slope)
+
+
+def compare_kerr(num_resonators, points_per_resonator, choose, double_root_tolerance, random):
+    """
+    Return two numbers for random resonators: the number of points at which the number of real roots differs from that
+    found by `np.roots` where no two roots are closer than `double_root_tolerance` times the largest root, and the
+    largest difference between the root returned by `kerr.kerr_detuning_shift` and the root chosen from the reference
+    roots at the other points, in units of the error caused by rounding the coefficients; see `condition_bound`.
+    """
+    num_mismatched = 0
+    largest_ratio = 0
+    for _ in range(num_resonators):
+        coupling_loss, internal_loss = 10 ** random.uniform(-7, -3, size=2)
+        io_coupling_coefficient = random.uniform(0.5, 2)
+        total_loss = coupling_loss + internal_loss
+        bifurcation = kerr.absolute_kerr_input_at_bifurcation(coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                                              io_coupling_coefficient=io_coupling_coefficient)
+        fraction = 1 if random.rand() < 0.1 else 10 ** random.uniform(-3, np.log10(30))
+        kerr_input = random.choice([-1, 1]) * fraction * bifurcation
+        lower, upper = kerr.bistable_detuning(coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                              kerr_input=kerr_input, io_coupling_coefficient=io_coupling_coefficient)
+        if np.isnan(lower):
+            # Without bistability, cluster the points around the detuning of bifurcation instead.
+            edges = np.array([np.sign(kerr_input) * np.sqrt(3) * total_loss / 2])
+        else:
+            edges = np.array([lower, upper])
+        offsets = (random.choice([-1, 1], size=(edges.size, points_per_resonator))
+                   * 10 ** random.uniform(-12, -2, size=(edges.size, points_per_resonator)))
+        detuning = np.concatenate((total_loss * random.uniform(-10, 10, size=points_per_resonator),
+                                   (edges[:, np.newaxis] * (1 + offsets)).ravel()))
+        shift = kerr.kerr_detuning_shift(detuning=detuning, coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                         kerr_input=kerr_input, io_coupling_coefficient=io_coupling_coefficient,
+                                         choose=choose)
+        d = -io_coupling_coefficient * coupling_loss * kerr_input
+        coefficients = np.stack(np.broadcast_arrays(1, -2 * detuning, total_loss ** 2 / 4 + detuning ** 2, d))
+        num_real = np.count_nonzero(~np.isnan(cubic.real_roots(*coefficients)), axis=0)
+        for index, y in enumerate(shift):
+            reference = reference_roots(coefficients[:, index])
+            if reference.size != num_real[index]:
+                # Near a double root, either calculation may return the double root as a complex pair.
+                separation = np.min(np.diff(reference)) if reference.size == 3 else 0
+                num_mismatched += separation > double_root_tolerance * np.max(np.abs(reference))
+                continue
+            chosen = reference[0] if reference.size == 1 else choose(reference[:, np.newaxis], axis=0)[0]
+            largest_ratio = max(largest_ratio, abs(y - chosen) / condition_bound(coefficients[:, index], chosen))
+    return num_mismatched, largest_ratio
+
+
+def main(num_polynomials=10000, decades=8, tolerance=1e-12, num_resonators=300, points_per_resonator=100,
+         condition_tolerance=100, double_root_tolerance=1e-6, seed=0):
+    random = np.random.RandomState(seed)
+    coefficients = (10 ** random.uniform(-decades, decades, size=(4, num_polynomials))
+                    * random.choice([-1, 1], size=(4, num_polynomials)))
+    num_mismatched, largest_difference = compare(roots=cubic.real_roots(*coefficients),
+                                                 reference_coefficients=coefficients)
+    print("real_roots: {:d} of {:d} with a different number of real roots, largest relative difference {:.3g}".format(
+        num_mismatched, num_polynomials, largest_difference))
+    assert num_mismatched == 0
+    assert largest_difference < tolerance
+    for choose in (np.max, np.min, max_abs, min_abs):
+        num_mismatched, largest_ratio = compare_kerr(
+            num_resonators=num_resonators, points_per_resonator=points_per_resonator, choose=choose,
+            double_root_tolerance=double_root_tolerance, random=random)
+        print("kerr_detuning_shift with {}: {:d} points away from double roots with a different number of real roots, "
+              "largest difference {:.3g} times the rounding bound".format(choose.__name__, num_mismatched,
+                                                                         largest_ratio))
+        assert num_mismatched == 0
+        assert largest_ratio < condition_tolerance
+
+if __name__ == '__main__':
+    main()
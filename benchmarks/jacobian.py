@@ -0,0 +1,85 @@
+"""
+Compare the number of function evaluations and the wall time of fits that use the analytic Jacobian with fits that
+calculate the Jacobian using finite differences.
+"""
+from __future__ import absolute_import, division, print_function
+
+import functools
+import time
+
+import numpy as np
+
+from resonator import background, kerr, kerr_loss, reflection, shunt, transmission
+
+
+def synthetic_data(fitter_class, background_model, num_points, noise=0.01, seed=0):
+    """
+    Return frequency and data arrays for a resonance with Q_i = 2e5 and Q_c = 1e5 plus gaussian noise; the Kerr models
+    are driven at twice the bifurcation input.
+    """
+    foreground_model = {
+        shunt.LinearShuntFitter: shunt.LinearShunt,
+        reflection.LinearReflectionFitter: reflection.LinearReflection,
+        transmission.CCxSTFitterKnownCoupling: transmission.LinearSymmetricTransmission,
+        shunt.KerrShuntFitter: functools.partial(shunt.KerrShunt, choose=np.max),
+        reflection.KerrReflectionFitter: functools.partial(reflection.KerrReflection, choose=np.max),
+        reflection.KerrLossReflectionFitter: functools.partial(reflection.KerrLossReflection,
+                                                               choose=kerr_loss.choose_min)}[fitter_class]()
+    resonance_frequency = 5e9
+    coupling_loss = 1e-5
+    internal_loss = 5e-6
+    frequency = resonance_frequency * (1 + 10 * (coupling_loss + internal_loss) * np.linspace(-1, 1, num_points))
+    params = foreground_model.make_params(resonance_frequency=resonance_frequency, coupling_loss=coupling_loss,
+                                          internal_loss=internal_loss, asymmetry=0.1,
+                                          kerr_input=2 * kerr.absolute_kerr_input_at_bifurcation(
+                                              coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                              io_coupling_coefficient=foreground_model.io_coupling_coefficient),
+                                          nonlinear_loss=1e-7, reduced_kerr=1e-6, reduced_input_rate=1e-4)
+    params.update(background_model.make_params(magnitude=0.8, phase=0.5, delay=1e-9, magnitude_slope=0,
+                                               magnitude_offset=0.8, frequency_reference=resonance_frequency))
+    data = (background_model.eval(params=params, frequency=frequency)
+            * foreground_model.eval(params=params, frequency=frequency))
+    random = np.random.RandomState(seed)
+    data += noise * (random.randn(num_points) + 1j * random.randn(num_points))
+    return frequency, data
+
+
+def fit(fitter_class, background_class, frequency, data, analytic_jacobian):
+    kwds = {'analytic_jacobian': analytic_jacobian}
+    if fitter_class is transmission.CCxSTFitterKnownCoupling:
+        kwds['coupling_loss'] = 1e-5
+    else:
+        kwds['background_model'] = background_class()
+    start = time.time()
+    fitter = fitter_class(frequency=frequency, data=data, **kwds)
+    return fitter.result.nfev, time.time() - start
+
+
+def main(sizes=(100, 1000, 10000, 100000), repeats=5):
+    cases = [(shunt.LinearShuntFitter, background.MagnitudePhase),
+             (shunt.LinearShuntFitter, background.MagnitudePhaseDelay),
+             (shunt.LinearShuntFitter, background.MagnitudeSlopeOffsetPhaseDelay),
+             (reflection.LinearReflectionFitter, background.MagnitudePhase),
+             (reflection.LinearReflectionFitter, background.MagnitudePhaseDelay),
+             (transmission.CCxSTFitterKnownCoupling, background.MagnitudePhase),
+             (shunt.KerrShuntFitter, background.MagnitudePhase),
+             (reflection.KerrReflectionFitter, background.MagnitudePhase),
+             (reflection.KerrLossReflectionFitter, background.MagnitudePhase)]
+    print("{:52s} {:>8s} {:>10s} {:>10s} {:>12s} {:>12s}".format(
+        'fitter * background', 'points', 'nfev fd', 'nfev jac', 'time fd / s', 'time jac / s'))
+    for fitter_class, background_class in cases:
+        for num_points in sizes:
+            frequency, data = synthetic_data(fitter_class=fitter_class, background_model=background_class(),
+                                             num_points=num_points)
+            results = {}
+            for analytic_jacobian in (False, True):
+                runs = [fit(fitter_class=fitter_class, background_class=background_class, frequency=frequency,
+                            data=data, analytic_jacobian=analytic_jacobian) for _ in range(repeats)]
+                results[analytic_jacobian] = (runs[0][0], min(t for _, t in runs))
+            print("{:52s} {:8d} {:10d} {:10d} {:12.4f} {:12.4f}".format(
+                '{} * {}'.format(fitter_class.__name__, background_class.__name__), num_points,
+                results[False][0], results[True][0], results[False][1], results[True][1]))
+
+
+if __name__ == '__main__':
+    main()
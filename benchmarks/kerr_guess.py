@@ -0,0 +1,68 @@
+"""
+Compare fits of the Kerr models that start from the linear guess (scan=False), with kerr_input or reduced_kerr equal to
+zero, to fits that start from the default guess that scans a grid of values (scan=True), for several strengths of the
+nonlinearity. For each fit this prints the wall time of the guess and of the fit from the guessed values, the peak
+memory of the guess traced by tracemalloc, nfev, and the reduced chi-squared divided by the noise variance, which is
+close to one for a good fit; the standard errors of the Kerr loss model are not meaningful because its parameters are
+degenerate, so the pulls are not used. Tracing slows the allocations, so the times of the guesses are longer than
+without tracemalloc.
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+import tracemalloc
+
+from . import suite
+
+
+def fit(case, frequency, data, fitter_kwds, scan):
+    """
+    Return the fitter after fitting the data starting from the guess with or without the scan, the time taken by the
+    guess, the peak memory traced during the guess, and the time taken by the fit.
+    """
+    fitter = case.fitter_class(frequency=frequency, data=data, lazy=True, scan=scan, **fitter_kwds)
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        params = fitter.initial_params()
+        guess_time = time.perf_counter() - start
+        _, guess_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # The guessed parameters include every model parameter, so fit() does not guess again.
+    start = time.perf_counter()
+    fitter.fit(params=params)
+    fit_time = time.perf_counter() - start
+    return fitter, guess_time, guess_memory, fit_time
+
+
+def main(kerr_fractions=(0.1, 0.5, 2, 5, -2), num_points=1000, snr=100, quality_factor=1e5,
+         background_name='MagnitudePhase', seed=0):
+    kerr_cases = [case for case in suite.cases if 'Kerr' in case.fitter_class.__name__]
+    columns = ['guess s', 'guess MB', 'fit s', 'nfev', 'chi2']
+    print("{:32s} {:>8s} ".format('', '') + ' '.join('{:>8s}'.format('linear') for _ in columns) + ' '
+          + ' '.join('{:>8s}'.format('scan') for _ in columns))
+    print("{:32s} {:>8s} ".format('fitter', 'fraction') + ' '.join('{:>8s}'.format(column) for column in 2 * columns))
+    noise_variance = (suite.background_magnitude / snr) ** 2
+    original_fraction = suite.kerr_fraction
+    try:
+        for case in kerr_cases:
+            for fraction in kerr_fractions:
+                suite.kerr_fraction = fraction
+                frequency, data, true_values, fitter_kwds = suite.synthetic_data(
+                    case=case, background_name=background_name, num_points=num_points, snr=snr,
+                    quality_factor=quality_factor, seed=seed)
+                values = []
+                for scan in (False, True):
+                    fitter, guess_time, guess_memory, fit_time = fit(case=case, frequency=frequency, data=data,
+                                                                     fitter_kwds=fitter_kwds, scan=scan)
+                    values.append("{:8.3f} {:8.1f} {:8.3f} {:8d} {:8.3g}".format(
+                        guess_time, guess_memory / 1e6, fit_time, fitter.result.nfev,
+                        fitter.result.redchi / noise_variance))
+                print("{:32s} {:8.1f} {}".format(case.fitter_class.__name__, fraction, ' '.join(values)))
+    finally:
+        suite.kerr_fraction = original_fraction
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Compare the wall time per fit of the lmfit engine with that of the lean engine, which calls
+scipy.optimize.least_squares directly, and check that the two engines produce the same best-fit values and standard
+errors. The difference in time at small numbers of points is the per-fit overhead removed by the lean engine.
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+
+import numpy as np
+
+from resonator import background, reflection, shunt, transmission
+
+from .jacobian import synthetic_data
+
+
+def fit(fitter_class, background_class, frequency, data, engine):
+    kwds = {'engine': engine}
+    if fitter_class is transmission.CCxSTFitterKnownCoupling:
+        kwds['coupling_loss'] = 1e-5
+    else:
+        kwds['background_model'] = background_class()
+    start = time.time()
+    fitter = fitter_class(frequency=frequency, data=data, **kwds)
+    return fitter, time.time() - start
+
+
+def max_difference(lmfit_fitter, lean_fitter):
+    """Return the largest difference in best-fit values in units of the lmfit standard error, and the largest relative
+    difference in standard errors."""
+    value_difference = 0
+    stderr_difference = 0
+    for name, p in lmfit_fitter.result.params.items():
+        q = lean_fitter.result.params[name]
+        if p.stderr:
+            value_difference = max(value_difference, abs(p.value - q.value) / p.stderr)
+            stderr_difference = max(stderr_difference, abs(p.stderr - q.stderr) / p.stderr)
+    return value_difference, stderr_difference
+
+
+def main(sizes=(30, 100, 300, 1000, 10000), repeats=10):
+    cases = [(shunt.LinearShuntFitter, background.MagnitudePhase),
+             (shunt.LinearShuntFitter, background.MagnitudePhaseDelay),
+             (shunt.LinearShuntFitter, background.MagnitudeSlopeOffsetPhaseDelay),
+             (reflection.LinearReflectionFitter, background.MagnitudePhase),
+             (transmission.CCxSTFitterKnownCoupling, background.MagnitudePhase)]
+    print("{:52s} {:>8s} {:>14s} {:>14s} {:>8s} {:>10s} {:>10s}".format(
+        'fitter * background', 'points', 'lmfit / ms', 'lean / ms', 'speedup', 'd value', 'd stderr'))
+    for fitter_class, background_class in cases:
+        for num_points in sizes:
+            frequency, data = synthetic_data(fitter_class=fitter_class, background_model=background_class(),
+                                             num_points=num_points)
+            fitters = {}
+            times = {}
+            for engine in ('lmfit', 'lean'):
+                runs = [fit(fitter_class=fitter_class, background_class=background_class, frequency=frequency,
+                            data=data, engine=engine) for _ in range(repeats)]
+                fitters[engine] = runs[0][0]
+                times[engine] = min(t for _, t in runs)
+            value_difference, stderr_difference = max_difference(fitters['lmfit'], fitters['lean'])
+            print("{:52s} {:8d} {:14.3f} {:14.3f} {:8.2f} {:10.2e} {:10.2e}".format(
+                '{} * {}'.format(fitter_class.__name__, background_class.__name__), num_points,
+                1e3 * times['lmfit'], 1e3 * times['lean'], times['lmfit'] / times['lean'], value_difference,
+                stderr_difference))
+
+
+if __name__ == '__main__':
+    np.seterr(all='ignore')
+    main()
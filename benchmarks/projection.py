@@ -0,0 +1,46 @@
+"""
+Compare fits with the lean engine with and without variable projection, starting from the guessed parameters with the
+background phase and magnitude moved away from their guessed values. For each fit this prints nfev and the reduced
+chi-squared divided by the noise variance, which is close to one for a good fit.
+"""
+from __future__ import absolute_import, division, print_function
+
+from . import suite
+
+
+def fit(case, frequency, data, fitter_kwds, params, projection):
+    fitter = case.fitter_class(frequency=frequency, data=data, engine='lean', params=params.copy(),
+                               projection=projection, **fitter_kwds)
+    return fitter.result
+
+
+def main(phase_errors=(0, 1, 2.5), magnitude_factor=3, num_points=1000, snr=100, quality_factor=1e5, seed=0):
+    fitter_names = ('LinearShuntFitter', 'LinearReflectionFitter', 'KerrShuntFitter', 'KerrReflectionFitter')
+    cases = [case for case in suite.cases if case.fitter_class.__name__ in fitter_names]
+    background_names = ('MagnitudePhase', 'MagnitudePhaseDelay', 'MagnitudeSlopeOffsetPhaseDelay')
+    print("{:24s} {:32s} {:>6s} {:>10s} {:>12s} {:>10s} {:>12s}".format(
+        'fitter', 'background', 'phase', 'full nfev', 'full chi2', 'vp nfev', 'vp chi2'))
+    noise_variance = (suite.background_magnitude / snr) ** 2
+    for case in cases:
+        for background_name in background_names:
+            frequency, data, true_values, fitter_kwds = suite.synthetic_data(
+                case=case, background_name=background_name, num_points=num_points, snr=snr,
+                quality_factor=quality_factor, seed=seed)
+            fitter = case.fitter_class(frequency=frequency, data=data, lazy=True, **fitter_kwds)
+            guess = fitter.guess(frequency=frequency, data=data)
+            for phase_error in phase_errors:
+                params = guess.copy()
+                params['phase'].value += phase_error
+                magnitude_name = 'magnitude_offset' if 'magnitude_offset' in params else 'magnitude'
+                params[magnitude_name].value *= magnitude_factor if phase_error else 1
+                columns = []
+                for projection in (False, True):
+                    result = fit(case=case, frequency=frequency, data=data, fitter_kwds=fitter_kwds, params=params,
+                                 projection=projection)
+                    columns.extend([result.nfev, result.redchi / noise_variance])
+                print("{:24s} {:32s} {:6.1f} {:10d} {:12.3g} {:10d} {:12.3g}".format(
+                    case.fitter_class.__name__, background_name, phase_error, *columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Compare the wall time of fitting many data sets on one frequency grid with `stacked.fit_stacked` to the time of fitting
+them one at a time using the lmfit and lean engines.
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+
+import numpy as np
+
+from resonator import background, reflection, shunt, stacked
+
+from .jacobian import synthetic_data
+
+
+def noisy_copies(data, num_data_sets, noise=0.01, seed=1):
+    """Return a 2D array in which each row is the given data plus independent gaussian noise."""
+    random = np.random.RandomState(seed)
+    shape = (num_data_sets, data.size)
+    return data + noise * (random.randn(*shape) + 1j * random.randn(*shape))
+
+
+def main(num_data_sets=(10, 100, 1000), num_points=300):
+    cases = [(shunt.LinearShuntFitter, background.MagnitudePhase),
+             (reflection.LinearReflectionFitter, background.MagnitudePhase)]
+    print("{:52s} {:>8s} {:>12s} {:>12s} {:>12s} {:>12s}".format(
+        'fitter * background', 'data sets', 'lmfit / s', 'lean / s', 'stacked / s', 'warm / s'))
+    for fitter_class, background_class in cases:
+        frequency, data = synthetic_data(fitter_class=fitter_class, background_model=background_class(),
+                                         num_points=num_points)
+        for num in num_data_sets:
+            datas = noisy_copies(data=data, num_data_sets=num)
+            times = []
+            for engine in ('lmfit', 'lean'):
+                start = time.time()
+                for row in datas:
+                    fitter_class(frequency=frequency, data=row, background_model=background_class(), engine=engine)
+                times.append(time.time() - start)
+            start = time.time()
+            fitters = stacked.fit_stacked(fitter_class, frequency=frequency, datas=datas,
+                                          background_model=background_class())
+            times.append(time.time() - start)
+            # Start every fit from the same complete set of parameters, which skips the guessing functions.
+            start = time.time()
+            stacked.fit_stacked(fitter_class, frequency=frequency, datas=datas, params=fitters[0].result.params,
+                                background_model=background_class())
+            times.append(time.time() - start)
+            print("{:52s} {:8d} {:12.3f} {:12.3f} {:12.3f} {:12.3f}".format(
+                '{} * {}'.format(fitter_class.__name__, background_class.__name__), num, *times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Check that `store.ResultStore` rebuilds the fitter of every row with the values stored in that row when the rows come
+from data in different frequency bands. The bounds of the resonance frequency depend on the frequency range of the data,
+so a row rebuilt with the bounds of another row would have its resonance frequency clipped to the other band. This fits
+synthetic data at several resonance frequencies, appends the fits to a temporary store, and raises an AssertionError if
+the value of any parameter of a rebuilt fitter differs from the stored column.
+"""
+from __future__ import absolute_import, division, print_function
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from resonator import store
+from . import suite
+
+
+def main(resonance_frequencies=(5e9, 6e9, 4e9), num_points=1000, snr=100, quality_factor=1e5,
+         background_name='MagnitudePhase', seed=0):
+    case = suite.cases[0]  # LinearShuntFitter
+    original_frequency = suite.resonance_frequency
+    path = tempfile.mkdtemp()
+    try:
+        results_store = store.ResultStore(path)
+        datasets = []
+        for resonance_frequency in resonance_frequencies:
+            suite.resonance_frequency = resonance_frequency
+            frequency, data, _, fitter_kwds = suite.synthetic_data(
+                case=case, background_name=background_name, num_points=num_points, snr=snr,
+                quality_factor=quality_factor, seed=seed)
+            fitter = case.fitter_class(frequency=frequency, data=data, **fitter_kwds)
+            results_store.append([fitter])
+            datasets.append((frequency, data, fitter_kwds))
+        for row, (frequency, data, fitter_kwds) in enumerate(datasets):
+            rebuilt = results_store.fitter(row, frequency, data, **fitter_kwds)
+            for name in results_store.parameter_names:
+                stored = results_store[name][row]
+                value = rebuilt.result.params[name].value
+                print("{:4d} {:24s} {:16.9g} {:16.9g}".format(row, name, stored, value))
+                assert np.isclose(value, stored, rtol=1e-12, atol=0), (row, name, stored, value)
+    finally:
+        suite.resonance_frequency = original_frequency
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
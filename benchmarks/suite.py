@@ -0,0 +1,324 @@
+"""
+Benchmark every fitter class on synthetic data generated from its own model combined with each background model,
+sweeping the number of points, the signal-to-noise ratio, and the quality factor. For each combination the suite records
+the wall time, the number of function evaluations, the peak memory allocated during one fit, and the accuracy of each
+best-fit parameter, and writes these to a JSON file so that results from different versions can be compared.
+
+Examples:
+  $ python -m benchmarks.suite --output before.json
+  $ python -m benchmarks.suite --fitters LinearShuntFitter KerrShuntFitter --sizes 100 10000 --output after.json
+  $ python -m benchmarks.suite --compare before.json after.json
+
+The transmission fitters fix the background model to MagnitudePhase, so they are run only with that background. The
+cost of the fits with nonlinear loss grows quickly with the number of points, so combinations with an expected cost
+larger than --max-cost, in the units of `resonator.batch.expected_cost`, are skipped.
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import traceback
+import tracemalloc
+from collections import namedtuple
+
+import lmfit
+import numpy as np
+import scipy
+
+from resonator import background, batch, kerr, kerr_loss, reflection, shunt, transmission
+
+resonance_frequency = 5e9
+background_magnitude = 0.8
+
+default_sizes = (100, 1000, 10000, 100000, 1000000)
+default_snrs = (10, 100, 1000)
+default_quality_factors = (1e4, 1e5, 1e6)
+default_max_cost = 1e7
+default_repeats = 3
+
+# The fraction of the Kerr input at bifurcation used for the Kerr models, which keeps the data below bifurcation.
+kerr_fraction = 0.5
+
+# One fitter class with the model used to generate its data; backgrounds is None if every background is used.
+Case = namedtuple('Case', ['fitter_class', 'foreground_class', 'backgrounds'])
+
+cases = [Case(shunt.LinearShuntFitter, shunt.LinearShunt, None),
+         Case(reflection.LinearReflectionFitter, reflection.LinearReflection, None),
+         Case(reflection.KnownLinearReflectionFitter, reflection.LinearReflection, ('Known',)),
+         Case(shunt.KerrShuntFitter, shunt.KerrShunt, None),
+         Case(reflection.KerrReflectionFitter, reflection.KerrReflection, None),
+         Case(reflection.KerrLossReflectionFitter, reflection.KerrLossReflection, None),
+         Case(transmission.CCxSTFitterKnownCoupling, transmission.LinearSymmetricTransmission, ('MagnitudePhase',)),
+         Case(transmission.CCxSTFitterKnownMagnitude, transmission.LinearSymmetricTransmission, ('MagnitudePhase',)),
+         Case(transmission.KerrSymmetricTransmissionFitter, transmission.KerrSymmetricTransmission,
+              ('MagnitudePhase',))]
+
+background_names = ['One', 'Phase', 'Magnitude', 'MagnitudePhase', 'MagnitudePhaseDelay',
+                    'MagnitudeSlopeOffsetPhaseDelay', 'Known']
+
+
+def frequency_array(num_points, quality_factor):
+    """Return frequencies spanning ten linewidths on each side of the resonance."""
+    return resonance_frequency * (1 + 10 / quality_factor * np.linspace(-1, 1, num_points))
+
+
+def foreground_params(foreground_class, quality_factor):
+    """Return a dict of the true foreground parameter values, with equal coupling and internal losses."""
+    coupling_loss = internal_loss = 1 / (2 * quality_factor)
+    values = {'resonance_frequency': resonance_frequency, 'coupling_loss': coupling_loss,
+              'internal_loss': internal_loss}
+    if issubclass(foreground_class, shunt.AbstractShunt):
+        values['asymmetry'] = 0.1
+    if foreground_class in (shunt.KerrShunt, reflection.KerrReflection, transmission.KerrSymmetricTransmission):
+        values['kerr_input'] = kerr_fraction * kerr.absolute_kerr_input_at_bifurcation(
+            coupling_loss=coupling_loss, internal_loss=internal_loss,
+            io_coupling_coefficient=foreground_class.io_coupling_coefficient)
+    if foreground_class is reflection.KerrLossReflection:
+        # Choose the input rate so that the linear photon number on resonance is one, then choose the Kerr shift and
+        # the nonlinear loss at that photon number to be fractions of the linewidth.
+        total_loss = coupling_loss + internal_loss
+        values['reduced_input_rate'] = total_loss ** 2 / (4 * foreground_class.io_coupling_coefficient * coupling_loss)
+        values['reduced_kerr'] = kerr_fraction * total_loss / 2
+        values['nonlinear_loss'] = 0.1 * total_loss
+    return values
+
+
+def background_params(frequency):
+    """Return a dict of the true values of the parameters of every background model."""
+    span = frequency.max() - frequency.min()
+    return {'magnitude': background_magnitude, 'phase': 0.5, 'delay': 1e-9, 'frequency_reference': frequency.mean(),
+            'magnitude_offset': background_magnitude, 'magnitude_slope': 0.05 * background_magnitude / span}
+
+
+def synthetic_data(case, background_name, num_points, snr, quality_factor, seed=0):
+    """
+    Return (frequency, data, true values, fitter keywords) for the given case, where the noise in each quadrature has
+    standard deviation equal to the background magnitude divided by the signal-to-noise ratio.
+    """
+    frequency = frequency_array(num_points=num_points, quality_factor=quality_factor)
+    choose_kwds = {}
+    if case.foreground_class in (shunt.KerrShunt, reflection.KerrReflection, transmission.KerrSymmetricTransmission):
+        choose_kwds['choose'] = np.max
+    elif case.foreground_class is reflection.KerrLossReflection:
+        choose_kwds['choose'] = kerr_loss.choose_min
+    foreground_model = case.foreground_class(**choose_kwds)
+    true_values = foreground_params(foreground_class=case.foreground_class, quality_factor=quality_factor)
+    all_background_values = background_params(frequency=frequency)
+    fitter_kwds = {}
+    if background_name == 'Known':
+        background_model = background.MagnitudePhaseDelay()
+        measurement_frequency = np.linspace(frequency.min(), frequency.max(), 1001)
+        measurement_data = background_model.eval(
+            params=background_model.make_params(**_select(background_model, all_background_values)),
+            frequency=measurement_frequency)
+        background_model = background.Known(measurement_frequency=measurement_frequency,
+                                            measurement_data=measurement_data)
+        if case.fitter_class is reflection.KnownLinearReflectionFitter:
+            fitter_kwds['background_frequency'] = measurement_frequency
+            fitter_kwds['background_data'] = measurement_data * reflection.LinearReflection.reference_point
+        else:
+            fitter_kwds['background_model'] = background_model
+    else:
+        background_model = getattr(background, background_name)()
+        true_values.update(_select(background_model, all_background_values))
+        if case.fitter_class is transmission.CCxSTFitterKnownCoupling:
+            fitter_kwds['coupling_loss'] = true_values['coupling_loss']
+        elif case.fitter_class in (transmission.CCxSTFitterKnownMagnitude,
+                                   transmission.KerrSymmetricTransmissionFitter):
+            fitter_kwds['background_magnitude'] = true_values['magnitude']
+        else:
+            fitter_kwds['background_model'] = background_model
+    params = foreground_model.make_params(**_select(foreground_model, true_values))
+    params.update(background_model.make_params(**_select(background_model, true_values)))
+    data = (background_model.eval(params=params, frequency=frequency)
+            * foreground_model.eval(params=params, frequency=frequency))
+    random = np.random.RandomState(seed)
+    noise = background_magnitude / snr
+    data = data + noise * (random.randn(num_points) + 1j * random.randn(num_points))
+    return frequency, data, true_values, fitter_kwds
+
+
+def _select(model, values):
+    return dict((name, values[name]) for name in model.param_names if name in values)
+
+
+def accuracy(params, true_values):
+    """
+    Return a dict that contains, for each varying parameter with a known true value, the true and best-fit values, the
+    standard error, the relative error, and the pull, which is the error divided by the standard error.
+    """
+    result = {}
+    for name, p in params.items():
+        if not p.vary or name not in true_values:
+            continue
+        true = true_values[name]
+        stderr = p.stderr if p.stderr else None
+        result[name] = {'true': true,
+                        'fit': p.value,
+                        'stderr': stderr,
+                        'relative_error': abs(p.value - true) / abs(true) if true else abs(p.value),
+                        'pull': None if stderr is None else (p.value - true) / stderr}
+    return result
+
+
+def benchmark_one(case, background_name, num_points, snr, quality_factor, repeats):
+    """Return a dict containing the results of one combination of settings."""
+    record = {'fitter': case.fitter_class.__name__, 'foreground_model': case.foreground_class.__name__,
+              'background_model': background_name, 'num_points': num_points, 'snr': snr,
+              'quality_factor': quality_factor, 'repeats': repeats, 'error': None, 'error_summary': None}
+    try:
+        frequency, data, true_values, fitter_kwds = synthetic_data(
+            case=case, background_name=background_name, num_points=num_points, snr=snr,
+            quality_factor=quality_factor)
+        times = []
+        fitter = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fitter = case.fitter_class(frequency=frequency, data=data, **fitter_kwds)
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            case.fitter_class(frequency=frequency, data=data, **fitter_kwds)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        params_accuracy = accuracy(params=fitter.result.params, true_values=true_values)
+        pulls = [abs(a['pull']) for a in params_accuracy.values() if a['pull'] is not None]
+        record.update({'time_min': min(times), 'time_median': float(np.median(times)), 'nfev': int(fitter.result.nfev),
+                       'peak_memory': int(peak), 'success': bool(fitter.result.success),
+                       'chisqr': float(fitter.result.chisqr), 'redchi': float(fitter.result.redchi),
+                       'max_abs_pull': max(pulls) if pulls else None, 'accuracy': params_accuracy})
+    except Exception as e:
+        record['error'] = traceback.format_exc()
+        record['error_summary'] = '{}: {}'.format(e.__class__.__name__, (str(e).strip().splitlines() or [''])[0])
+    return record
+
+
+def run(fitter_names=None, backgrounds=None, sizes=default_sizes, snrs=default_snrs,
+        quality_factors=default_quality_factors, repeats=default_repeats, max_cost=default_max_cost, verbose=True):
+    """
+    Run the benchmarks for every combination of the given settings and return a list of records; names that are None
+    select every fitter class or background model.
+    """
+    records = []
+    for case in cases:
+        if fitter_names is not None and case.fitter_class.__name__ not in fitter_names:
+            continue
+        for background_name in background_names:
+            if case.backgrounds is not None and background_name not in case.backgrounds:
+                continue
+            if backgrounds is not None and background_name not in backgrounds:
+                continue
+            for num_points in sizes:
+                if batch.expected_cost(case.fitter_class, num_points) > max_cost:
+                    continue
+                for snr in snrs:
+                    for quality_factor in quality_factors:
+                        record = benchmark_one(case=case, background_name=background_name, num_points=num_points,
+                                               snr=snr, quality_factor=quality_factor, repeats=repeats)
+                        records.append(record)
+                        if verbose:
+                            print(format_record(record))
+                            sys.stdout.flush()
+    return records
+
+
+def format_record(record):
+    settings = "{:36s} {:32s} {:8d} {:6g} {:6g}".format(record['fitter'], record['background_model'],
+                                                       record['num_points'], record['snr'], record['quality_factor'])
+    if record['error'] is not None:
+        return settings + " error: " + record['error_summary']
+    return settings + " {:10.4f} s {:5d} nfev {:10.1f} MB pull {}".format(
+        record['time_min'], record['nfev'], record['peak_memory'] / 1e6,
+        'n/a' if record['max_abs_pull'] is None else '{:.2f}'.format(record['max_abs_pull']))
+
+
+def environment():
+    """Return a dict describing the versions of the software used to run the benchmarks."""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'date': datetime.datetime.now().isoformat(), 'commit': commit, 'python': platform.python_version(),
+            'platform': platform.platform(), 'numpy': np.__version__, 'scipy': scipy.__version__,
+            'lmfit': lmfit.__version__}
+
+
+def key(record):
+    return (record['fitter'], record['background_model'], record['num_points'], record['snr'],
+            record['quality_factor'])
+
+
+def compare(old, new, threshold=1.2):
+    """
+    Print the ratios of the times and peak memory of the combinations present in both of the given benchmark outputs,
+    marking ratios above the threshold, and return a list of (key, quantity, ratio) tuples for the regressions. A
+    combination that succeeded before and now fails or raises an exception is also a regression.
+    """
+    old_records = dict((key(record), record) for record in old['results'])
+    regressions = []
+    for record in new['results']:
+        k = key(record)
+        if k not in old_records:
+            continue
+        before = old_records[k]
+        if before['error'] is not None:
+            continue
+        if record['error'] is not None:
+            regressions.append((k, 'error', None))
+            print("{} now raises an exception".format(k))
+            continue
+        if before['success'] and not record['success']:
+            regressions.append((k, 'success', None))
+        ratios = {'time': record['time_min'] / before['time_min'],
+                  'memory': record['peak_memory'] / max(before['peak_memory'], 1),
+                  'nfev': record['nfev'] / max(before['nfev'], 1)}
+        flags = []
+        for quantity, ratio in sorted(ratios.items()):
+            if ratio > threshold:
+                regressions.append((k, quantity, ratio))
+                flags.append(quantity)
+        print("{:36s} {:32s} {:8d} {:6g} {:6g} time x{:.2f} memory x{:.2f} nfev x{:.2f} {}".format(
+            *(k + (ratios['time'], ratios['memory'], ratios['nfev'], ' '.join('REGRESSION: ' + f for f in flags)))))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--fitters', nargs='+', help="fitter class names; the default is every fitter")
+    parser.add_argument('--backgrounds', nargs='+', choices=background_names,
+                        help="background model names; the default is every background")
+    parser.add_argument('--sizes', nargs='+', type=int, default=default_sizes)
+    parser.add_argument('--snrs', nargs='+', type=float, default=default_snrs)
+    parser.add_argument('--qs', nargs='+', type=float, default=default_quality_factors)
+    parser.add_argument('--repeats', type=int, default=default_repeats)
+    parser.add_argument('--max-cost', type=float, default=default_max_cost)
+    parser.add_argument('--output', help="the path of the JSON output file")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two JSON output files")
+    parser.add_argument('--threshold', type=float, default=1.2, help="the ratio above which --compare reports a "
+                                                                     "regression")
+    args = parser.parse_args(argv)
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        return 1 if compare(old=old, new=new, threshold=args.threshold) else 0
+    np.seterr(all='ignore')
+    settings = {'fitters': args.fitters, 'backgrounds': args.backgrounds, 'sizes': args.sizes, 'snrs': args.snrs,
+                'quality_factors': args.qs, 'repeats': args.repeats, 'max_cost': args.max_cost}
+    records = run(fitter_names=args.fitters, backgrounds=args.backgrounds, sizes=args.sizes, snrs=args.snrs,
+                  quality_factors=args.qs, repeats=args.repeats, max_cost=args.max_cost)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'settings': settings, 'results': records}, f, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -20,6 +20,10 @@ class One(base.BackgroundModel):
 
         super(One, self).__init__(func=one, *args, **kwds)
 
+    @staticmethod
+    def derivatives(frequency):
+        return {}
+
 
 class Phase(base.BackgroundModel):
     """
@@ -35,16 +39,24 @@ class Phase(base.BackgroundModel):
 
         super(Phase, self).__init__(func=phase, *args, **kwds)
 
-    def guess(self, data, frequency, fraction=0.1, **kwds):
+    @staticmethod
+    def derivatives(frequency, phase):
+        return {'phase': 1j * np.ones_like(frequency) * np.exp(1j * phase)}
+
+    def guess(self, data, frequency, fraction=0.1, features=None, **kwds):
         """
         :param data: complex scattering parameter data.
         :param fraction: the fraction of points with lowest nearest-neighbor distances to use to estimate the phase.
+        :param features: None, or a `guess.Features` object for the data, or for the data multiplied by a constant, that
+          supplies the nearest-neighbor distances.
         :param kwds: ignored, for now
         :return: lmfit.Parameters
         """
         params = self.make_params()
         # Use the points with smallest nearest-neighbor distances per frequency difference
-        indices = guess.smallest(guess.distances_per_frequency(frequency=frequency, data=data), fraction=fraction)
+        if features is None:
+            features = guess.Features(frequency=frequency, data=data)
+        indices = guess.smallest(features.distances_per_frequency, fraction=fraction)
         median = np.median(data[indices].real) + 1j * np.median(data[indices].imag)
         params['phase'].value = np.angle(median)
         return params
@@ -64,15 +76,19 @@ class Magnitude(base.BackgroundModel):
 
         super(Magnitude, self).__init__(func=magnitude, *args, **kwds)
 
-    def guess(self, data, fraction=0.1, **kwds):
+    def guess(self, data, fraction=0.1, features=None, **kwds):
         """
         :param data: complex scattering parameter data.
         :param fraction: the fraction of points with lowest nearest-neighbor distances to use to estimate the magnitude.
+        :param features: None, or a `guess.Features` object for the data, or for the data multiplied by a constant, that
+          supplies the nearest-neighbor distances.
         :param kwds: ignored, for now
         :return: lmfit.Parameters
         """
         params = self.make_params()
-        indices = guess.smallest(guess.distances(data), fraction=fraction)
+        if features is None:
+            features = guess.Features(frequency=None, data=data)
+        indices = guess.smallest(features.distances, fraction=fraction)
         median = np.median(data[indices].real) + 1j * np.median(data[indices].imag)
         params['magnitude'].value = np.abs(median)
         return params
@@ -98,7 +114,27 @@ class MagnitudePhase(base.BackgroundModel):
 
         super(MagnitudePhase, self).__init__(func=magnitude_phase, *args, **kwds)
 
-    def guess(self, data, frequency, fraction=0.1, **kwds):
+    @staticmethod
+    def derivatives(frequency, magnitude, phase):
+        unit = np.exp(1j * phase) * np.ones_like(frequency)
+        return {'magnitude': unit,
+                'phase': 1j * magnitude * unit}
+
+    # The model is the complex gain magnitude * exp(1j * phase), so it is linear in the real and imaginary parts of the
+    # gain; see base.BackgroundModel.linear_names.
+    linear_names = ('magnitude', 'phase')
+
+    @staticmethod
+    def linear_basis(frequency, magnitude, phase):
+        one = np.ones_like(frequency, dtype='complex')
+        return [one, 1j * one]
+
+    @staticmethod
+    def linear_params(coefficients, magnitude, phase):
+        gain = coefficients[0] + 1j * coefficients[1]
+        return {'magnitude': np.abs(gain), 'phase': np.angle(gain)}
+
+    def guess(self, data, frequency, fraction=0.1, features=None, **kwds):
         """
         This function should calculate very good inital values for configurations in which the transmission far from
         resonance is nonzero, such as the shunt and reflection configurations. It will underestimate the magnitude for
@@ -110,12 +146,16 @@ class MagnitudePhase(base.BackgroundModel):
         :param fraction: the fraction of points to use when estimating the background magnitude; it should be large
           enough that any spurious high-magnitude points do not bias the median; for transmission resonators it should
           be small enough that points far from the peak are not included.
+        :param features: None, or a `guess.Features` object for the data, or for the data multiplied by a constant, that
+          supplies the nearest-neighbor distances.
         :param kwds: currently ignored.
         :return: lmfit.Parameters
         """
         params = self.make_params()
         # Use the points with smallest nearest-neighbor distances per frequency difference
-        indices = guess.smallest(guess.distances_per_frequency(frequency=frequency, data=data), fraction=fraction)
+        if features is None:
+            features = guess.Features(frequency=frequency, data=data)
+        indices = guess.smallest(features.distances_per_frequency, fraction=fraction)
         median = np.median(data[indices].real) + 1j * np.median(data[indices].imag)
         params['magnitude'].set(value=np.abs(median), min=0)
         params['phase'].value = np.angle(median)
@@ -143,11 +183,35 @@ class MagnitudePhaseDelay(base.BackgroundModel):
 
         super(MagnitudePhaseDelay, self).__init__(func=magnitude_phase_delay, *args, **kwds)
 
-    def guess(self, data, frequency, fraction=0.1, **kwds):
+    @staticmethod
+    def derivatives(frequency, frequency_reference, magnitude, phase, delay):
+        unit = np.exp(1j * (2 * np.pi * (frequency - frequency_reference) * delay + phase))
+        return {'frequency_reference': -2j * np.pi * delay * magnitude * unit,
+                'magnitude': unit,
+                'phase': 1j * magnitude * unit,
+                'delay': 2j * np.pi * (frequency - frequency_reference) * magnitude * unit}
+
+    # The model is linear in the real and imaginary parts of the complex gain magnitude * exp(1j * phase); see
+    # base.BackgroundModel.linear_names.
+    linear_names = ('magnitude', 'phase')
+
+    @staticmethod
+    def linear_basis(frequency, frequency_reference, magnitude, phase, delay):
+        unit = np.exp(2j * np.pi * (frequency - frequency_reference) * delay)
+        return [unit, 1j * unit]
+
+    @staticmethod
+    def linear_params(coefficients, frequency_reference, magnitude, phase, delay):
+        gain = coefficients[0] + 1j * coefficients[1]
+        return {'magnitude': np.abs(gain), 'phase': np.angle(gain)}
+
+    def guess(self, data, frequency, fraction=0.1, features=None, **kwds):
         """
         :param data: complex scattering parameter data.
         :param frequency: the frequencies corresponding to the data points.
         :param fraction: the fraction of points with lowest nearest-neighbor distances to use to estimate the magnitude.
+        :param features: None, or a `guess.Features` object for the data, or for the data multiplied by a constant, that
+          supplies the nearest-neighbor distances.
         :param kwds: ignored, for now.
         :return: lmfit.Parameters
         """
@@ -155,7 +219,9 @@ class MagnitudePhaseDelay(base.BackgroundModel):
         frequency_reference = frequency.mean()
         params['frequency_reference'].set(value=frequency_reference, vary=False)
         # Use the points with smallest nearest-neighbor distances per frequency difference
-        indices = guess.smallest(guess.distances_per_frequency(frequency=frequency, data=data), fraction=fraction)
+        if features is None:
+            features = guess.Features(frequency=frequency, data=data)
+        indices = guess.smallest(features.distances_per_frequency, fraction=fraction)
         phase, delay = guess.polyfit_phase_delay(frequency=frequency[indices] - frequency_reference, data=data[indices])
         params['phase'].set(value=phase)
         params['delay'].set(value=delay)
@@ -188,11 +254,42 @@ class MagnitudeSlopeOffsetPhaseDelay(base.BackgroundModel):
 
         super(MagnitudeSlopeOffsetPhaseDelay, self).__init__(func=magnitude_slope_offset_phase_delay, *args, **kwds)
 
-    def guess(self, data, frequency, fraction=0.1, **kwds):
+    @staticmethod
+    def derivatives(frequency, frequency_reference, magnitude_slope, magnitude_offset, phase, delay):
+        unit = np.exp(1j * (2 * np.pi * (frequency - frequency_reference) * delay + phase))
+        magnitude = magnitude_offset + magnitude_slope * (frequency - frequency_reference)
+        return {'frequency_reference': -(magnitude_slope + 2j * np.pi * delay * magnitude) * unit,
+                'magnitude_slope': (frequency - frequency_reference) * unit,
+                'magnitude_offset': unit,
+                'phase': 1j * magnitude * unit,
+                'delay': 2j * np.pi * (frequency - frequency_reference) * magnitude * unit}
+
+    # The model is linear in the magnitude slope and offset; see base.BackgroundModel.linear_names.
+    linear_names = ('magnitude_slope', 'magnitude_offset')
+
+    @staticmethod
+    def linear_basis(frequency, frequency_reference, magnitude_slope, magnitude_offset, phase, delay):
+        unit = np.exp(1j * (2 * np.pi * (frequency - frequency_reference) * delay + phase))
+        return [(frequency - frequency_reference) * unit, unit]
+
+    @staticmethod
+    def linear_params(coefficients, frequency_reference, magnitude_slope, magnitude_offset, phase, delay):
+        """
+        Return the slope and offset; if the offset is negative, the signs of both are reversed and the phase is shifted
+        by pi, which does not change the model, so that the offset satisfies the bound set by guess().
+        """
+        slope, offset = coefficients
+        if offset < 0:
+            return {'magnitude_slope': -slope, 'magnitude_offset': -offset, 'phase': np.angle(-np.exp(1j * phase))}
+        return {'magnitude_slope': slope, 'magnitude_offset': offset}
+
+    def guess(self, data, frequency, fraction=0.1, features=None, **kwds):
         """
         :param data: complex scattering parameter data.
         :param frequency: the frequencies corresponding to the data points.
         :param fraction: the fraction of points with lowest nearest-neighbor distances to use to estimate the magnitude.
+        :param features: None, or a `guess.Features` object for the data, or for the data multiplied by a constant, that
+          supplies the nearest-neighbor distances.
         :param kwds: ignored, for now.
         :return: lmfit.Parameters
         """
@@ -200,7 +297,9 @@ class MagnitudeSlopeOffsetPhaseDelay(base.BackgroundModel):
         frequency_reference = frequency.mean()
         params['frequency_reference'].set(value=frequency_reference, vary=False)
         # Use the points with smallest nearest-neighbor distances per frequency difference
-        indices = guess.smallest(guess.distances_per_frequency(frequency=frequency, data=data), fraction=fraction)
+        if features is None:
+            features = guess.Features(frequency=frequency, data=data)
+        indices = guess.smallest(features.distances_per_frequency, fraction=fraction)
         phase, delay = guess.polyfit_phase_delay(frequency=frequency[indices] - frequency_reference, data=data[indices])
         params['phase'].set(value=phase)
         params['delay'].set(value=delay)
@@ -223,12 +322,26 @@ class Known(base.BackgroundModel):
     so the measured background data should be multiplied by -1 before being passed to this class. In the transmission
     case, the background could be measured either using switches to bypass the resonator or during a separate
     measurement.
+
+    The model has no parameters, so its values depend only on the frequency array, which is the same object in every
+    evaluation during a fit. The interpolated values for the last frequency array are stored and returned as a read-only
+    array until the model is evaluated at a different array, so the measured background is searched only once per fit.
     """
 
     def __init__(self, measurement_frequency, measurement_data, *args, **kwds):
+        def interpolate(frequency):
+            values = np.interp(frequency, measurement_frequency, measurement_data)
+            if isinstance(values, np.ndarray):
+                values.flags.writeable = False
+            return values
+
+        interpolate_last = base.LastEvaluation(interpolate)
+
         def known(frequency):
-            data_real = np.interp(frequency, measurement_frequency, measurement_data.real)
-            data_imag = np.interp(frequency, measurement_frequency, measurement_data.imag)
-            return data_real + 1j * data_imag
+            return interpolate_last(frequency)
 
         super(Known, self).__init__(func=known, *args, **kwds)
+
+    @staticmethod
+    def derivatives(frequency):
+        return {}
@@ -3,11 +3,16 @@ This module contains base classes
 """
 from __future__ import absolute_import, division, print_function
 from collections import namedtuple
+from copy import deepcopy
+from types import MappingProxyType
 
 import lmfit
 import numpy as np
 from scipy.constants import h, pi
 
+from . import chunked, lean
+from .guess import Features
+
 
 class ResonatorModel(lmfit.model.Model):
 
@@ -15,17 +20,152 @@ class ResonatorModel(lmfit.model.Model):
 
     io_coupling_coefficient = None
 
+    # Subclasses with closed-form derivatives should replace this with a static method that has the same signature as
+    # the model function and returns a dict that maps each parameter name to the partial derivative of the model;
+    # models whose function is a closure created in __init__, such as the Kerr models, assign a closure instead.
+    derivatives = None
+
     def guess(self, data, frequency, **kwds):
         """Subclasses should implement a guess function that returns reasonable initial values for the fit."""
         return self.make_params()
 
+    def gradient(self, params, frequency):
+        """
+        Return a dict that maps each parameter name to the partial derivative of the model with respect to that
+        parameter, evaluated at the given frequencies, or None if the model does not implement `derivatives`.
+
+        :param params: a lmfit.parameter.Parameters object containing the parameter values.
+        :param frequency: float or array of floats.
+        :return: dict or None
+        """
+        return _gradient(model=self, params=params, frequency=frequency)
+
 
 class BackgroundModel(lmfit.model.Model):
 
+    # See ResonatorModel.derivatives.
+    derivatives = None
+
+    # Subclasses in which some parameters enter the model linearly can set this to a tuple of their names and implement
+    # the static methods linear_basis(frequency, **parameters), which returns a list of complex arrays whose linear
+    # combination with real coefficients is the model, and linear_params(coefficients, **parameters), which returns a
+    # dict of the parameter values that correspond to the coefficients. The lean engine uses these to eliminate the
+    # linear parameters from the nonlinear search; see lean.fit().
+    linear_names = None
+
     def guess(self, data, frequency, **kwds):
         """Subclasses should implement a guess function that returns reasonable initial values for the fit."""
         return self.make_params()
 
+    def gradient(self, params, frequency):
+        """See ResonatorModel.gradient."""
+        return _gradient(model=self, params=params, frequency=frequency)
+
+
+def _gradient(model, params, frequency):
+    if model.derivatives is None:
+        return None
+    derivatives = model.derivatives(**model.make_funcargs(params=params, kwargs={'frequency': frequency}))
+    return {model.prefix + name: value for name, value in derivatives.items()}
+
+
+class LastEvaluation(object):
+    """
+    This class wraps a function of frequency and scalar parameters and stores its value for the last arguments, so that
+    a model function and its derivatives that are evaluated with the same parameters during a fit share one expensive
+    calculation, such as the root solve of a nonlinear model. The frequency must be the same object, which it is during
+    a fit; if any parameter is an array, the function is always called.
+    """
+
+    def __init__(self, function):
+        """
+        :param function: a function called as function(frequency, *parameters).
+        """
+        self.function = function
+        self.frequency = None
+        self.parameters = None
+        self.value = None
+
+    def __call__(self, frequency, *parameters):
+        if any(np.ndim(parameter) for parameter in parameters):
+            return self.function(frequency, *parameters)
+        if frequency is not self.frequency or parameters != self.parameters:
+            self.value = self.function(frequency, *parameters)
+            self.frequency = frequency
+            self.parameters = parameters
+        return self.value
+
+
+# See _residual_convention()
+_lmfit_residual_convention = []
+
+
+def _residual_convention():
+    """
+    Return (sign, complex_weights) that describe the residual calculated by lmfit.model.Model._residual for complex
+    data: the residual is sign * (data - model) multiplied by the weights either as complex numbers, if complex_weights
+    is True, or separately for the real and imaginary parts, if it is False. This differs between versions of lmfit, so
+    it is determined once by calculating the residual of a trivial model.
+    """
+    if not _lmfit_residual_convention:
+        def trivial(x, a):
+            return a * (1 + 1j) * np.ones_like(x)
+
+        model = lmfit.model.Model(trivial)
+        residual = np.asarray(model._residual(params=model.make_params(a=1), data=np.zeros(1, dtype='complex'),
+                                              weights=np.array([1 + 2j]), x=np.zeros(1))).view('float')
+        # The residual is [1, -3] for complex weights and [-1, -2] for separate weights, and the signs are reversed if
+        # the residual is model - data.
+        complex_weights = abs(residual[1]) > 2.5
+        if complex_weights:
+            sign = np.sign(residual[0])
+        else:
+            sign = -np.sign(residual[0])
+        _lmfit_residual_convention.extend([sign, complex_weights])
+    return tuple(_lmfit_residual_convention)
+
+
+class ParameterSnapshot(object):
+    """
+    This class is an immutable record of the values and standard errors of a set of lmfit Parameters. The `values` and
+    `errors` attributes are read-only mappings from parameter name to value and standard error.
+
+    Reading a value from a lmfit.parameter.Parameters object involves several layers of Python attribute access, which
+    dominates the time needed to tabulate derived quantities such as quality factors from many fits. The fitters take
+    one snapshot after each fit and read every best-fit value and standard error from it.
+    """
+
+    __slots__ = ('names', 'values', 'errors')
+
+    def __init__(self, params):
+        """
+        :param params: a lmfit.parameter.Parameters object.
+        """
+        names = tuple(params.keys())
+        object.__setattr__(self, 'names', names)
+        object.__setattr__(self, 'values', MappingProxyType(dict((name, params[name].value) for name in names)))
+        object.__setattr__(self, 'errors', MappingProxyType(dict((name, params[name].stderr) for name in names)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ParameterSnapshot objects are immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError("ParameterSnapshot objects are immutable.")
+
+    def __getstate__(self):
+        # MappingProxyType objects cannot be pickled, so pickle the underlying dicts.
+        return self.names, dict(self.values), dict(self.errors)
+
+    def __setstate__(self, state):
+        names, values, errors = state
+        object.__setattr__(self, 'names', names)
+        object.__setattr__(self, 'values', MappingProxyType(values))
+        object.__setattr__(self, 'errors', MappingProxyType(errors))
+
+    def __repr__(self):
+        return "ParameterSnapshot({})".format(', '.join('{}={!r}'.format(name, self.values[name])
+                                                          for name in self.names))
+
 
 class ResonatorFitter(object):
     """
@@ -34,10 +174,16 @@ class ResonatorFitter(object):
     configurations.
     """
 
-    def __init__(self, frequency, data, foreground_model, background_model, errors=None, params=None, **fit_kwds):
+    def __init__(self, frequency, data, foreground_model, background_model, errors=None, params=None,
+                 analytic_jacobian=True, lazy=False, engine='lmfit', projection=False, **fit_kwds):
         """
         Fit the given data using the given models for the foreground and background.
 
+        If lazy is True, the fit is deferred until the first access of `result`, which includes access of any of the
+        best-fit parameters or derived quantities. This allows fitters to be created cheaply and their settings, such as
+        `errors` or `analytic_jacobian`, to be changed before fitting. The deferred fit uses the `params` and `fit_kwds`
+        given here; calling fit() explicitly before then replaces the deferred fit.
+
         :param frequency: an array of floats containing the frequencies at which the data was measured.
         :param data: an array of complex numbers containing the data, probably forward transmission S_{21} or forward
           reflection S_{11}.
@@ -51,8 +197,21 @@ class ResonatorFitter(object):
           to exclude a point, set the errors to (1 + 1j) * np.inf for that point.
         :param params: a lmfit.parameter.Parameters object containing Parameters to use as initial values for the fit;
         these are passed to fit() and will overwrite Parameters with the same names obtained from guess().
+        :param analytic_jacobian: if True and both models implement `derivatives`, fit() passes the analytic Jacobian of
+          the residual to the minimizer instead of letting it calculate the Jacobian using finite differences.
+        :param lazy: if True, defer the fit until `result` is first accessed; see above.
+        :param engine: 'lmfit' to fit using lmfit.model.Model.fit(), or 'lean' to fit using lean.fit(), which calls
+          scipy.optimize.least_squares directly and produces a lean.LeanResult with the same parameter names, values,
+          and standard errors; the lean engine is faster but does not support parameters constrained by expressions.
+          Use 'chunked' to fit data that does not fit in memory, such as np.memmap arrays, using chunked.fit(), which
+          reads the data in chunks and guesses the initial values from block averages of the data; see `chunked`.
+        :param projection: if True, the lean engine eliminates the parameters of the background model that enter the
+          model linearly, such as the complex gain of background.MagnitudePhase, from the nonlinear search using
+          variable projection, so the minimizer varies only the other parameters; see lean.fit(). This requires
+          engine='lean', and it has no effect if the background model has no linear parameters or one of them is fixed.
         :param fit_kwds: keyword arguments passed directly to lmfit.model.Model.fit(), except for params, as explained
-          above; see the lmfit documentation.
+          above; see the lmfit documentation. If engine='lean' or 'chunked', these are passed to lean.fit() or
+          chunked.fit() instead.
         """
         if not np.iscomplexobj(data):
             raise TypeError("Resonator data must be complex.")
@@ -61,20 +220,136 @@ class ResonatorFitter(object):
         self.frequency = frequency
         self.data = data
         self.errors = errors
+        if engine not in ('lmfit', 'lean', 'chunked'):
+            raise ValueError("Unknown engine: {}".format(engine))
+        if projection and engine != 'lean':
+            raise ValueError("Variable projection requires engine='lean'.")
+        self.analytic_jacobian = analytic_jacobian
+        self.engine = engine
+        self.projection = projection
         self.model = background_model * foreground_model  # lmfit.model.CompositeModel
-        self.result = None  # This is updated immediately by the next line
-        self.fit(params=params, **fit_kwds)
+        self._result = None
+        self._deferred_fit = None
+        self._snapshot = None
+        self._cache = {}
+        if lazy:
+            fit_kwds['params'] = params
+            self._deferred_fit = fit_kwds
+        else:
+            self.fit(params=params, **fit_kwds)
+
+    @classmethod
+    def from_params(cls, params, frequency, data, **kwds):
+        """
+        Return a fitter for the given data that uses the given parameters, typically the stored best-fit parameters of
+        an earlier fit to the same data, as its result without running the minimizer.
+
+        The returned fitter can be used exactly like one that has been fit: the best-fit parameters, their standard
+        errors, and the derived quantities are taken from the given parameters, and the evaluation, residual,
+        inversion, and plotting functions all use them. The fit statistics in `result`, such as chisqr, are calculated
+        from the data, while `result.nfev` is zero and `result.init_params` is a copy of the given parameters.
+
+        :param params: a lmfit.parameter.Parameters object containing a value, and optionally a standard error, for
+          every parameter of the model.
+        :param frequency: an array of floats containing the frequencies at which the data was measured.
+        :param data: an array of complex numbers containing the data.
+        :param kwds: keywords passed directly to the fitter class, such as `background_model` or `errors`.
+        :return: an instance of the class on which this method is called.
+        """
+        fitter = cls(frequency=frequency, data=data, lazy=True, **kwds)
+        fitter.result = fitter.result_from_params(params=params)
+        return fitter
+
+    def result_from_params(self, params):
+        """
+        Return a lmfit.model.ModelResult for this fitter's model and data that contains the given parameters as its
+        best-fit parameters, without running the minimizer; see from_params().
+
+        :param params: a lmfit.parameter.Parameters object containing every parameter of the model.
+        :return: lmfit.model.ModelResult
+        """
+        missing = [name for name in self.model.param_names if name not in params]
+        if missing:
+            raise ValueError("Missing parameters: {}".format(', '.join(missing)))
+        params = deepcopy(params)
+        result = lmfit.model.ModelResult(self.model, params, data=self.data, weights=self.weights,
+                                         fcn_kws={'frequency': self.frequency})
+        result.init_params = deepcopy(params)
+        result.var_names = [name for name, p in params.items() if p.vary and p.expr is None]
+        result.nvarys = len(result.var_names)
+        result.nfev = 0
+        result.residual = np.asarray(self.model._residual(params=params, data=self.data, weights=self.weights,
+                                                          frequency=self.frequency)).view('float')
+        result.ndata = result.residual.size
+        result.nfree = result.ndata - result.nvarys
+        result.chisqr = np.sum(result.residual ** 2)
+        result.redchi = result.chisqr / max(result.nfree, 1)
+        neg2_log_likelihood = result.ndata * np.log(max(result.chisqr, 1e-250) / result.ndata)
+        result.aic = neg2_log_likelihood + 2 * result.nvarys
+        result.bic = neg2_log_likelihood + np.log(result.ndata) * result.nvarys
+        result.init_fit = result.best_fit = self.model.eval(params=params, frequency=self.frequency)
+        result.success = True
+        result.message = 'Result created from stored parameters without fitting.'
+        return result
+
+    @property
+    def result(self):
+        """
+        The lmfit.model.ModelResult object of the most recent fit; if the fit was deferred by creating this fitter with
+        lazy=True, the first access runs the fit.
+        """
+        if self._result is None and self._deferred_fit is not None:
+            self.fit(**self._deferred_fit)
+        return self._result
+
+    @result.setter
+    def result(self, result):
+        self._result = result
+        self._deferred_fit = None
+        self._snapshot = None
+        self._cache.clear()
+
+    @property
+    def snapshot(self):
+        """
+        A ParameterSnapshot of the best-fit parameter values and standard errors, taken once after each fit. The
+        best-fit parameters, their errors, and all of the derived quantities are read from this snapshot, so changes
+        made directly to self.result.params after a fit are not reflected in these attributes.
+        """
+        if self._snapshot is None:
+            self._snapshot = ParameterSnapshot(self.result.params)
+        return self._snapshot
+
+    def _cached(self, name, calculate):
+        """
+        Return the array returned by calculate(), which must depend only on self.frequency, self.data, and self.result.
+        The array is calculated once and then returned from the cache until one of these attributes is replaced; the
+        cache is also cleared by each fit. Cached arrays are read-only because they are shared between calls.
+        """
+        key = (self.result, self.frequency, self.data)
+        if name in self._cache:
+            cached_key, value = self._cache[name]
+            if all(new is old for new, old in zip(key, cached_key)):
+                return value
+        value = np.asarray(calculate())
+        value.flags.writeable = False
+        self._cache[name] = (key, value)
+        return value
 
     def __getattr__(self, attr):
+        # Private attributes are never parameters; this also prevents recursion before __init__ has set _result, or if
+        # one of the properties used below raises AttributeError.
+        if attr.startswith('_') or attr in ('result', 'snapshot'):
+            raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, attr))
         if attr.endswith('_error'):
             name = attr[:-len('_error')]
             try:
-                return self.result.params[name].stderr
+                return self.snapshot.errors[name]
             except KeyError:
                 raise AttributeError("Couldn't find error for {} in self.result".format(name))
         else:
             try:
-                return self.result.params[attr].value
+                return self.snapshot.values[attr]
             except KeyError:
                 raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, attr))
 
@@ -127,26 +402,123 @@ class ResonatorFitter(object):
         :return: lmfit.parameter.Parameters
         """
         # The signature of lmfit.model.Model.guess is guess(data, **kwds)
-        guess = self.background_model.guess(data=data / self.foreground_model.reference_point, frequency=frequency)
+        # The nearest-neighbor distances and the smoothed data are calculated once and shared by both guesses; dividing
+        # the data by the constant reference point does not change the ranking of the distances.
+        features = Features(frequency=frequency, data=data)
+        guess = self.background_model.guess(data=data / self.foreground_model.reference_point, frequency=frequency,
+                                            features=features)
         background_guess = self.background_model.eval(params=guess, frequency=frequency)
-        guess.update(self.foreground_model.guess(data=data / background_guess, frequency=frequency))
+        guess.update(self.foreground_model.guess(data=data / background_guess, frequency=frequency,
+                                                 features=features.divide(background_guess)))
         return guess
 
+    def initial_params(self, params=None):
+        """
+        Return the parameters that fit() uses as initial values: those obtained from self.guess(), overwritten by the
+        given parameters. If the given parameters include every model parameter then self.guess() is not called and the
+        given object itself is returned.
+
+        :param params: None or a lmfit.parameter.Parameters object.
+        :return: lmfit.parameter.Parameters
+        """
+        if params is not None and all(name in params for name in self.model.param_names):
+            # The guessed parameters would all be overwritten, so skip the guess.
+            return params
+        if self.engine == 'chunked':
+            # Guess from block averages so that the whole data array is never read into memory.
+            frequency, data = chunked.decimate(frequency=self.frequency, data=self.data)
+        else:
+            frequency, data = self.frequency, self.data
+        initial_params = self.guess(frequency=frequency, data=data)
+        if params is not None:
+            initial_params.update(params)
+        return initial_params
+
     def fit(self, params=None, **fit_kwds):
         """
         Fit the object's model to its data, overwriting the existing result.
 
         :param params: a lmfit.parameter.Parameters object containing Parameters that will overwrite the parameters
-          obtained from self.guess(), which uses the guessing functions of first the background and then the foreground.
-        :param fit_kwds: a dict of keywords passed directly to lmfit.model.Model.fit().
+          obtained from self.guess(), which uses the guessing functions of first the background and then the foreground;
+          if it contains every model parameter then self.guess() is not called.
+        :param fit_kwds: a dict of keywords passed directly to lmfit.model.Model.fit(), or to lean.fit() or
+          chunked.fit() if the engine is 'lean' or 'chunked'.
         :return: None
         """
-        initial_params = self.guess(frequency=self.frequency, data=self.data)
-        if params is not None:
-            initial_params.update(params)
+        initial_params = self.initial_params(params=params)
+        # The lean and chunked engines write the best-fit values into the given parameters, so do not modify the user's
+        # object.
+        if self.engine in ('lean', 'chunked') and initial_params is params:
+            initial_params = deepcopy(params)
+        if self.engine == 'chunked':
+            self.result = chunked.fit(background_model=self.background_model, foreground_model=self.foreground_model,
+                                      params=initial_params, frequency=self.frequency, data=self.data,
+                                      errors=self.errors, residual_convention=_residual_convention(),
+                                      analytic_jacobian=self.analytic_jacobian, **fit_kwds)
+            return
+        if self.engine == 'lean':
+            self.result = lean.fit(background_model=self.background_model, foreground_model=self.foreground_model,
+                                   params=initial_params, frequency=self.frequency, data=self.data,
+                                   weights=self.weights, residual_convention=_residual_convention(),
+                                   analytic_jacobian=self.analytic_jacobian, projection=self.projection, **fit_kwds)
+            return
+        if self.analytic_jacobian and self._can_use_jacobian(params=initial_params, **fit_kwds):
+            fit_kws = dict(fit_kwds.pop('fit_kws', None) or {})
+            fit_kws['Dfun'] = self.residual_jacobian
+            fit_kwds['fit_kws'] = fit_kws
         self.result = self.model.fit(frequency=self.frequency, data=self.data, weights=self.weights,
                                      params=initial_params, **fit_kwds)
 
+    def _can_use_jacobian(self, params, method='leastsq', fit_kws=None, **fit_kwds):
+        """
+        Return True if the analytic Jacobian can be used in a fit with the given settings: the minimizer must accept a
+        Jacobian, the user must not have supplied one, no parameter can be constrained by an expression, and both models
+        must implement derivatives for every parameter.
+        """
+        if method not in ('leastsq', 'least_squares') or (fit_kws is not None and 'Dfun' in fit_kws):
+            return False
+        if any(p.expr is not None for p in params.values()):
+            return False
+        if self.background_model.derivatives is None or self.foreground_model.derivatives is None:
+            return False
+        return True
+
+    def residual_jacobian(self, params, data, weights, frequency):
+        """
+        Return the Jacobian of the residual calculated by lmfit with respect to the varying parameters, as an array with
+        one column per parameter. This function has the signature of the `Dfun` argument passed by lmfit to the
+        minimizer.
+
+        The derivatives of the composite model are calculated from the analytic derivatives of the background and
+        foreground models using the product rule:
+          d(background * foreground) / dp = (d background / dp) * foreground + background * (d foreground / dp).
+
+        :param params: a lmfit.parameter.Parameters object containing the current parameter values.
+        :param data: the data array, which is not used.
+        :param weights: the weights array or None.
+        :param frequency: the frequency array.
+        :return: array[float] with shape (2 * frequency.size, number of varying parameters)
+        """
+        background = self.background_model.eval(params=params, frequency=frequency)
+        foreground = self.foreground_model.eval(params=params, frequency=frequency)
+        background_gradient = self.background_model.gradient(params=params, frequency=frequency)
+        foreground_gradient = self.foreground_model.gradient(params=params, frequency=frequency)
+        var_names = [name for name, p in params.items() if p.vary and p.expr is None]
+        jacobian = np.zeros((len(var_names), np.size(frequency)), dtype='complex')
+        for row, name in zip(jacobian, var_names):
+            if name in background_gradient:
+                row += background_gradient[name] * foreground
+            if name in foreground_gradient:
+                row += background * foreground_gradient[name]
+        sign, complex_weights = _residual_convention()
+        jacobian *= -sign
+        if weights is not None and complex_weights:
+            jacobian *= weights
+        jacobian = jacobian.view('float')
+        if weights is not None and not complex_weights:
+            jacobian *= np.asarray(weights, dtype='complex').view('float')
+        return jacobian.T
+
     def evaluate_fit(self, frequency=None):
         """
         Return the model (background * foreground) evaluated at the given frequencies with the best-fit parameters.
@@ -159,7 +531,7 @@ class ResonatorFitter(object):
         :return: array[complex]
         """
         if frequency is None:
-            frequency = self.frequency
+            return self._cached('fit', lambda: self.evaluate_fit_background() * self.evaluate_fit_foreground())
         return self.model.eval(params=self.result.params, frequency=frequency)
 
     def evaluate_initial(self, frequency=None):
@@ -170,7 +542,8 @@ class ResonatorFitter(object):
         :return: array[complex]
         """
         if frequency is None:
-            frequency = self.frequency
+            return self._cached('initial',
+                                lambda: self.evaluate_initial_background() * self.evaluate_initial_foreground())
         return self.model.eval(params=self.result.init_params, frequency=frequency)
 
     def evaluate_fit_foreground(self, frequency=None):
@@ -181,7 +554,7 @@ class ResonatorFitter(object):
         :return: array[complex]
         """
         if frequency is None:
-            frequency = self.frequency
+            return self._cached('fit_foreground', lambda: self.evaluate_fit_foreground(frequency=self.frequency))
         return self.foreground_model.eval(frequency=frequency, params=self.result.params)
 
     def evaluate_initial_foreground(self, frequency=None):
@@ -192,7 +565,8 @@ class ResonatorFitter(object):
         :return: array[complex]
         """
         if frequency is None:
-            frequency = self.frequency
+            return self._cached('initial_foreground',
+                                lambda: self.evaluate_initial_foreground(frequency=self.frequency))
         return self.foreground_model.eval(frequency=frequency, params=self.result.init_params)
 
     def evaluate_fit_background(self, frequency=None):
@@ -203,7 +577,7 @@ class ResonatorFitter(object):
         :return: array[complex]
         """
         if frequency is None:
-            frequency = self.frequency
+            return self._cached('fit_background', lambda: self.evaluate_fit_background(frequency=self.frequency))
         return self.background_model.eval(frequency=frequency, params=self.result.params)
 
     def evaluate_initial_background(self, frequency=None):
@@ -214,33 +588,34 @@ class ResonatorFitter(object):
         :return: array[complex]
         """
         if frequency is None:
-            frequency = self.frequency
+            return self._cached('initial_background',
+                                lambda: self.evaluate_initial_background(frequency=self.frequency))
         return self.background_model.eval(frequency=frequency, params=self.result.init_params)
 
     @property
     def foreground_data(self):
         """The measured data divided by the background best-fit model evaluated at the same frequencies."""
-        return self.data / self.evaluate_fit_background()
+        return self._cached('foreground_data', lambda: self.data / self.evaluate_fit_background())
 
     @property
     def background_data(self):
         """The measured data divided by the foreground best-fit model evaluated at the same frequencies."""
-        return self.data / self.evaluate_fit_foreground()
+        return self._cached('background_data', lambda: self.data / self.evaluate_fit_foreground())
 
     @property
     def residuals(self):
         """The measured data minus the best-fit model evaluated at the same frequencies."""
-        return self.data - self.evaluate_fit()
+        return self._cached('residuals', lambda: self.data - self.evaluate_fit())
 
     @property
     def foreground_residuals(self):
         """The residuals divided by the best-fit background model evaluated at the same frequencies."""
-        return self.residuals / self.evaluate_fit_background()
+        return self._cached('foreground_residuals', lambda: self.residuals / self.evaluate_fit_background())
 
     @property
     def background_residuals(self):
         """The residuals divided by the best-fit background model evaluated at the same frequencies."""
-        return self.residuals / self.evaluate_fit_foreground()
+        return self._cached('background_residuals', lambda: self.residuals / self.evaluate_fit_foreground())
 
     def remove_background(self, frequency, data):
         """
@@ -312,23 +687,24 @@ class ResonatorFitter(object):
     @property
     def f_r(self):
         """Alias for resonance_frequency."""
-        return self.resonance_frequency
+        return self.snapshot.values['resonance_frequency']
 
     @property
     def f_r_error(self):
         """Alias for resonance_frequency_error."""
-        return self.resonance_frequency_error
+        return self.snapshot.errors['resonance_frequency']
 
     @property
     def omega_r(self):
         """The resonance angular frequency."""
-        return 2 * pi * self.resonance_frequency
+        return 2 * pi * self.snapshot.values['resonance_frequency']
 
     @property
     def omega_r_error(self):
         """The standard error of the resonance angular frequency."""
-        if self.resonance_frequency_error is not None:
-            return 2 * pi * self.resonance_frequency_error
+        resonance_frequency_error = self.snapshot.errors['resonance_frequency']
+        if resonance_frequency_error is not None:
+            return 2 * pi * resonance_frequency_error
 
     @property
     def total_loss(self):
@@ -336,18 +712,22 @@ class ResonatorFitter(object):
         The total loss is the sum of the coupling and internal losses, which is inverse of the total (or loaded or
         resonator) quality factor.
         """
-        return self.internal_loss + self.coupling_loss
+        values = self.snapshot.values
+        return values['internal_loss'] + values['coupling_loss']
 
     @property
     def total_loss_error(self):
         """Assume that the errors of the internal loss and coupling loss are independent."""
-        if self.internal_loss_error is not None and self.coupling_loss_error is not None:
-            return (self.internal_loss_error ** 2 + self.coupling_loss_error ** 2) ** (1 / 2)
+        errors = self.snapshot.errors
+        internal_loss_error = errors['internal_loss']
+        coupling_loss_error = errors['coupling_loss']
+        if internal_loss_error is not None and coupling_loss_error is not None:
+            return (internal_loss_error ** 2 + coupling_loss_error ** 2) ** (1 / 2)
 
     @property
     def coupling_quality_factor(self):
         """The coupling quality factor."""
-        return 1 / self.coupling_loss
+        return 1 / self.snapshot.values['coupling_loss']
 
     @property
     def Q_c(self):
@@ -357,8 +737,10 @@ class ResonatorFitter(object):
     @property
     def coupling_quality_factor_error(self):
         """The standard error of the coupling quality factor."""
-        if self.coupling_loss_error is not None:
-            return self.coupling_loss_error / self.coupling_loss ** 2
+        snapshot = self.snapshot
+        coupling_loss_error = snapshot.errors['coupling_loss']
+        if coupling_loss_error is not None:
+            return coupling_loss_error / snapshot.values['coupling_loss'] ** 2
 
     @property
     def Q_c_error(self):
@@ -368,7 +750,7 @@ class ResonatorFitter(object):
     @property
     def internal_quality_factor(self):
         """The internal quality factor."""
-        return 1 / self.internal_loss
+        return 1 / self.snapshot.values['internal_loss']
 
     @property
     def Q_i(self):
@@ -378,8 +760,10 @@ class ResonatorFitter(object):
     @property
     def internal_quality_factor_error(self):
         """The standard error of the internal quality factor."""
-        if self.internal_loss_error is not None:
-            return self.internal_loss_error / self.internal_loss ** 2
+        snapshot = self.snapshot
+        internal_loss_error = snapshot.errors['internal_loss']
+        if internal_loss_error is not None:
+            return internal_loss_error / snapshot.values['internal_loss'] ** 2
 
     @property
     def Q_i_error(self):
@@ -389,7 +773,8 @@ class ResonatorFitter(object):
     @property
     def total_quality_factor(self):
         """The total (or resonator, or loaded) quality factor."""
-        return 1 / (self.internal_loss + self.coupling_loss)
+        values = self.snapshot.values
+        return 1 / (values['internal_loss'] + values['coupling_loss'])
 
     @property
     def Q_t(self):
@@ -399,8 +784,9 @@ class ResonatorFitter(object):
     @property
     def total_quality_factor_error(self):
         """The standard error of the total (or resonator, or loaded) quality factor."""
-        if self.total_loss_error is not None:
-            return self.total_loss_error / self.total_loss ** 2
+        total_loss_error = self.total_loss_error
+        if total_loss_error is not None:
+            return total_loss_error / self.total_loss ** 2
 
     @property
     def Q_t_error(self):
@@ -410,7 +796,8 @@ class ResonatorFitter(object):
     @property
     def coupling_energy_decay_rate(self):
         """The energy decay rate through the coupling to the output port."""
-        return self.omega_r * self.coupling_loss
+        values = self.snapshot.values
+        return 2 * pi * values['resonance_frequency'] * values['coupling_loss']
 
     @property
     def coupling_energy_decay_rate_error(self):
@@ -418,14 +805,21 @@ class ResonatorFitter(object):
         The standard error of the coupling energy decay rate, calculated by assuming that the errors of the resonance
         frequency and coupling loss are independent.
         """
-        if self.resonance_frequency_error is not None and self.coupling_loss_error is not None:
-            return self.coupling_energy_decay_rate * ((self.resonance_frequency_error / self.resonance_frequency) ** 2
-                                                      + (self.coupling_loss_error / self.coupling_loss) ** 2) ** (1 / 2)
+        values = self.snapshot.values
+        errors = self.snapshot.errors
+        resonance_frequency_error = errors['resonance_frequency']
+        coupling_loss_error = errors['coupling_loss']
+        if resonance_frequency_error is not None and coupling_loss_error is not None:
+            resonance_frequency = values['resonance_frequency']
+            coupling_loss = values['coupling_loss']
+            return self.coupling_energy_decay_rate * ((resonance_frequency_error / resonance_frequency) ** 2
+                                                     + (coupling_loss_error / coupling_loss) ** 2) ** (1 / 2)
 
     @property
     def internal_energy_decay_rate(self):
         """The energy decay rate due to all channels other than the output port."""
-        return self.omega_r * self.internal_loss
+        values = self.snapshot.values
+        return 2 * pi * values['resonance_frequency'] * values['internal_loss']
 
     @property
     def internal_energy_decay_rate_error(self):
@@ -433,14 +827,21 @@ class ResonatorFitter(object):
         The standard error of the coupling energy decay rate, calculated by assuming that the errors of the resonance
         frequency and internal loss are independent.
         """
-        if self.resonance_frequency_error is not None and self.internal_loss_error is not None:
-            return self.internal_energy_decay_rate * ((self.resonance_frequency_error / self.resonance_frequency) ** 2
-                                                      + (self.internal_loss_error / self.internal_loss) ** 2) ** (1 / 2)
+        values = self.snapshot.values
+        errors = self.snapshot.errors
+        resonance_frequency_error = errors['resonance_frequency']
+        internal_loss_error = errors['internal_loss']
+        if resonance_frequency_error is not None and internal_loss_error is not None:
+            resonance_frequency = values['resonance_frequency']
+            internal_loss = values['internal_loss']
+            return self.internal_energy_decay_rate * ((resonance_frequency_error / resonance_frequency) ** 2
+                                                     + (internal_loss_error / internal_loss) ** 2) ** (1 / 2)
 
     @property
     def total_energy_decay_rate(self):
         """The total (coupling plus internal) energy loss rate."""
-        return self.omega_r * (self.internal_loss + self.coupling_loss)
+        values = self.snapshot.values
+        return 2 * pi * values['resonance_frequency'] * (values['internal_loss'] + values['coupling_loss'])
 
     @property
     def total_energy_decay_rate_error(self):
@@ -448,31 +849,54 @@ class ResonatorFitter(object):
         The total energy decay rate, calculated by assuming that the errors of the resonance frequency, internal loss,
         and coupling loss are independent.
         """
-        if self.resonance_frequency_error is not None and self.total_loss_error is not None:
-            return self.total_energy_decay_rate * ((self.resonance_frequency_error / self.resonance_frequency) ** 2
-                                                   + (self.total_loss_error / self.total_loss) ** 2) ** (1 / 2)
+        resonance_frequency_error = self.snapshot.errors['resonance_frequency']
+        total_loss_error = self.total_loss_error
+        if resonance_frequency_error is not None and total_loss_error is not None:
+            resonance_frequency = self.snapshot.values['resonance_frequency']
+            total_loss = self.total_loss
+            return self.total_energy_decay_rate * ((resonance_frequency_error / resonance_frequency) ** 2
+                                                  + (total_loss_error / total_loss) ** 2) ** (1 / 2)
 
     # Photon number
 
-    def photon_number(self, input_frequency, input_rate):
+    def photon_number(self, input_frequency, input_rate, **kwds):
         """
         Return the average photon number in the resonator calculated using the fit parameters, assuming an input signal
-        at the given input frequency and input rate.
+        at the given input frequency and input rate. The arguments broadcast together, so for example
+        photon_number(frequency, rate[:, np.newaxis]) returns an array with shape (rate.size, frequency.size) with one
+        row per input rate; the nonlinear fitters calculate all of the points with one vectorized root solve.
 
         :param input_frequency: float or array[float]; the frequency of the input signal, in Hz.
         :param input_rate: float or array[float]; the input photon rate, in photons per second.
+        :param kwds: keywords specific to the fitter class.
         :return: float or array[float]
         """
         raise NotImplementedError("Subclasses should implement this.")
 
-    def photon_number_from_power(self, input_frequency, input_power_dBm):
+    def photon_number_from_power(self, input_frequency, input_power_dBm, **kwds):
         """
         Return the average photon number in the resonator calculated using the fit parameters, assuming an input signal
-        at the given input frequency and input power in dBm.
+        at the given input frequency and input power in dBm. The arguments broadcast together as in photon_number().
 
         :param input_frequency: float or array[float]; the frequency of the input signal, in Hz.
         :param input_power_dBm: float or array[float]; the input power, in dBm.
+        :param kwds: keywords passed directly to photon_number().
         :return: float or array[float]
         """
         return self.photon_number(input_frequency=input_frequency,
-                                  input_rate=1e-3 * 10 ** (input_power_dBm / 10) / (h * input_frequency))
+                                  input_rate=1e-3 * 10 ** (input_power_dBm / 10) / (h * input_frequency), **kwds)
+
+    def photon_number_grid(self, input_frequency, input_power_dBm, **kwds):
+        """
+        Return the average photon number in the resonator on the grid of the given input frequencies and input powers,
+        calculated using the fit parameters; see photon_number_from_power().
+
+        :param input_frequency: 1D array[float]; the frequencies of the input signal, in Hz.
+        :param input_power_dBm: 1D array[float]; the input powers, in dBm.
+        :param kwds: keywords passed directly to photon_number(); the Kerr fitters require kerr_coefficient or
+          fitted_input_rate for more than one input power; see `kerr.KerrFitter.photon_number`.
+        :return: array[float] with shape (input_power_dBm.size, input_frequency.size), with one row per input power.
+        """
+        return self.photon_number_from_power(input_frequency=np.asarray(input_frequency, dtype='float'),
+                                             input_power_dBm=np.asarray(input_power_dBm, dtype='float')[:, np.newaxis],
+                                             **kwds)
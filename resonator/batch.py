@@ -0,0 +1,178 @@
+"""
+Functions for fitting many data sets on a pool of processes.
+
+The fitters in this package do all of their work in `__init__`, so fitting many resonances is a loop over data sets
+that creates one fitter per data set. The `fit_many` function in this module runs that loop on a pool of worker
+processes. The data sets are grouped into chunks of roughly equal expected cost, the most expensive chunks are started
+first, and the results are returned in the same order as the input data sets. An exception raised while fitting one
+data set is recorded in the corresponding outcome instead of stopping the whole batch.
+
+The fitter objects themselves are not returned because their models contain locally-defined functions that cannot be
+pickled. Instead, each fit produces a `FitOutcome` that contains the best-fit `lmfit.Parameters` and the fit
+statistics.
+"""
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import traceback
+from collections import namedtuple
+
+import numpy as np
+
+from . import kerr, kerr_loss
+
+FitOutcome = namedtuple('FitOutcome', ['params', 'chisqr', 'redchi', 'nfev', 'success', 'error'])
+FitOutcome.__doc__ = """
+The result of fitting one data set: `params` is the best-fit lmfit.Parameters object, `chisqr` and `redchi` are the
+chi-squared and reduced chi-squared, `nfev` is the number of function evaluations, and `success` is the lmfit success
+flag. If the fit raised an exception, `params` is None, `success` is False, and `error` is the formatted traceback;
+otherwise, `error` is None.
+"""
+
+# The cost of one model evaluation per data point relative to a linear model. The Kerr models solve a cubic equation at
+# each point and the Kerr models with nonlinear loss find all of the real roots of a cubic polynomial at each point.
+cost_per_point = [(kerr_loss.KerrLossFitter, 20),
+                  (kerr.KerrFitter, 5)]
+default_cost_per_point = 1
+
+# Settings shared by every task that a worker process runs; see _initialize_worker().
+_worker_settings = {}
+
+
+def expected_cost(fitter_class, num_points):
+    """
+    Return the expected cost of fitting a data set with the given number of points using the given fitter class, in
+    arbitrary units proportional to the number of point-evaluations of a linear model.
+
+    :param fitter_class: a ResonatorFitter subclass (not an instance).
+    :param num_points: the number of data points.
+    :return: float
+    """
+    for base_class, cost in cost_per_point:
+        if issubclass(fitter_class, base_class):
+            return cost * num_points
+    return default_cost_per_point * num_points
+
+
+def fit_many(fitter_class, frequencies, datas, errors=None, processes=None, chunks_per_process=4, **kwds):
+    """
+    Fit many data sets using the given fitter class and return a list of FitOutcome objects in the same order as the
+    data sets.
+
+    Example:
+      outcomes = fit_many(shunt.LinearShuntFitter, frequencies=frequency, datas=s21_array, processes=32)
+      internal_quality_factors = [1 / o.params['internal_loss'].value for o in outcomes if o.success]
+
+    :param fitter_class: a ResonatorFitter subclass (not an instance) that is created as
+      fitter_class(frequency=frequency, data=data, errors=errors, **kwds) for each data set.
+    :param frequencies: either a single 1D array of frequencies that is used for every data set, or a sequence of 1D
+      arrays with one array per data set.
+    :param datas: a sequence of 1D complex data arrays, such as a 2D array with one data set per row.
+    :param errors: None to use equal weights for every data set, or a sequence of 1D complex error arrays with one array
+      per data set.
+    :param processes: the number of worker processes; the default of None uses `multiprocessing.cpu_count()`, and 1
+      fits the data sets in the current process without creating a pool.
+    :param chunks_per_process: the approximate number of chunks of data sets per process; more chunks give better load
+      balancing, while fewer chunks reduce the communication overhead.
+    :param kwds: keywords passed directly to the fitter class, such as `background_model` or keywords for
+      lmfit.model.Model.fit(); these are sent to the workers once per process, so unless the processes are created by
+      forking they must be picklable.
+    :return: list[FitOutcome]
+    """
+    datas = list(datas)
+    num_fits = len(datas)
+    shared_frequency = isinstance(frequencies, np.ndarray) and frequencies.ndim == 1
+    if not shared_frequency:
+        frequencies = list(frequencies)
+        if len(frequencies) != num_fits:
+            raise ValueError("The number of frequency arrays must equal the number of data arrays.")
+    if errors is not None:
+        errors = list(errors)
+        if len(errors) != num_fits:
+            raise ValueError("The number of error arrays must equal the number of data arrays.")
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    settings = {'fitter_class': fitter_class, 'kwds': kwds, 'frequency': frequencies if shared_frequency else None}
+
+    def task(index):
+        return (index,
+                None if shared_frequency else frequencies[index],
+                datas[index],
+                None if errors is None else errors[index])
+
+    outcomes = [None] * num_fits
+    if processes == 1 or num_fits <= 1:
+        _initialize_worker(settings)
+        try:
+            for index, outcome in _fit_chunk([task(index) for index in range(num_fits)]):
+                outcomes[index] = outcome
+        finally:
+            _worker_settings.clear()
+        return outcomes
+    costs = [expected_cost(fitter_class, np.size(data)) for data in datas]
+    chunks = [[task(index) for index in chunk]
+              for chunk in _balanced_chunks(costs=costs, num_chunks=processes * chunks_per_process)]
+    pool = multiprocessing.Pool(processes=processes, initializer=_initialize_worker, initargs=(settings,))
+    try:
+        for results in pool.imap_unordered(_fit_chunk, chunks):
+            for index, outcome in results:
+                outcomes[index] = outcome
+    finally:
+        pool.close()
+        pool.join()
+    return outcomes
+
+
+def _balanced_chunks(costs, num_chunks):
+    """
+    Return a list of lists of indices into the given costs, sorted so that the most expensive chunks come first. The
+    indices are assigned in order of decreasing cost so that each chunk has a total cost close to the total cost
+    divided by the number of chunks; this keeps all of the workers busy until the end of the batch.
+    """
+    order = np.argsort(costs)[::-1]
+    target = np.sum(costs) / max(num_chunks, 1)
+    chunks = []
+    chunk = []
+    chunk_cost = 0
+    for index in order:
+        chunk.append(int(index))
+        chunk_cost += costs[index]
+        if chunk_cost >= target:
+            chunks.append(chunk)
+            chunk = []
+            chunk_cost = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _initialize_worker(settings):
+    _worker_settings.clear()
+    _worker_settings.update(settings)
+
+
+def _fit_chunk(tasks):
+    return [(index, _fit_one(frequency=frequency, data=data, errors=errors))
+            for index, frequency, data, errors in tasks]
+
+
+def _fit_one(frequency, data, errors):
+    if frequency is None:
+        frequency = _worker_settings['frequency']
+    try:
+        fitter = _worker_settings['fitter_class'](frequency=frequency, data=data, errors=errors,
+                                                  **_worker_settings['kwds'])
+    except Exception:
+        return failed_outcome(error=traceback.format_exc())
+    return outcome(fitter)
+
+
+def outcome(fitter):
+    """Return a FitOutcome containing the best-fit parameters and fit statistics of the given fitter."""
+    return FitOutcome(params=fitter.result.params, chisqr=fitter.result.chisqr, redchi=fitter.result.redchi,
+                      nfev=fitter.result.nfev, success=fitter.result.success, error=None)
+
+
+def failed_outcome(error):
+    """Return a FitOutcome for a fit that raised an exception, where error is the formatted traceback."""
+    return FitOutcome(params=None, chisqr=np.nan, redchi=np.nan, nfev=0, success=False, error=error)
@@ -0,0 +1,281 @@
+"""
+Functions for guessing and fitting data sets that are too large to hold in memory, such as sweeps of many millions of
+points stored in `np.memmap` arrays.
+
+The lmfit and lean engines evaluate the residual and its Jacobian at every point at once, so a fit needs several arrays
+with the size of the data, and the guessing functions create several more. The `fit` function in this module instead
+reads the frequency, data, and error arrays in chunks of at most `chunk_size` points and accumulates the sum of squares
+of the residual and the normal equations of each Levenberg-Marquardt step, so each iteration is one pass over the data
+and the memory used is a small multiple of the memory of one chunk. The initial values are guessed from the means of
+blocks of adjacent points calculated by `decimate`, which reduces a data set of any size to a bounded number of points;
+since the guessing functions smooth the data over a fixed fraction of the sweep, averaging blocks that are much narrower
+than the smoothing kernel does not change the guesses appreciably.
+
+A fitter uses these functions when it is created with `engine='chunked'`:
+  frequency = np.memmap('frequency.bin', dtype='float64', mode='r')
+  data = np.memmap('s21.bin', dtype='complex64', mode='r')
+  fitter = shunt.LinearShuntFitter(frequency=frequency, data=data, engine='chunked', chunk_size=2 ** 16)
+
+The arrays derived from the best-fit model, such as `fitter.residuals`, are still calculated at every point at once.
+Models that couple neighboring points, such as the Kerr models with `track=True`, are evaluated separately in each
+chunk, so a tracked branch starts again at the beginning of each chunk.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from . import lean
+
+default_chunk_size = 2 ** 18
+default_guess_points = 2 ** 17
+
+
+class ChunkedResult(lean.LeanResult):
+    """
+    This class contains the result of a fit by the chunked engine. It is a lean.LeanResult that does not store the
+    residual, which has the size of the data; chisqr and ndata are accumulated during the fit instead.
+    """
+
+    method = 'chunked'
+
+    def __init__(self, params, init_values, var_names, chisqr, ndata, covar, nfev, njev, success, message):
+        self._initialize(params=params, init_values=init_values, var_names=var_names, chisqr=chisqr, ndata=ndata,
+                         covar=covar, nfev=nfev, njev=njev, success=success, message=message)
+        self.residual = None
+
+
+def chunks(size, chunk_size=default_chunk_size):
+    """
+    Return a list of slices that divide an array with the given size into consecutive chunks of at most chunk_size
+    points.
+
+    :param size: the number of points.
+    :param chunk_size: the maximum number of points in a chunk.
+    :return: list[slice]
+    """
+    return [slice(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+
+def decimate(frequency, data, num_points=default_guess_points, chunk_size=default_chunk_size):
+    """
+    Return in-memory frequency and data arrays that contain the means of the given arrays over blocks of adjacent
+    points, with the number of points in a block chosen so that there are at most num_points blocks. The arrays are
+    read in chunks of at most chunk_size points. If the data has at most num_points points, the arrays are returned
+    unchanged, apart from being read into memory.
+
+    :param frequency: a 1D array of frequencies, such as a np.memmap array.
+    :param data: a 1D array of complex data with the same size.
+    :param num_points: the maximum number of points in the returned arrays.
+    :param chunk_size: the maximum number of points that are read at once.
+    :return: frequency, data; array[float], array[complex]
+    """
+    size = np.size(data)
+    if size <= num_points:
+        return np.asarray(frequency, dtype='float'), np.asarray(data, dtype='complex')
+    block_size = -(-size // num_points)
+    starts = np.arange(0, size, block_size)
+    sums = np.zeros((3, starts.size))
+    for chunk in chunks(size=size, chunk_size=chunk_size):
+        block = np.arange(chunk.start, chunk.stop) // block_size
+        first = block[0]
+        block -= first
+        chunk_data = np.asarray(data[chunk], dtype='complex')
+        for row, values in enumerate((np.asarray(frequency[chunk], dtype='float'), chunk_data.real, chunk_data.imag)):
+            sums[row, first:first + block[-1] + 1] += np.bincount(block, weights=values)
+    sums /= np.diff(np.append(starts, size))
+    return sums[0], sums[1] + 1j * sums[2]
+
+
+def fit(background_model, foreground_model, params, frequency, data, errors, residual_convention,
+        analytic_jacobian=True, scale_covar=True, chunk_size=default_chunk_size, max_iterations=200, ftol=1.5e-8,
+        xtol=1.5e-8):
+    """
+    Fit background_model * foreground_model to the data, reading the arrays in chunks, and return a ChunkedResult.
+
+    The minimizer is the Levenberg-Marquardt algorithm with Marquardt's scaling of the damping term, as in `stacked`,
+    applied to the normal equations accumulated over the chunks. The bounds of the parameters are handled as in
+    lean.fit(), and the best-fit values and standard errors agree with those of the other engines to within the
+    tolerances of the fits.
+
+    :param background_model: the background model instance.
+    :param foreground_model: the foreground model instance.
+    :param params: a lmfit.parameter.Parameters object containing the initial values and bounds; it is modified in place
+      and becomes the params attribute of the result.
+    :param frequency: the 1D frequency array, such as a np.memmap array.
+    :param data: the 1D complex data array with the same size.
+    :param errors: None or the complex errors array with the same size; see base.ResonatorFitter. The weights are
+      calculated from the errors one chunk at a time.
+    :param residual_convention: the (sign, complex_weights) tuple returned by base._residual_convention(), which is used
+      so that chisqr equals that calculated by lmfit.
+    :param analytic_jacobian: if True and both models implement `derivatives`, use the analytic Jacobian; otherwise, use
+      forward differences calculated in each chunk.
+    :param scale_covar: if True, scale the covariance matrix by the reduced chi-squared, as lmfit does by default.
+    :param chunk_size: the maximum number of points that are evaluated at once.
+    :param max_iterations: the maximum number of iterations; if the fit has not converged by then, `success` is False.
+    :param ftol: the fit has converged when a step reduces chi-squared by less than this fraction.
+    :param xtol: the fit has converged when the scaled length of a step is less than this fraction of the scaled length
+      of the parameter vector.
+    :return: ChunkedResult
+    """
+    if any(p.expr is not None for p in params.values()):
+        raise ValueError("The chunked engine does not support parameters constrained by expressions.")
+    if np.ndim(data) != 1 or np.size(frequency) != np.size(data):
+        raise ValueError("The frequency and data must be 1D arrays with the same size.")
+    var_names = [name for name, p in params.items() if p.vary]
+    lower = np.array([-np.inf if params[name].min is None else params[name].min for name in var_names], dtype='float')
+    upper = np.array([np.inf if params[name].max is None else params[name].max for name in var_names], dtype='float')
+    init_values = dict((name, params[name].value) for name in var_names)
+    bounds = lean.Bounds(lower=lower, upper=upper)
+    problem = _ChunkedProblem(background_model=background_model, foreground_model=foreground_model, params=params,
+                              var_names=var_names, bounds=bounds, frequency=frequency, data=data, errors=errors,
+                              residual_convention=residual_convention, analytic_jacobian=analytic_jacobian,
+                              chunk_size=chunk_size)
+    internal, chisqr, jtj, nfev, success, message = _levenberg_marquardt(
+        problem=problem, internal=bounds.internal(np.array([init_values[name] for name in var_names], dtype='float')),
+        max_iterations=max_iterations, ftol=ftol, xtol=xtol)
+    best_values = bounds.external(internal)
+    ndata = 2 * np.size(data)
+    try:
+        derivative = bounds.derivative(internal)
+        covar = np.linalg.inv(jtj) * np.outer(derivative, derivative)
+    except np.linalg.LinAlgError:
+        covar = None
+    nfree = ndata - len(var_names)
+    if covar is not None and scale_covar and nfree > 0:
+        covar *= chisqr / nfree
+    for index, name in enumerate(var_names):
+        params[name].init_value = init_values[name]
+        params[name].value = best_values[index]
+        if covar is None or not covar[index, index] > 0:
+            params[name].stderr = None
+        else:
+            params[name].stderr = np.sqrt(covar[index, index])
+    # As in lmfit, parameters that do not vary have a standard error of zero if the covariance could be calculated.
+    for name, p in params.items():
+        if name not in init_values:
+            p.stderr = None if covar is None else 0
+    return ChunkedResult(params=params, init_values=init_values, var_names=var_names, chisqr=chisqr, ndata=ndata,
+                         covar=covar, nfev=nfev, njev=nfev, success=success, message=message)
+
+
+class _ChunkedProblem(object):
+    """
+    The sum of squares of the residual and the normal equations of the least-squares problem, accumulated over the
+    chunks of the data. The residual and weights follow the lmfit convention, as in lean.fit().
+    """
+
+    def __init__(self, background_model, foreground_model, params, var_names, bounds, frequency, data, errors,
+                 residual_convention, analytic_jacobian, chunk_size):
+        self.var_names = var_names
+        self.bounds = bounds
+        self.background = lean._Component(model=background_model, params=params, var_names=var_names)
+        self.foreground = lean._Component(model=foreground_model, params=params, var_names=var_names)
+        self.analytic = (analytic_jacobian and self.background.derivatives is not None
+                         and self.foreground.derivatives is not None)
+        self.frequency = frequency
+        self.data = data
+        self.errors = errors
+        self.sign, self.complex_weights = residual_convention
+        self.chunks = chunks(size=np.size(data), chunk_size=chunk_size)
+
+    def evaluate(self, internal):
+        """
+        Return the sum of squares of the residual, J^T J, and J^T r, where J is the Jacobian of the residual r with
+        respect to the internal values.
+        """
+        values = self.bounds.external(internal)
+        num_vars = len(self.var_names)
+        cost = 0
+        jtj = np.zeros((num_vars, num_vars))
+        jtr = np.zeros(num_vars)
+        for chunk in self.chunks:
+            # The same frequency object is passed to the model functions and their derivatives, so that models that
+            # share a calculation between them through base.LastEvaluation do it once per chunk.
+            frequency = np.asarray(self.frequency[chunk], dtype='float')
+            data = np.asarray(self.data[chunk], dtype='complex')
+            if self.errors is None:
+                weights = None
+            else:
+                errors = np.asarray(self.errors[chunk], dtype='complex')
+                weights = 1 / errors.real + 1j / errors.imag
+            background_kwargs = self.background.kwargs(values)
+            foreground_kwargs = self.foreground.kwargs(values)
+            background_values = self.background.func(frequency=frequency, **background_kwargs)
+            foreground_values = self.foreground.func(frequency=frequency, **foreground_kwargs)
+            residual = self._weigh(self.sign * (data - background_values * foreground_values), weights=weights)
+            if self.analytic:
+                jacobian = self._analytic_jacobian(internal=internal, frequency=frequency, weights=weights,
+                                                   background_values=background_values,
+                                                   foreground_values=foreground_values,
+                                                   background_kwargs=background_kwargs,
+                                                   foreground_kwargs=foreground_kwargs)
+            else:
+                jacobian = self._difference_jacobian(internal=internal, frequency=frequency, data=data,
+                                                     weights=weights, residual=residual)
+            cost += np.dot(residual, residual)
+            jtj += np.dot(jacobian, jacobian.T)
+            jtr += np.dot(jacobian, residual)
+        return cost, jtj, jtr
+
+    def _weigh(self, difference, weights):
+        # Apply the lmfit weighting convention to complex values, returning real values.
+        if weights is not None and self.complex_weights:
+            difference = difference * weights
+        difference = np.ascontiguousarray(difference).view('float')
+        if weights is not None and not self.complex_weights:
+            difference = difference * np.ascontiguousarray(weights).view('float')
+        return difference
+
+    def _analytic_jacobian(self, internal, frequency, weights, background_values, foreground_values,
+                           background_kwargs, foreground_kwargs):
+        """Return the Jacobian with shape (number of varying parameters, 2 * number of points in the chunk)."""
+        jacobian = np.zeros((len(self.var_names), frequency.size), dtype='complex')
+        for component, other_values, kwargs in [(self.background, foreground_values, background_kwargs),
+                                                (self.foreground, background_values, foreground_kwargs)]:
+            for name, derivative in component.derivatives(frequency=frequency, **kwargs).items():
+                if component.prefix + name in self.var_names:
+                    jacobian[self.var_names.index(component.prefix + name)] += derivative * other_values
+        jacobian *= -self.sign * self.bounds.derivative(internal)[:, np.newaxis]
+        return self._weigh(jacobian, weights=weights)
+
+    def _difference_jacobian(self, internal, frequency, data, weights, residual):
+        """Return the Jacobian calculated using forward differences of the residual in the internal values."""
+        jacobian = np.empty((len(self.var_names), residual.size))
+        # This is the step used by scipy.optimize.least_squares, and thus by the lean engine.
+        steps = np.sqrt(np.finfo('float').eps) * np.maximum(1, np.abs(internal))
+        for index, step in enumerate(steps):
+            shifted = internal.copy()
+            shifted[index] += step
+            values = self.bounds.external(shifted)
+            model = (self.background.func(frequency=frequency, **self.background.kwargs(values))
+                     * self.foreground.func(frequency=frequency, **self.foreground.kwargs(values)))
+            jacobian[index] = (self._weigh(self.sign * (data - model), weights=weights) - residual) / step
+        return jacobian
+
+
+def _levenberg_marquardt(problem, internal, max_iterations, ftol, xtol):
+    """
+    Minimize the sum of squares of the residual of the chunked problem using the Levenberg-Marquardt algorithm with
+    Marquardt's scaling of the damping term, with the steps and tests shared with stacked._levenberg_marquardt(). Each
+    trial step is one pass over the data that also calculates the normal equations for the next step. Return the
+    internal values, the sum of squares of the residual, J^T J, the number of passes, the success flag, and the
+    termination message.
+    """
+    cost, jtj, jtr = problem.evaluate(internal)
+    nfev = 1
+    if not np.isfinite(cost):
+        return internal, cost, jtj, nfev, False, lean.not_finite_message
+    damping = np.array([1e-3])
+    for iteration in range(max_iterations):
+        step, scale = lean._damped_steps(jtj=jtj[np.newaxis], jtr=jtr[np.newaxis], damping=damping)
+        trial = internal + step[0]
+        trial_cost, trial_jtj, trial_jtr = problem.evaluate(trial)
+        nfev += 1
+        accepted, damping, done, success, messages = lean._step_tests(
+            cost=np.array([cost]), trial_cost=np.array([trial_cost]), internal=internal[np.newaxis], step=step,
+            scale=scale, damping=damping, ftol=ftol, xtol=xtol)
+        if accepted[0]:
+            internal, cost, jtj, jtr = trial, trial_cost, trial_jtj, trial_jtr
+        if done[0]:
+            return internal, cost, jtj, nfev, bool(success[0]), messages[0]
+    return internal, cost, jtj, nfev, False, lean.max_iterations_message
@@ -0,0 +1,221 @@
+"""
+Vectorized calculation of the real roots of cubic polynomials with real coefficients.
+
+The nonlinear resonator models find the roots of a cubic polynomial at every frequency point. Calling `np.roots` at
+each point calculates the eigenvalues of a companion matrix in a Python loop, which is slow. The functions in this
+module instead calculate the roots of all of the polynomials at once: the real root with the largest magnitude from the
+trigonometric and hyperbolic forms of the solution of the depressed cubic, the other two from Vieta's relations, and
+then improve their accuracy with Newton steps on the original polynomial. The function `track` selects one root at each
+point of a sweep by following a continuous branch of roots.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+
+# The maximum number of Newton steps taken by real_roots to polish each root.
+newton_steps = 2
+
+
+def real_roots(a, b, c, d, polish=True):
+    """
+    Return the real roots of the cubic polynomials
+      a x^3 + b x^2 + c x + d = 0,
+    where the coefficients are real numbers or arrays that broadcast together.
+
+    The roots are returned in an array with shape (3,) + the broadcast shape of the coefficients. At each point the
+    real roots are sorted in increasing order and the entries that do not correspond to a real root are NaN, so with
+    one real root the first entry is the root and the other two are NaN. A double root is returned twice and a triple
+    root three times. Where a is zero the polynomial is quadratic or linear and its real roots are returned in the same way.
+
+    The closed-form solution calculates every root with an absolute error of order the machine precision times the
+    magnitude of the largest root, so a root that is many orders of magnitude smaller than the largest root would have a
+    large relative error, and the sign of the discriminant that determines the number of real roots is unreliable.
+    Therefore, only the real root with the largest magnitude is taken from the closed-form solution. It is polished,
+    and the other two roots are calculated from it using Vieta's relations, which is equivalent to dividing the
+    polynomial by the factor of this root; they are real if the discriminant of the resulting quadratic is not clearly
+    negative. Every root is then polished with Newton steps. Away from multiple roots, the relative error of
+    every root is then a few times the machine precision, even when the roots differ by many orders of magnitude. Where
+    two roots nearly coincide they are ill-conditioned, and their error is of order the square root of the machine
+    precision times their magnitude, which is also the accuracy of np.roots; whether such a pair is returned as two real
+    roots or omitted as a complex pair is then decided by the sign of the calculated discriminant.
+
+    :param a: the coefficient of x^3.
+    :param b: the coefficient of x^2.
+    :param c: the coefficient of x.
+    :param d: the constant term.
+    :param polish: if True, improve each root with up to `newton_steps` Newton steps on the original polynomial, which
+      removes most of the rounding error of the closed-form solution; because the slope vanishes at a double root, each
+      step is kept only where it reduces the magnitude of the polynomial.
+    :return: numpy.ndarray
+    """
+    a, b, c, d = np.broadcast_arrays(*[np.asarray(coefficient, dtype='float') for coefficient in (a, b, c, d)])
+    roots = np.full((3,) + a.shape, np.nan)
+    cubic = a != 0
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        if cubic.all():
+            roots[:] = _cubic_roots(b / a, c / a, d / a, polish=polish)
+        else:
+            roots[:, cubic] = _cubic_roots(b[cubic] / a[cubic], c[cubic] / a[cubic], d[cubic] / a[cubic],
+                                           polish=polish)
+            quadratic_roots = _quadratic_roots(b[~cubic], c[~cubic], d[~cubic])
+            if polish:
+                quadratic_roots = _polish(0, b[~cubic], c[~cubic], d[~cubic], quadratic_roots)
+            roots[:, ~cubic] = quadratic_roots
+    return np.sort(roots, axis=0)
+
+
+def _polish(a, b, c, d, roots):
+    """
+    Return the given roots of a x^3 + b x^2 + c x + d = 0 improved by up to `newton_steps` Newton steps, where each step
+    is kept only if it reduces the magnitude of the polynomial.
+    """
+    value = ((a * roots + b) * roots + c) * roots + d
+    for step in range(newton_steps):
+        slope = (3 * a * roots + 2 * b) * roots + c
+        polished = roots - value / slope
+        polished_value = ((a * polished + b) * polished + c) * polished + d
+        # Near a double root the slope vanishes, so keep the step only if it reduces the value of the polynomial.
+        better = np.abs(polished_value) < np.abs(value)
+        if not better.any():
+            break
+        roots = np.where(better, polished, roots)
+        value = np.where(better, polished_value, value)
+    return roots
+
+
+def _cubic_roots(b, c, d, polish):
+    """
+    Return an array with shape (3,) + b.shape containing the real roots of x^3 + b x^2 + c x + d = 0, with NaN entries
+    for a complex pair of roots.
+
+    The closed-form solution is used only to find the real root with the largest magnitude; the other two roots are then
+    calculated from it by `_deflated_roots`. If `polish` is True, the largest root is polished before it is used and
+    the other two are polished after.
+    """
+    # Substitute x = t - b / 3 to obtain the depressed cubic t^3 + p t + q = 0.
+    shift = b / 3
+    p = c - b * shift
+    q = (2 * shift ** 2 - c) * shift + d
+    largest = np.empty(b.shape)
+    # The discriminant is -(4 p^3 + 27 q^2); there are three real roots, counting a double root twice, where it is
+    # non-negative and p is negative.
+    three = (4 * p ** 3 + 27 * q ** 2 <= 0) & (p < 0)
+    one = ~three
+    if three.any():
+        m = 2 * np.sqrt(-p[three] / 3)
+        theta = np.arccos(np.clip(3 * q[three] / (p[three] * m), -1, 1)) / 3
+        # The largest and smallest of the three roots m cos(theta - 2 pi k / 3) - shift, with theta in [0, pi / 3], are
+        # those with k = 0 and k = 2, and one of them has the largest magnitude.
+        highest = m * np.cos(theta) - shift[three]
+        lowest = m * np.cos(theta - 4 * np.pi / 3) - shift[three]
+        largest[three] = np.where(np.abs(highest) >= np.abs(lowest), highest, lowest)
+    if one.any():
+        p1 = p[one]
+        q1 = q[one]
+        t = np.cbrt(-q1)  # This is correct where p is zero.
+        negative = p1 < 0
+        if negative.any():
+            m = 2 * np.sqrt(-p1[negative] / 3)
+            argument = np.maximum(-3 * np.abs(q1[negative]) / (p1[negative] * m), 1)
+            t[negative] = -np.sign(q1[negative]) * m * np.cosh(np.arccosh(argument) / 3)
+        positive = p1 > 0
+        if positive.any():
+            m = 2 * np.sqrt(p1[positive] / 3)
+            t[positive] = -m * np.sinh(np.arcsinh(3 * q1[positive] / (p1[positive] * m)) / 3)
+        largest[one] = t - shift[one]
+    if polish:
+        largest = _polish(1, b, c, d, largest)
+    roots = _deflated_roots(b, c, d, largest)
+    if polish:
+        roots[1:] = _polish(1, b, c, d, roots[1:])
+    return roots
+
+
+def _deflated_roots(b, c, d, r):
+    """
+    Return an array with shape (3,) + b.shape containing the real roots of x^3 + b x^2 + c x + d = 0, calculated from the
+    given real root r using Vieta's relations, with NaN entries for a complex pair of roots.
+    """
+    # The other two roots s and t have product -d / r and sum -b - r = (c - s t) / r. The first form of the sum loses
+    # precision when r nearly cancels b, and the second when s t nearly cancels c, so use the one with the smaller
+    # rounding error.
+    product = -d / r
+    difference_error = np.maximum(np.abs(b), np.abs(r))
+    vieta_error = np.maximum(np.abs(c), np.abs(product)) / np.abs(r)
+    total = np.where(vieta_error < difference_error, (c - product) / r, -b - r)
+    # A discriminant that is negative by no more than its rounding error is taken to be zero, at a double root. The sign
+    # of the discriminant of the original cubic is unreliable where the roots differ by many orders of magnitude, so the
+    # number of real roots is decided by the sign of this discriminant.
+    discriminant = total ** 2 - 4 * product
+    complex_pair = discriminant < -16 * np.finfo(float).eps * np.maximum(total ** 2, 4 * np.abs(product))
+    s = (total + np.copysign(np.sqrt(np.maximum(discriminant, 0)), total)) / 2
+    t = np.where(s != 0, product / s, 0)
+    roots = np.stack((r, np.where(complex_pair, np.nan, s), np.where(complex_pair, np.nan, t)))
+    # Where r is zero, d is zero and the other two roots are those of x^2 + b x + c = 0.
+    zero = r == 0
+    if zero.any():
+        roots[1:, zero] = _quadratic_roots(np.ones(np.count_nonzero(zero)), b[zero], c[zero])[:2]
+    return roots
+
+
+def _quadratic_roots(b, c, d):
+    """
+    Return an array with shape (3,) + b.shape containing the real roots of b x^2 + c x + d = 0, with NaN entries for
+    the missing roots.
+    """
+    roots = np.full((3,) + b.shape, np.nan)
+    quadratic = b != 0
+    discriminant = c ** 2 - 4 * b * d
+    real = quadratic & (discriminant >= 0)
+    # This form avoids the cancellation in the usual formula.
+    r = -(c[real] + np.copysign(np.sqrt(discriminant[real]), c[real])) / 2
+    roots[0, real] = r / b[real]
+    roots[1, real] = np.where(r != 0, d[real] / r, 0)
+    linear = ~quadratic & (c != 0)
+    roots[0, linear] = -d[linear] / c[linear]
+    return roots
+
+
+def track(roots, choose):
+    """
+    Return one root per point from an array of real roots, following a continuous branch of roots from each point to the
+    next in the order of the points.
+
+    This models a nonlinear resonator that is measured in a sweep: its state changes continuously with the swept
+    variable and stays on one stable branch of a bistable region until that branch disappears. Where there are three
+    real roots, the middle root is the unstable state, so a tracked point is always on the lower or the upper branch.
+    Both of these branches exist at every point of a contiguous run of points with three real roots, since a run ends
+    where two of the roots merge and disappear, so the branch is chosen once at the first point of each run and kept
+    until the end of the run, where the state moves to the only remaining root. At the first point of a run, the
+    branch is the one whose root is closer to the root at the previous point, which has only one real root; if the run
+    starts at the first point, the branch is the one closer to the root selected by `choose`. Every point is then
+    handled with a few vectorized operations instead of a loop over the points.
+
+    :param roots: an array with shape (3, num_points) that contains the real roots at each point in increasing order,
+      with NaN in place of complex roots, as returned by `real_roots` for a 1D array of coefficients; for an array with
+      shape (3, ..., num_points), each sweep along the last axis is tracked separately.
+    :param choose: a function used to select the initial branch when the first point of a sweep has three real roots;
+      it is called as choose(roots[:, indices], axis=0).
+    :return: numpy.ndarray
+    """
+    shape = roots.shape[1:]
+    roots = roots.reshape(3, -1)
+    chosen = roots[0].copy()
+    three = ~np.isnan(roots[2])
+    if not three.any():
+        return chosen.reshape(shape)
+    sweep_start = np.arange(chosen.size) % shape[-1] == 0
+    first = three.copy()
+    first[1:] &= ~three[:-1] | sweep_start[1:]
+    first_index = np.flatnonzero(first)
+    continued = ~sweep_start[first_index]
+    reference = np.empty(first_index.size)
+    reference[continued] = roots[0, first_index[continued] - 1]
+    if not continued.all():
+        reference[~continued] = choose(roots[:, first_index[~continued]], axis=0)
+    upper_run = np.abs(roots[2, first_index] - reference) < np.abs(roots[0, first_index] - reference)
+    upper = np.zeros(chosen.size, dtype=bool)
+    upper[three] = upper_run[np.cumsum(first)[three] - 1]
+    chosen[upper] = roots[2, upper]
+    return chosen.reshape(shape)
@@ -4,13 +4,29 @@ Functions for generating initial parameters used by model `guess` methods.
 from __future__ import absolute_import, division, print_function
 
 import numpy as np
+from scipy import signal
 
 
 def smooth(data, fraction=0.05, flatten_edges=True):
+    """
+    Return the data convolved with a Gaussian kernel whose width is the given fraction of the number of points.
+
+    The convolution is calculated by `scipy.signal.convolve`, which uses the FFT when the kernel is long, so the time
+    grows as n log n instead of as the square of the number of points n; the result is the same as that of
+    np.convolve(kernel, data, mode='same') up to rounding error.
+
+    :param data: real or complex data.
+    :param fraction: the width of the kernel as a fraction of the number of points.
+    :param flatten_edges: if True, replace the points within one kernel width of each end, where the kernel extends
+      past the data, by the first point on each side that does not.
+    :return: array
+    """
     width = int(fraction * data.size)
+    if not width:
+        raise ValueError("The smoothing kernel is empty because the data has too few points.")
     gaussian = np.exp(-np.linspace(-4, 4, width) ** 2)
     gaussian /= np.sum(gaussian)
-    smoothed = np.convolve(gaussian, data, mode='same')
+    smoothed = signal.convolve(data, gaussian, mode='same')
     if flatten_edges:
         smoothed[:width] = smoothed[width]
         smoothed[-width:] = smoothed[-(width + 1)]
@@ -43,19 +59,48 @@ def distances_per_frequency(frequency, data, pad_ends=True):
     :param pad_ends: if True, duplicate the end values so that the returned array has the same size as the data.
     :return: array[float]
     """
-    d = distances(data=data, pad_ends=pad_ends)
+    return distances(data=data, pad_ends=pad_ends) / _frequency_differences(frequency=frequency, pad_ends=pad_ends)
+
+
+def _frequency_differences(frequency, pad_ends=True):
+    """
+    Return an array containing the sum of the nearest-neighbor frequency differences, which normalizes the distances
+    returned by `distances` with the same value of pad_ends.
+    """
     f = np.diff(frequency[:-1]) + np.diff(frequency[1:])
     if pad_ends:
         f = np.concatenate((f[:1], f, f[-1:]))
-    return d / f
+    return f
 
 
 def smallest(values, fraction=0.1):
-    return np.argsort(values)[:int(fraction * values.size)]
+    """
+    Return the indices of the given fraction of the values that are smallest, in no particular order. The selection
+    uses `np.argpartition`, so it takes time proportional to the number of values instead of sorting them.
+
+    :param values: array[float]
+    :param fraction: the fraction of the values to select.
+    :return: array[int]
+    """
+    number = int(fraction * values.size)
+    if number == 0:
+        return np.zeros(0, dtype=np.intp)
+    return np.argpartition(values, number - 1)[:number]
 
 
 def largest(values, fraction=0.1):
-    return np.argsort(values)[-int(fraction * values.size):]
+    """
+    Return the indices of the given fraction of the values that are largest, in no particular order; see `smallest`.
+    As for np.argsort(values)[-number:], every index is returned if the number of values to select is zero.
+
+    :param values: array[float]
+    :param fraction: the fraction of the values to select.
+    :return: array[int]
+    """
+    number = int(fraction * values.size)
+    if number == 0:
+        return np.arange(values.size)
+    return np.argpartition(values, values.size - number)[-number:]
 
 
 def polyfit_phase_delay(frequency, data):
@@ -76,9 +121,21 @@ def polyfit_magnitude_slope_offset(frequency, data):
     return slope, offset
 
 
-def guess_smooth(frequency, data):
-    smooth_data = smooth(data)
-    resonance_frequency = np.median(frequency[largest(distances(smooth_data), fraction=0.1)])
+def guess_smooth(frequency, data, features=None):
+    """
+    Return guesses of the resonance frequency, coupling loss, and internal loss from the smoothed normalized data of a
+    resonator in the shunt or reflection configuration.
+
+    :param frequency: the frequencies at which the data was measured.
+    :param data: the data divided by the background model.
+    :param features: None, or a `Features` object for the data that supplies the smoothed data and its distances, such
+      as the one passed to the `guess` methods by `ResonatorFitter.guess`.
+    :return: tuple (resonance_frequency, coupling_loss, internal_loss) of floats.
+    """
+    if features is None:
+        features = Features(frequency=frequency, data=data)
+    smooth_data = features.smooth_data
+    resonance_frequency = np.median(frequency[largest(features.smooth_distances, fraction=0.1)])
     resonance_index = np.argmin(np.abs(frequency - resonance_frequency))
     linewidth = abs(frequency[np.argmin(smooth_data.imag)] - frequency[np.argmax(smooth_data.imag)])
     internal_plus_coupling = linewidth / resonance_frequency
@@ -86,3 +143,78 @@ def guess_smooth(frequency, data):
     coupling_loss = internal_plus_coupling / (1 + internal_over_coupling)
     internal_loss = internal_plus_coupling / (1 + 1 / internal_over_coupling)
     return resonance_frequency, coupling_loss, internal_loss
+
+
+class Features(object):
+    """
+    This class calculates the quantities that the guessing functions use, such as the nearest-neighbor distances of the
+    data and the smoothed data, once for one data set and only when they are first needed, so that the background and
+    foreground `guess` methods can share them.
+
+    The foreground guess uses the data divided by the guessed background, and the Features object for that data is
+    obtained using divide(). If the background is constant in frequency, as for the MagnitudePhase background model,
+    dividing by it scales the data, so every quantity is obtained by scaling the corresponding quantity of the original
+    data instead of being calculated again.
+    """
+
+    def __init__(self, frequency, data):
+        """
+        :param frequency: the frequencies at which the data was measured.
+        :param data: complex scattering parameter data.
+        """
+        self.frequency = frequency
+        self._data = data
+        self._parent = None
+        self._divisor = None
+        self._values = {}
+
+    def divide(self, divisor):
+        """
+        Return a Features object for the data divided by the given divisor.
+
+        :param divisor: a complex number or an array of complex numbers, such as the background model evaluated at the
+          data frequencies.
+        :return: Features
+        """
+        divisor = np.asarray(divisor)
+        if divisor.ndim and not np.all(divisor == divisor.flat[0]):
+            return Features(frequency=self.frequency, data=self.data / divisor)
+        features = Features(frequency=self.frequency, data=None)
+        features._parent = self
+        features._divisor = complex(divisor.flat[0])
+        return features
+
+    @property
+    def data(self):
+        """The complex data."""
+        return self._get('data', lambda: self._data, magnitude=False)
+
+    @property
+    def distances(self):
+        """The sum of the nearest-neighbor distances of the data; see `distances`."""
+        return self._get('distances', lambda: distances(self.data), magnitude=True)
+
+    @property
+    def distances_per_frequency(self):
+        """The nearest-neighbor distances per frequency difference; see `distances_per_frequency`."""
+        return self._get('distances_per_frequency', lambda: self.distances / _frequency_differences(self.frequency),
+                         magnitude=True)
+
+    @property
+    def smooth_data(self):
+        """The data smoothed by `smooth`."""
+        return self._get('smooth_data', lambda: smooth(self.data), magnitude=False)
+
+    @property
+    def smooth_distances(self):
+        """The sum of the nearest-neighbor distances of the smoothed data."""
+        return self._get('smooth_distances', lambda: distances(self.smooth_data), magnitude=True)
+
+    def _get(self, name, calculate, magnitude):
+        if name not in self._values:
+            if self._parent is None:
+                self._values[name] = calculate()
+            else:
+                divisor = abs(self._divisor) if magnitude else self._divisor
+                self._values[name] = getattr(self._parent, name) / divisor
+        return self._values[name]
@@ -3,12 +3,16 @@ Functions and classes related to resonators with a Kerr-type nonlinearity.
 """
 from __future__ import absolute_import, division, print_function
 
+import functools
+import os
+
 import numpy as np
 
-from . import base
+from . import base, cubic
 
 
-def kerr_detuning_shift(detuning, coupling_loss, internal_loss, kerr_input, io_coupling_coefficient, choose):
+def kerr_detuning_shift(detuning, coupling_loss, internal_loss, kerr_input, io_coupling_coefficient, choose, out=None,
+                        track=False):
     """
     Return one chosen real root of the cubic polynomial
     0 = a y^3 + b y^2 + c y + d
@@ -52,77 +56,133 @@ def kerr_detuning_shift(detuning, coupling_loss, internal_loss, kerr_input, io_c
     guaranteed to stay in one of the bistable states, and it is recommended to collect time-ordered data acquired with
     a large bandwidth in order to detect jumps between the states.
 
+    A global `choose` function is equivalent to following one branch only if the detuning increases or decreases
+    monotonically. With `track=True`, the points are instead taken to be in the order in which they were measured, and
+    the returned root follows the branch of the previous point through each bistable region and jumps to the other
+    branch only where the followed branch disappears, which gives the hysteresis of a swept measurement for any order
+    of the points; see `cubic.track`. In this case, `choose` selects the initial branch only if the first point is in a
+    bistable region.
+
+    The roots are calculated from the depressed cubic t^3 + p t + q = 0, where y = t + 2 x / 3, using the trigonometric
+    form of the solution where there are three real roots and the hyperbolic forms where there is one, so that no
+    complex arithmetic is needed. Only the chosen root is kept, and it is improved by up to `cubic.newton_steps` Newton
+    steps on the original cubic, each kept only if it reduces the magnitude of the cubic. The arrays are updated in
+    place, so that apart from the output only a few temporary arrays of the size of the detuning are allocated. With
+    `track=True` every real root is needed, so the roots are instead calculated by `cubic.real_roots`. Away from
+    bifurcation the relative error of the returned root is a few times the machine precision. Where two roots nearly
+    coincide, which happens at the edges of the bistable region where the discriminant delta is close to zero, the
+    roots are ill-conditioned: the error of either of the two nearly equal roots is of order the square root of the
+    machine precision times their magnitude, which is the same accuracy that np.roots achieves there.
+
     :param detuning: a 1D array[float] or single float; the fractional frequency detuning
     :param coupling_loss: a single float; the inverse coupling quality factor.
     :param internal_loss: a single float; the inverse internal quality factor.
     :param kerr_input: a 1D array[float] or single float; the rescaled input photon rate \chi described above.
     :param io_coupling_coefficient: a single float; the parameter g defined above.
     :param choose: a function used to choose which root to return when the cubic has multiple roots; it is called as
-      choose(np.vstack((array_of_roots_0, ... , array_of_roots_n)), axis=0), with either two or three arrays; see above
-      for recommended functions.
+      choose(np.vstack((array_of_roots_0, array_of_roots_1, array_of_roots_2)), axis=0) for the points with three real
+      roots, where a double root appears twice; see above for recommended functions.
+    :param out: None, or a preallocated float array with the broadcast shape of detuning and kerr_input in which to
+      store the result, which avoids allocating the output array.
+    :param track: if True, follow a continuous branch of roots in the order of the points, as described above.
     :return: array[float]
     """
-    is_scalar = False
-    is_zero_size = False
-    if np.isscalar(detuning):
-        is_scalar = True
-        detuning = np.array([detuning])
-    elif not detuning.shape:
-        is_zero_size = True
-        detuning.shape = (1,)
-    roots = np.zeros(detuning.size)
-    b = -2 * detuning
-    c = ((coupling_loss + internal_loss) / 2) ** 2 + detuning ** 2
-    d = -io_coupling_coefficient * coupling_loss * kerr_input
-    delta0 = b ** 2 - 3 * c
-    delta1 = 2 * b ** 3 - 9 * b * c + 27 * d
-    delta = (4 * delta0 ** 3 - delta1 ** 2) / 27
-    # These boolean arrays partition the result into three cases.
-    three_distinct_real = delta > 0
-    multiple_real = delta == 0
-    one_real = delta < 0
-
-    # Three distinct real roots
-    if three_distinct_real.any():
-        # Cast to complex so that sqrt() returns one of the a complex roots.
-        sqrt_arg = (delta1[three_distinct_real] ** 2 - 4 * delta0[three_distinct_real] ** 3).astype(np.complex)
-        cc_three_distinct_real = ((delta1[three_distinct_real] + np.sqrt(sqrt_arg)) / 2) ** (1 / 3)
-        xi = (-1 + 1j * np.sqrt(3)) / 2
-        x0 = np.real(-1 / 3 * (b[three_distinct_real] + cc_three_distinct_real
-                               + delta0[three_distinct_real] / cc_three_distinct_real))
-        x1 = np.real(-1 / 3 * (b[three_distinct_real] + xi * cc_three_distinct_real
-                               + delta0[three_distinct_real] / (xi * cc_three_distinct_real)))
-        x2 = np.real(-1 / 3 * (b[three_distinct_real] + xi ** 2 * cc_three_distinct_real
-                               + delta0[three_distinct_real] / (xi ** 2 * cc_three_distinct_real)))
-        roots[three_distinct_real] = choose(np.vstack((x0, x1, x2)), axis=0)
-
-    # Three real roots with a multiple root
-    triple = multiple_real & (delta0 == 0)
-    if triple.any():
-        roots[triple] = -b[triple] / 3
-    double_and_simple = multiple_real & (delta0 != 0)  # This occurs exactly at bifurcation
-    if double_and_simple.any():
-        double_root = (9 * d - b[double_and_simple] * c[double_and_simple]) / (2 * delta0[double_and_simple])
-        simple_root = ((4 * b[double_and_simple] * c[double_and_simple] - 9 * d - b[double_and_simple] ** 3)
-                       / delta0[double_and_simple])
-        roots[double_and_simple] = choose(np.vstack((double_root, simple_root)), axis=0)
-
-    # One real root
-    if one_real.any():
-        # One can choose either sign of the square root as long as the argument of the cube root is nonzero.
-        square_root = np.sqrt(delta1[one_real] ** 2 - 4 * delta0[one_real] ** 3)
-        plus = (delta1[one_real] + square_root) / 2
-        minus = (delta1[one_real] - square_root) / 2
-        cbrt_argument = np.where(plus != 0, plus, minus)
-        cc_one_real = np.cbrt(cbrt_argument)
-        roots[one_real] = np.real(-(b[one_real] + cc_one_real + delta0[one_real] / cc_one_real) / 3)
-
-    if is_scalar or is_zero_size:
-        return roots[0]
+    detuning = np.asarray(detuning, dtype='float')
+    is_scalar = not detuning.shape and not np.shape(kerr_input)
+    half_loss_squared = ((coupling_loss + internal_loss) / 2) ** 2
+    d = -io_coupling_coefficient * coupling_loss * np.asarray(kerr_input, dtype='float')
+    shape = np.broadcast(detuning, d).shape or (1,)
+    x = np.broadcast_to(detuning, shape)
+    d = np.broadcast_to(d, shape)
+    if out is None or is_scalar:
+        out = np.empty(shape)
+    if track:
+        out[:] = cubic.track(cubic.real_roots(1, -2 * x, half_loss_squared + x ** 2, d), choose=choose)
+    else:
+        _chosen_root(x=x, d=d, half_loss_squared=half_loss_squared, choose=choose, out=out)
+    if is_scalar:
+        return out[0]
     else:
-        return roots
+        return out
 
-    # ToDo: check math
+
+def _chosen_root(x, d, half_loss_squared, choose, out):
+    """
+    Store in `out` the root of y^3 - 2 x y^2 + [(loss_i + loss_c)^2 / 4 + x^2] y + d = 0 that is chosen by `choose`
+    where there are three real roots, polished with Newton steps; see `kerr_detuning_shift`.
+    """
+    # Substitute y = t + 2 x / 3 to obtain the depressed cubic t^3 + p t + q = 0, with
+    #   p = (loss_i + loss_c)^2 / 4 - x^2 / 3 and q = x (2 x^2 / 27 + (loss_i + loss_c)^2 / 6) + d.
+    # The arrays are updated in place to limit the number of temporary arrays.
+    p = np.multiply(x, x)
+    q = p * (2 / 27)
+    q += 2 * half_loss_squared / 3
+    q *= x
+    q += d
+    p *= -1 / 3
+    p += half_loss_squared
+    # The discriminant of the depressed cubic is -(4 p^3 + 27 q^2), so there are three real roots, counting a double
+    # root twice, where this is non-positive and p is negative; p is positive if |x| < sqrt(3) (loss_i + loss_c) / 2.
+    discriminant = np.square(q)
+    discriminant *= 27
+    discriminant += 4 * p ** 3
+    three_real = discriminant <= 0
+    three_real &= p < 0
+    one_real = ~three_real
+    with np.errstate(divide='ignore', invalid='ignore'):
+        positive = p > 0
+        if positive.any():
+            m = 2 * np.sqrt(p[positive] / 3)
+            out[positive] = -m * np.sinh(np.arcsinh(3 * q[positive] / (p[positive] * m)) / 3)
+        negative = one_real & (p < 0)
+        if negative.any():
+            m = 2 * np.sqrt(-p[negative] / 3)
+            argument = np.maximum(-3 * np.abs(q[negative]) / (p[negative] * m), 1)
+            out[negative] = -np.sign(q[negative]) * m * np.cosh(np.arccosh(argument) / 3)
+        zero = p == 0
+        if zero.any():
+            out[zero] = np.cbrt(-q[zero])
+        out[one_real] += 2 * x[one_real] / 3
+        if three_real.any():
+            m = 2 * np.sqrt(-p[three_real] / 3)
+            theta = np.arccos(np.clip(3 * q[three_real] / (p[three_real] * m), -1, 1)) / 3
+            shift = 2 * x[three_real] / 3
+            roots = np.empty((3, theta.size))
+            for k in range(3):
+                np.cos(theta - 2 * np.pi * k / 3, out=roots[k])
+            roots *= m
+            roots += shift
+            out[three_real] = choose(roots, axis=0)
+        # Polish with Newton steps, reusing the arrays: p holds the coefficient of y, q the polished roots, and
+        # discriminant the slope.
+        np.multiply(x, x, out=p)
+        p += half_loss_squared
+        value = out - 2 * x
+        value *= out
+        value += p
+        value *= out
+        value += d
+        polished_value = np.empty_like(value)
+        better = three_real  # Reuse the boolean array.
+        for step in range(cubic.newton_steps):
+            np.multiply(out, 3, out=discriminant)
+            discriminant -= 4 * x
+            discriminant *= out
+            discriminant += p
+            np.divide(value, discriminant, out=q)
+            np.subtract(out, q, out=q)
+            np.multiply(x, -2, out=polished_value)
+            polished_value += q
+            polished_value *= q
+            polished_value += p
+            polished_value *= q
+            polished_value += d
+            # Near a double root the slope vanishes, so keep the step only if it reduces the value of the cubic.
+            np.less(np.abs(polished_value), np.abs(value), out=better)
+            if not better.any():
+                break
+            np.copyto(out, q, where=better)
+            np.copyto(value, polished_value, where=better)
 
 
 def absolute_kerr_input_at_bifurcation(coupling_loss, internal_loss, io_coupling_coefficient):
@@ -130,6 +190,416 @@ def absolute_kerr_input_at_bifurcation(coupling_loss, internal_loss, io_coupling
             / (3 ** (3 / 2) * io_coupling_coefficient * coupling_loss))
 
 
+def bistable_detuning(coupling_loss, internal_loss, kerr_input, io_coupling_coefficient, tolerance=1e-15,
+                      max_iterations=100):
+    """
+    Return the edges of the interval of detuning in which `kerr_detuning_shift` has three real roots, corresponding to
+    two stable states of the resonator, for arrays of parameters.
+
+    At an edge the cubic has a double root, so both the cubic and its derivative with respect to y vanish. With
+    L = loss_i + loss_c, these two equations are solved by
+      x = sign(\\chi) L (w + 3 / w) / 4 and y = sign(\\chi) L (w + 1 / w) / 4,
+    where w > 0 is a root of
+      (w^2 + 1)^2 = 4 K w^3, with K = 4 |\\chi| / (3^(3 / 2) \\chi_b),
+    and \\chi_b is the value returned by `absolute_kerr_input_at_bifurcation`. In terms of t = ln(w), the equation is
+    phi(t) = 2 ln(e^(2 t) + 1) - 3 t - ln(4 K) = 0, where phi is convex with its minimum at w = sqrt(3). If |\\chi| is
+    larger than \\chi_b, there are two roots, one on each side of the minimum. Newton's method started from the
+    asymptotes of phi converges to each of them monotonically, so the calculation is vectorized with no branches and
+    each iteration costs a few operations per element. At bifurcation, where |\\chi| = \\chi_b, the two edges meet at
+    x = sign(\\chi) sqrt(3) L / 2, and near it the convergence becomes linear, so max_iterations limits the time.
+
+    :param coupling_loss: a float or array of floats; the inverse coupling quality factor.
+    :param internal_loss: a float or array of floats; the inverse internal quality factor.
+    :param kerr_input: a float or array of floats; the rescaled input photon rate \\chi; see `kerr_detuning_shift`.
+    :param io_coupling_coefficient: a float or array of floats; the parameter g; see `kerr_detuning_shift`.
+    :param tolerance: the iteration stops when every step in t is smaller than this.
+    :param max_iterations: the maximum number of Newton steps.
+    :return: a tuple (lower, upper) of arrays with the broadcast shape of the arguments containing the lower and upper
+      edges of the bistable interval of detuning; both are NaN where |\\chi| <= \\chi_b, so there is no bistability.
+    """
+    coupling_loss, internal_loss, kerr_input, io_coupling_coefficient = np.broadcast_arrays(
+        *[np.asarray(value, dtype='float') for value in (coupling_loss, internal_loss, kerr_input,
+                                                        io_coupling_coefficient)])
+    total_loss = coupling_loss + internal_loss
+    reduced_input = np.abs(kerr_input) / absolute_kerr_input_at_bifurcation(
+        coupling_loss=coupling_loss, internal_loss=internal_loss, io_coupling_coefficient=io_coupling_coefficient)
+    bistable = reduced_input > 1
+    log_4k = np.log(16 * reduced_input[bistable] / 3 ** (3 / 2))
+    # The large-t asymptote of phi is t - ln(4 K) and the small-t asymptote is -3 t - ln(4 K).
+    t = np.stack((-log_4k / 3, log_4k))
+    for _ in range(max_iterations):
+        exp_2t = np.exp(2 * t)
+        phi = 2 * np.log1p(exp_2t) - 3 * t - log_4k
+        step = phi / (4 * exp_2t / (1 + exp_2t) - 3)
+        t -= step
+        if not np.any(np.abs(step) > tolerance):
+            break
+    w = np.exp(t)
+    edges = np.full((2,) + bistable.shape, np.nan)
+    edges[:, bistable] = np.sign(kerr_input[bistable]) * total_loss[bistable] * (w + 3 / w) / 4
+    edges.sort(axis=0)
+    return edges[0], edges[1]
+
+
+def invert(z, coupling_loss, kerr_input, io_coupling_coefficient):
+    """
+    Return the detuning and internal loss that correspond to the given values of
+      z = loss_i + 2j (x - y),
+    which is the quantity in the denominator of the Kerr scattering models, calculated from normalized data as in the
+    `invert` methods of the linear fitters; here x is the detuning and y is the Kerr detuning shift. In the notation of
+    `kerr_detuning_shift`, the cubic for the shift is
+      y [(loss_i + loss_c)^2 / 4 + (x - y)^2] = y |z + loss_c|^2 / 4 = g loss_c \\chi,
+    so the data determine the shift directly as y = 4 g loss_c \\chi / |z + loss_c|^2, with no root to choose: the
+    data show which branch the resonator was on. This is exact for every point, including points in the bistable
+    region, and costs a few array operations.
+
+    :param z: a complex or array of complex values of z.
+    :param coupling_loss: the inverse coupling quality factor.
+    :param kerr_input: the rescaled input photon rate \\chi; see `kerr_detuning_shift`.
+    :param io_coupling_coefficient: the parameter g; see `kerr_detuning_shift`.
+    :return: detuning, internal_loss; both float or array[float].
+    """
+    shift = 4 * io_coupling_coefficient * coupling_loss * kerr_input / np.abs(z + coupling_loss) ** 2
+    return z.imag / 2 + shift, z.real
+
+
+def detuning_shift_derivatives(detuning, shift, coupling_loss, internal_loss, kerr_input, io_coupling_coefficient):
+    """
+    Return the partial derivatives of a root y of the cubic in `kerr_detuning_shift` with respect to the detuning and
+    the parameters, calculated by implicit differentiation of the cubic F(y) = 0 at the given root:
+      dy / dp = -(dF / dp) / (dF / dy).
+    This requires only the root, so the derivatives of the root chosen by the model cost a few array operations
+    instead of another solve for each parameter. They diverge at the edges of the bistable region, where dF / dy = 0
+    and the root disappears.
+
+    :param detuning: a float or array of floats; the fractional frequency detuning x.
+    :param shift: a float or array of floats; the root y at each detuning, as returned by `kerr_detuning_shift`.
+    :param coupling_loss: the inverse coupling quality factor.
+    :param internal_loss: the inverse internal quality factor.
+    :param kerr_input: the rescaled input photon rate \\chi.
+    :param io_coupling_coefficient: the parameter g.
+    :return: dict that maps 'detuning', 'coupling_loss', 'internal_loss', and 'kerr_input' to the derivative of y.
+    """
+    half_loss = (coupling_loss + internal_loss) / 2
+    d_shift = 3 * shift ** 2 - 4 * detuning * shift + half_loss ** 2 + detuning ** 2
+    return {'detuning': -2 * shift * (detuning - shift) / d_shift,
+            'coupling_loss': (io_coupling_coefficient * kerr_input - half_loss * shift) / d_shift,
+            'internal_loss': -half_loss * shift / d_shift,
+            'kerr_input': io_coupling_coefficient * coupling_loss / d_shift}
+
+
+class DetuningShiftTable(object):
+    """
+    This class evaluates `kerr_detuning_shift` faster by interpolating a precalculated table of roots.
+
+    In terms of the reduced detuning s = x / L, the reduced shift u = y / L, where L = loss_i + loss_c is the total
+    loss, and the ratio r = \\chi / \\chi_b of the rescaled input photon rate to its absolute value at bifurcation
+    \\chi_b (see `absolute_kerr_input_at_bifurcation`), the cubic in `kerr_detuning_shift` becomes
+      0 = u^3 - 2 s u^2 + (1 / 4 + s^2) u - r / 3^(3 / 2),
+    so the shift depends only on s and r. The table contains u on a grid of s and r that is densest near zero. For one
+    value of kerr_input, which is the case during a fit, evaluation interpolates the table linearly in r to obtain u as
+    a function of s, interpolates this with `np.interp` at every point, and then improves each value with Newton steps
+    on the exact cubic. The Newton steps make the values as accurate as those of `kerr_detuning_shift` and the fits
+    are unchanged. A value is kept only if the polished root is the only real root and it satisfies the cubic to nearly
+    machine precision. The remaining points are passed to `kerr_detuning_shift`: points in a bistable region, where
+    `choose` selects the root; points near a bifurcation, where Newton steps converge slowly; and any point outside
+    the table. All points also go to `kerr_detuning_shift` if kerr_input is an array.
+
+    Calculating the default table takes a fraction of a second, and `detuning_shift_table` caches it on disk and in
+    memory so that it is calculated only once.
+    """
+
+    num_newton_steps = 2
+    # The largest accepted magnitude of the cubic relative to the sum of the magnitudes of its terms.
+    tolerance = 1e-14
+
+    def __init__(self, reduced_detuning, reduced_input, reduced_shift):
+        """
+        :param reduced_detuning: an increasing 1D array[float]; the grid of reduced detuning s.
+        :param reduced_input: an increasing 1D array[float]; the grid of the ratio r.
+        :param reduced_shift: a 2D array[float] with shape (reduced_input.size, reduced_detuning.size) containing u.
+        """
+        self.reduced_detuning = np.asarray(reduced_detuning, dtype='float')
+        self.reduced_input = np.asarray(reduced_input, dtype='float')
+        self.reduced_shift = np.asarray(reduced_shift, dtype='float')
+
+    @classmethod
+    def calculate(cls, num_detuning=2001, num_input=401, max_reduced_detuning=100, max_reduced_input=1000):
+        """
+        Return a new table calculated using `kerr_detuning_shift`. Both grids are symmetric about zero, with spacing
+        that increases linearly with distance from zero.
+
+        :param num_detuning: the number of points in the reduced detuning grid.
+        :param num_input: the number of points in the reduced input grid.
+        :param max_reduced_detuning: the largest magnitude of the reduced detuning in the table.
+        :param max_reduced_input: the largest magnitude of the ratio r in the table.
+        :return: DetuningShiftTable
+        """
+        reduced_detuning = _symmetric_grid(num_points=num_detuning, maximum=max_reduced_detuning, spacing=0.05)
+        reduced_input = _symmetric_grid(num_points=num_input, maximum=max_reduced_input, spacing=0.5)
+        s, r = np.meshgrid(reduced_detuning, reduced_input)
+        # With coupling_loss = internal_loss = 1 / 2 the total loss is 1, so the detuning and shift are reduced.
+        kerr_input = r.ravel() * absolute_kerr_input_at_bifurcation(coupling_loss=1 / 2, internal_loss=1 / 2,
+                                                                    io_coupling_coefficient=1)
+        reduced_shift = kerr_detuning_shift(detuning=s.ravel(), coupling_loss=1 / 2, internal_loss=1 / 2,
+                                            kerr_input=kerr_input, io_coupling_coefficient=1,
+                                            choose=np.max).reshape(s.shape)
+        return cls(reduced_detuning=reduced_detuning, reduced_input=reduced_input, reduced_shift=reduced_shift)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Return a table saved by `save`.
+
+        :param path: the path of a .npz file.
+        :return: DetuningShiftTable
+        """
+        with np.load(path) as arrays:
+            return cls(reduced_detuning=arrays['reduced_detuning'], reduced_input=arrays['reduced_input'],
+                       reduced_shift=arrays['reduced_shift'])
+
+    def save(self, path):
+        """
+        Save the table in a NumPy .npz file.
+
+        :param path: the path of the file.
+        :return: None
+        """
+        np.savez(path, reduced_detuning=self.reduced_detuning, reduced_input=self.reduced_input,
+                 reduced_shift=self.reduced_shift)
+
+    def __call__(self, detuning, coupling_loss, internal_loss, kerr_input, io_coupling_coefficient, choose, out=None):
+        """
+        Return the same value as `kerr_detuning_shift` with the same arguments; see the class docstring.
+
+        :return: array[float]
+        """
+        if np.shape(kerr_input):
+            return kerr_detuning_shift(detuning=detuning, coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                       kerr_input=kerr_input, io_coupling_coefficient=io_coupling_coefficient,
+                                       choose=choose, out=out)
+        detuning = np.asarray(detuning, dtype='float')
+        is_scalar = not detuning.shape
+        x = np.atleast_1d(detuning)
+        if out is None or is_scalar:
+            out = np.empty(x.shape)
+        total_loss = coupling_loss + internal_loss
+        r = kerr_input / absolute_kerr_input_at_bifurcation(coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                                            io_coupling_coefficient=io_coupling_coefficient)
+        reduced_shift = self._reduced_shift(r)
+        if reduced_shift is None:
+            accept = np.zeros(x.shape, dtype=bool)
+        else:
+            y = np.interp(x / total_loss, self.reduced_detuning, reduced_shift)
+            y *= total_loss
+            # The coefficients of the monic cubic y^3 + b y^2 + c y + d.
+            b = -2 * x
+            c = x ** 2
+            c += total_loss ** 2 / 4
+            d = -io_coupling_coefficient * coupling_loss * kerr_input
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for _ in range(self.num_newton_steps):
+                    value = ((y + b) * y + c) * y + d
+                    y -= value / ((3 * y + 2 * b) * y + c)
+                value = ((y + b) * y + c) * y + d
+                magnitude = np.abs(y)
+                scale = ((magnitude + np.abs(b)) * magnitude + c) * magnitude + np.abs(d)
+                accept = np.abs(value) <= self.tolerance * scale
+                # Dividing the cubic by (y - root) leaves y^2 + B y + C, with B = b + root and C = c + B root; the other
+                # two roots are real if B^2 - 4 C is not negative, and the margin sends nearly double roots to the
+                # exact solver too.
+                b += y
+                c += b * y
+                discriminant = b ** 2
+                discriminant -= 4 * c
+                accept &= discriminant < -self.tolerance * (b ** 2 + 4 * np.abs(c))
+            out[accept] = y[accept]
+        exact = ~accept
+        if exact.any():
+            out[exact] = kerr_detuning_shift(detuning=x[exact], coupling_loss=coupling_loss,
+                                             internal_loss=internal_loss, kerr_input=kerr_input,
+                                             io_coupling_coefficient=io_coupling_coefficient, choose=choose)
+        if is_scalar:
+            return out[0]
+        else:
+            return out
+
+    def _reduced_shift(self, r):
+        """Return the table row for the given ratio r, interpolated linearly, or None if r is outside the table."""
+        if not self.reduced_input[0] <= r <= self.reduced_input[-1]:
+            return None
+        index = min(np.searchsorted(self.reduced_input, r, side='right') - 1, self.reduced_input.size - 2)
+        weight = (r - self.reduced_input[index]) / (self.reduced_input[index + 1] - self.reduced_input[index])
+        return (1 - weight) * self.reduced_shift[index] + weight * self.reduced_shift[index + 1]
+
+
+def _symmetric_grid(num_points, maximum, spacing):
+    """
+    Return an increasing grid from -maximum to maximum with num_points points whose spacing is about the given spacing
+    near zero and increases linearly with distance from zero.
+    """
+    return spacing * np.sinh(np.linspace(-1, 1, num_points) * np.arcsinh(maximum / spacing))
+
+
+default_table_path = os.path.join(os.path.expanduser('~'), '.cache', 'resonator', 'kerr_detuning_shift_table.npz')
+_default_table = None
+
+
+def detuning_shift_table(path=default_table_path):
+    """
+    Return the default DetuningShiftTable. It is loaded from the given path if the file exists; otherwise, it is
+    calculated and saved there if possible. The table is then kept in memory, so later calls return the same object.
+
+    :param path: the path of the .npz file used to cache the table on disk.
+    :return: DetuningShiftTable
+    """
+    global _default_table
+    if _default_table is None:
+        try:
+            _default_table = DetuningShiftTable.load(path)
+        except (IOError, OSError, KeyError, ValueError):
+            _default_table = DetuningShiftTable.calculate()
+            try:
+                directory = os.path.dirname(path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                _default_table.save(path)
+            except (IOError, OSError):
+                pass
+    return _default_table
+
+
+# The values of kerr_input, relative to its absolute value at bifurcation, that `guess_kerr_input` compares first.
+guess_reduced_inputs = np.concatenate((-np.geomspace(30, 0.1, 15), [0], np.geomspace(0.1, 30, 15)))
+
+# The number of the best values of `guess_reduced_inputs` around which `guess_kerr_input` refines the grid.
+guess_num_cells = 3
+
+# The number of values of kerr_input in each refined cell.
+guess_cell_inputs = 3
+
+# The factors by which `guess_kerr_input` multiplies the guessed total loss in the refined cells.
+guess_loss_scales = np.geomspace(0.5, 2, 3)
+
+# The fractions of the total loss that `guess_kerr_input` assigns to the coupling loss in the refined cells.
+guess_coupling_fractions = np.linspace(0.25, 0.75, 3)
+
+
+def guess_kerr_input(evaluate, frequency, data, resonance_frequency, coupling_loss, internal_loss,
+                     io_coupling_coefficient, reduced_inputs=guess_reduced_inputs, num_cells=guess_num_cells,
+                     cell_inputs=guess_cell_inputs, loss_scales=guess_loss_scales,
+                     coupling_fractions=guess_coupling_fractions, max_points=250, detuning_points=500):
+    """
+    Return initial values of the resonance frequency, losses, and kerr_input for a Kerr model by comparing the data to
+    the model evaluated for a grid of values at once.
+
+    The frequency at which the data changes fastest is shifted from the resonance frequency: below bifurcation it is
+    near the peak of the photon number, and above bifurcation it is at the jump between branches. This frequency is
+    found from a moving average of the data, and for each set of values the shift is found by evaluating the model on
+    a grid of detuning and finding where the model changes fastest, which determines the resonance frequency. The model
+    with each set of values is then evaluated on at most max_points of the data points.
+
+    The first pass compares the values of kerr_input in reduced_inputs with the losses guessed as for a linear
+    resonator. The guessing functions for linear resonators estimate the losses from the width and depth of the
+    resonance, which the nonlinearity distorts, so the second pass refines only the num_cells best values: for each,
+    it compares every combination of cell_inputs values of kerr_input between the neighbors of the value, a factor
+    that multiplies the guessed total loss, and a fraction of the total loss that is the coupling loss. With the
+    default grids the model is evaluated for about a hundred sets of values, and the best set of either pass is
+    returned.
+
+    :param evaluate: a function evaluate(frequency, resonance_frequency, coupling_loss, internal_loss, kerr_input) that
+      returns the normalized model, where every argument after frequency is a column array, so the result is a 2D array
+      with one row per set of values; frequency may also be a 2D array with one row per set of values.
+    :param frequency: an array of floats containing the frequencies at which the data was measured.
+    :param data: an array of complex numbers containing the data divided by the background model.
+    :param resonance_frequency: the resonance frequency guessed as for a linear resonator, which sets the scale of the
+      detuning.
+    :param coupling_loss: the coupling loss guessed as for a linear resonator.
+    :param internal_loss: the internal loss guessed as for a linear resonator.
+    :param io_coupling_coefficient: the parameter g; see `kerr_detuning_shift`.
+    :param reduced_inputs: the increasing values of kerr_input to compare in the first pass, relative to
+      `absolute_kerr_input_at_bifurcation`.
+    :param num_cells: the number of the best values of reduced_inputs that are refined in the second pass.
+    :param cell_inputs: the number of values of kerr_input in each refined cell.
+    :param loss_scales: the factors by which the guessed total loss is multiplied in the second pass.
+    :param coupling_fractions: the fractions of the total loss that are assigned to the coupling loss in the second
+      pass.
+    :param max_points: the data is sampled with a constant stride so that no more than this many points are used.
+    :param detuning_points: the number of points in the detuning grid used to find the shift of the fastest change.
+    :return: tuple (resonance_frequency, coupling_loss, internal_loss, kerr_input) of floats.
+    """
+    stride = max(1, int(np.ceil(frequency.size / max_points)))
+    reduced_inputs = np.asarray(reduced_inputs, dtype='float')
+    scan = functools.partial(
+        _scan_kerr_input, evaluate=evaluate, frequency=frequency[::stride], data=data[::stride],
+        fastest_frequency=_fastest_frequency(frequency=frequency, data=data), resonance_frequency=resonance_frequency,
+        io_coupling_coefficient=io_coupling_coefficient,
+        reduced_detuning=np.linspace(-1, 1, detuning_points) * max(10, 2 * np.max(np.abs(reduced_inputs))))
+    total_loss = coupling_loss + internal_loss
+    coarse = [reduced_inputs, np.full(reduced_inputs.size, total_loss),
+              np.full(reduced_inputs.size, coupling_loss / total_loss)]
+    coarse_cost, coarse_resonance_frequencies = scan(*coarse)
+    cells = np.argsort(coarse_cost)[:num_cells]
+    refined_inputs = np.concatenate([np.linspace(*_neighbors(reduced_inputs, cell), num=cell_inputs)
+                                     for cell in cells])
+    refined = [grid.ravel() for grid in np.meshgrid(
+        refined_inputs, total_loss * np.asarray(loss_scales, dtype='float'),
+        np.asarray(coupling_fractions, dtype='float'), indexing='ij')]
+    refined_cost, refined_resonance_frequencies = scan(*refined)
+    if coarse_cost[cells[0]] <= np.min(refined_cost):
+        values, resonance_frequencies, best = coarse, coarse_resonance_frequencies, cells[0]
+    else:
+        values, resonance_frequencies, best = refined, refined_resonance_frequencies, np.argmin(refined_cost)
+    reduced_input, best_total_loss, coupling_fraction = [value[best] for value in values]
+    best_coupling_loss = coupling_fraction * best_total_loss
+    best_internal_loss = best_total_loss - best_coupling_loss
+    kerr_input = reduced_input * absolute_kerr_input_at_bifurcation(
+        coupling_loss=best_coupling_loss, internal_loss=best_internal_loss,
+        io_coupling_coefficient=io_coupling_coefficient)
+    return resonance_frequencies[best], best_coupling_loss, best_internal_loss, kerr_input
+
+
+def _scan_kerr_input(reduced_input, total_loss, coupling_fraction, evaluate, frequency, data, fastest_frequency,
+                     resonance_frequency, io_coupling_coefficient, reduced_detuning):
+    """
+    Evaluate the model for each set of values in the given 1D arrays, as described in `guess_kerr_input`, and return
+    the sums of squared residuals and the resonance frequencies of the sets.
+    """
+    reduced_input, total_loss, coupling_fraction = [value[:, np.newaxis] for value in
+                                                    (reduced_input, total_loss, coupling_fraction)]
+    coupling_loss = coupling_fraction * total_loss
+    internal_loss = total_loss - coupling_loss
+    kerr_input = reduced_input * absolute_kerr_input_at_bifurcation(
+        coupling_loss=coupling_loss, internal_loss=internal_loss, io_coupling_coefficient=io_coupling_coefficient)
+    detuning = total_loss * reduced_detuning
+    model = evaluate(resonance_frequency * (1 + detuning), resonance_frequency, coupling_loss, internal_loss,
+                     kerr_input)
+    rows = np.arange(detuning.shape[0])
+    fastest = np.argmax(np.abs(np.diff(model, axis=1)), axis=1)
+    shift = (detuning[rows, fastest] + detuning[rows, fastest + 1]) / 2
+    resonance_frequencies = np.clip(fastest_frequency / (1 + shift), frequency.min(), frequency.max())[:, np.newaxis]
+    model = evaluate(frequency, resonance_frequencies, coupling_loss, internal_loss, kerr_input)
+    return np.sum(np.abs(data - model) ** 2, axis=1), resonance_frequencies[:, 0]
+
+
+def _neighbors(grid, index):
+    """Return the values of the grid on either side of the given index, or the value itself at the ends."""
+    return grid[max(index - 1, 0)], grid[min(index + 1, grid.size - 1)]
+
+
+def _fastest_frequency(frequency, data, fraction=0.02):
+    """
+    Return the frequency at which a moving average of the data, over the given fraction of the points, changes
+    fastest with respect to frequency.
+    """
+    width = max(1, int(fraction * data.size))
+    cumulative = np.concatenate(([0], np.cumsum(data)))
+    average = (cumulative[width:] - cumulative[:-width]) / width
+    average_frequency = (frequency[width - 1:] + frequency[:average.size]) / 2
+    index = np.argmax(np.abs(np.diff(average)) / np.abs(np.diff(average_frequency)))
+    return (average_frequency[index] + average_frequency[index + 1]) / 2
+
+
 def kerr_given_input_rate(input_rate, resonance_frequency, kerr_input):
     return kerr_input * (2 * np.pi * resonance_frequency) ** 2 / input_rate
 
@@ -147,26 +617,82 @@ def photon_number(resonance_frequency, kerr_detuning_shift, kerr_input, input_ra
 class KerrFitter(base.ResonatorFitter):
 
     def __init__(self, frequency, data, choose, foreground_model=None, background_model=None, errors=None,
-                 params=None, **fit_kwds):
+                 params=None, track=False, **fit_kwds):
         """
         :param choose: a numpy ufunc that chooses a number to return given multiple roots; see `kerr_detuning_shift`;
           this is baked into the model function when the model object is created, so if you want to compare the results
           of using another choose function, create a new fitter.
+        :param track: if True, the foreground model follows a continuous branch of roots in the order of the frequency
+          points instead of using `choose` at every point; see `kerr_detuning_shift`. This should be the same value that
+          was used to create the foreground model.
         """
         self._choose = choose  # Modifying this will lead to inconsistent results
+        self._track = track
         super(KerrFitter, self).__init__(frequency=frequency, data=data, foreground_model=foreground_model,
                                          background_model=background_model, errors=errors, params=params, **fit_kwds)
 
-    def photon_number(self, input_frequency, input_rate, choose=None):
+    def photon_number(self, input_frequency, input_rate, choose=None, track=None, kerr_coefficient=None,
+                      fitted_input_rate=None):
+        """
+        Return the average photon number in the resonator at the given input frequency and input rate.
+
+        The fit determines kerr_input, which is proportional to the product of the Kerr coefficient and the input rate
+        of the fitted data, but not the two separately. If the Kerr coefficient is given, or the input rate of the
+        fitted data from which it is calculated by kerr_coefficient(), kerr_input is calculated from each given input
+        rate, so an array of input rates gives the photon number at different input powers. The arguments broadcast
+        together, so photon_number(frequency, rate[:, np.newaxis], kerr_coefficient=K) returns a grid with one row per
+        input rate, calculated by one call to `kerr_detuning_shift`; with track=True, each row is tracked separately in
+        the order of the frequencies. If neither is given, the given input rate is taken to be that of the fitted data,
+        which determines the Kerr coefficient, and the photon number is calculated with the fitted kerr_input. The
+        nonlinearity would then not change with the input rate, so in this case a ValueError is raised if the input
+        rate adds points to the frequencies, as it does for a grid of input rates.
+
+        :param input_frequency: float or array[float]; the frequency of the input signal, in Hz.
+        :param input_rate: float or array[float]; the input photon rate, in photons per second.
+        :param choose: a function used to choose the root; the default is the one used by the fitter.
+        :param track: if True, follow a continuous branch of roots along the last axis; the default is the value used
+          by the fitter.
+        :param kerr_coefficient: None, or the Kerr coefficient K in s^-1.
+        :param fitted_input_rate: None, or the input photon rate of the fitted data, in photons per second, used to
+          calculate the Kerr coefficient if it is not given.
+        :return: float or array[float]
+        """
         if choose is None:
             choose = self._choose
-        detuning = input_frequency / self.resonance_frequency - 1
+        if track is None:
+            track = self._track
+        if kerr_coefficient is None and fitted_input_rate is not None:
+            kerr_coefficient = self.kerr_coefficient(input_rate=fitted_input_rate)
+        if kerr_coefficient is None and np.broadcast(input_frequency, input_rate).size != np.size(input_frequency):
+            raise ValueError("The photon number at input rates other than that of the fitted data requires "
+                             "kerr_coefficient or fitted_input_rate.")
+        detuning = np.asarray(input_frequency, dtype='float') / self.resonance_frequency - 1
+        if kerr_coefficient is None:
+            kerr_input = self.kerr_input
+        else:
+            kerr_input = kerr_coefficient * np.asarray(input_rate, dtype='float') / (
+                2 * np.pi * self.resonance_frequency) ** 2
         shift = kerr_detuning_shift(
             detuning=detuning, coupling_loss=self.coupling_loss, internal_loss=self.internal_loss,
-            kerr_input=self.kerr_input, io_coupling_coefficient=self.foreground_model.io_coupling_coefficient,
-            choose=choose)
-        return photon_number(resonance_frequency=self.resonance_frequency, kerr_detuning_shift=shift,
-                             kerr_input=self.kerr_input, input_rate=input_rate)
+            kerr_input=kerr_input, io_coupling_coefficient=self.foreground_model.io_coupling_coefficient,
+            choose=choose, track=track)
+        if kerr_coefficient is None:
+            return photon_number(resonance_frequency=self.resonance_frequency, kerr_detuning_shift=shift,
+                                 kerr_input=self.kerr_input, input_rate=input_rate)
+        # This equals photon_number() but is also correct where the input rate is zero.
+        return 2 * np.pi * self.resonance_frequency * shift / kerr_coefficient
+
+    def bistable_frequency(self):
+        """
+        Return the lower and upper edges of the frequency interval in which the best-fit model is bistable, which are
+        both NaN if it is not; see `bistable_detuning`.
+
+        :return: tuple[float]
+        """
+        lower, upper = bistable_detuning(coupling_loss=self.coupling_loss, internal_loss=self.internal_loss,
+                                         kerr_input=self.kerr_input,
+                                         io_coupling_coefficient=self.foreground_model.io_coupling_coefficient)
+        return self.resonance_frequency * (1 + lower), self.resonance_frequency * (1 + upper)
 
     def kerr_coefficient(self, input_rate):
         return kerr_given_input_rate(input_rate=input_rate, resonance_frequency=self.resonance_frequency,
@@ -177,8 +703,6 @@ class KerrFitter(base.ResonatorFitter):
                                      kerr_input=self.kerr_input)
 
 
-# ToDo: use these slow functions to check the fast function above.
-
 def chosen_photon_number(detuning, coupling_loss, internal_loss, normalized_kerr, normalized_input, choose):
     roots = [choose(roots) for roots in photon_number_roots(
         detuning=detuning, coupling_loss=coupling_loss, internal_loss=internal_loss,
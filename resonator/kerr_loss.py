@@ -5,11 +5,11 @@ from __future__ import absolute_import, division, print_function
 
 import numpy as np
 
-from . import base
+from . import base, cubic
 
 
 def photon_number(detuning, coupling_loss, internal_loss, nonlinear_loss, reduced_kerr, reduced_input_rate,
-                  io_coupling_coefficient, choose):
+                  io_coupling_coefficient, choose, track=False):
     """
     Return one chosen real root of a cubic polynomial that arises when considering a resonator with hamiltonian
       H = \hbar \omega_r a^\dag a + (\hbar K / 2) a^\dag a^\dag a a,
@@ -33,13 +33,18 @@ def photon_number(detuning, coupling_loss, internal_loss, nonlinear_loss, reduce
     The input power is P_{in} = \hbar \omega X_{in}.
 
     The `choose` function selects one real root when there are multiple real roots that correspond to multiple stable
-    photon number states in the resonator. The recommended value of this function is `np.min` when fitting data taken
-    with a VNA that sweeps the frequency in the positive direction, as is typically done. If the frequency is swept in
-    the negative direction, the recommended value is `np.min`.
+    photon number states in the resonator. The recommended value of this function is `choose_min` when fitting data
+    taken with a VNA that sweeps the frequency in the positive direction, as is typically done. If the frequency is
+    swept in the negative direction, the recommended value is `choose_min`.
 
     Note that the resonator is not
     guaranteed to stay in one of the bistable states, and it is recommended to collect time-ordered data acquired with
-    a large bandwidth in order to detect jumps between the states.
+    a large bandwidth in order to detect jumps between the states. With `track=True`, the points are taken to be in the
+    order in which they were measured and the returned root follows a continuous branch of roots, as described in
+    `kerr.kerr_detuning_shift` and `cubic.track`.
+
+    The roots at all detuning points are calculated at once by `cubic.real_roots`; the slow functions
+    `one_photon_number` and `photon_number_roots` below, which call `np.roots` at each point, give the same results.
 
     :param detuning: a 1D array[float] or single float; the fractional frequency detuning
     :param coupling_loss: a single float; the inverse coupling quality factor.
@@ -47,26 +52,29 @@ def photon_number(detuning, coupling_loss, internal_loss, nonlinear_loss, reduce
     :param nonlinear_loss: a
     :param kerr_input: a 1D array[float] or single float; the rescaled input photon rate \chi described above.
     :param io_coupling_coefficient: a single float; the parameter g defined above.
-    :param choose: a function used to choose which root to return when the cubic has multiple roots; it is called as
-      choose(np.vstack((array_of_roots_0, ... , array_of_roots_n)), axis=0), with either two or three arrays; see above
-      for recommended functions.
-    :return: array[float]
+    :param choose: a function used to choose which root to return when the cubic has multiple real roots; it is called
+      as choose(roots, axis=0), where roots is an array with shape (3,) + the shape of the photon numbers that contains
+      the real roots at each point and NaN in place of complex roots, so it must ignore NaN values; see `choose_min` and
+      `choose_max`.
+    :param track: if True, follow a continuous branch of roots in the order of the points; `choose` then selects only
+      the initial branch if the first point has three real roots. If the arguments broadcast to a 2D array, each row
+      is tracked separately.
+    :return: array[float] with the broadcast shape of detuning and reduced_input_rate.
     """
-    is_scalar = False
-    is_zero_size = False
-    if np.isscalar(detuning):
-        is_scalar = True
-        detuning = np.array([detuning])
-    elif not detuning.shape:
-        is_zero_size = True
-        detuning.shape = (1,)
-    roots = [one_photon_number(x, coupling_loss, internal_loss, nonlinear_loss, reduced_kerr,
-                               reduced_input_rate, io_coupling_coefficient, choose)
-             for x in detuning]
-    if is_scalar or is_zero_size:
-        return roots[0]
+    is_scalar = not np.shape(detuning) and not np.shape(reduced_input_rate)
+    detuning = np.atleast_1d(detuning)
+    roots = cubic.real_roots(*photon_number_cubic(
+        detuning=detuning, coupling_loss=coupling_loss, internal_loss=internal_loss, nonlinear_loss=nonlinear_loss,
+        reduced_kerr=reduced_kerr, reduced_input_rate=reduced_input_rate,
+        io_coupling_coefficient=io_coupling_coefficient))
+    if track:
+        photon_numbers = cubic.track(roots, choose=choose)
+    else:
+        photon_numbers = choose(roots, axis=0)
+    if is_scalar:
+        return photon_numbers[0]
     else:
-        return np.array(roots)
+        return photon_numbers
 
 
 def one_photon_number(detuning, coupling_loss, internal_loss, nonlinear_loss, reduced_kerr, reduced_input_rate,
@@ -91,38 +99,239 @@ def photon_number_cubic(detuning, coupling_loss, internal_loss, nonlinear_loss,
     b = -(2 * detuning * reduced_kerr + (coupling_loss + internal_loss) * nonlinear_loss / 4)
     c = ((coupling_loss + internal_loss) / 2) ** 2 + detuning ** 2
     d = -io_coupling_coefficient * coupling_loss * reduced_input_rate
-    return np.array([a, b, c, d])
+    return a, b, c, d
 
 
-def choose_min(roots):
-    return np.min(roots[roots.imag == 0].real)
+def bistable_detuning(coupling_loss, internal_loss, nonlinear_loss, reduced_kerr, reduced_input_rate,
+                      io_coupling_coefficient):
+    """
+    Return the edges of the interval of detuning in which `photon_number` has three real roots, for arrays of
+    parameters.
+
+    The coefficients of the cubic returned by `photon_number_cubic` are a, b = b_0 + b_1 x, c = c_0 + c_1 x + c_2 x^2,
+    and d, where x is the detuning. At an edge the cubic has a double root n, so both the cubic and its derivative with
+    respect to n vanish. Eliminating c between these equations gives b = d / n^2 - 2 a n, which determines
+      x = (d - b_0 n^2 - 2 a n^3) / (b_1 n^2),
+    and substituting this into the derivative gives a polynomial of degree six in n:
+      b_1^2 (-a n^6 + c_0 n^4 + 2 d n^3) + c_1 b_1 n^2 P(n) + c_2 P(n)^2 = 0, with P(n) = d - b_0 n^2 - 2 a n^3.
+    The roots of these polynomials are calculated for all parameters at once as the eigenvalues of a stack of companion
+    matrices, and each real positive root is polished with one Newton step. The edges are the smallest and largest of
+    the corresponding values of x.
 
+    :param coupling_loss: a float or array of floats; the inverse coupling quality factor.
+    :param internal_loss: a float or array of floats; the inverse internal quality factor.
+    :param nonlinear_loss: a float or array of floats; the nonlinear loss.
+    :param reduced_kerr: a float or array of floats; the reduced Kerr coefficient.
+    :param reduced_input_rate: a float or array of floats; the reduced input rate.
+    :param io_coupling_coefficient: a float or array of floats; the parameter g.
+    :return: a tuple (lower, upper) of arrays with the broadcast shape of the arguments containing the lower and upper
+      edges of the bistable interval of detuning; both are NaN where there is no bistability, including where the
+      reduced Kerr coefficient is zero.
+    """
+    arguments = np.broadcast_arrays(*[np.asarray(value, dtype='float') for value in (
+        coupling_loss, internal_loss, nonlinear_loss, reduced_kerr, reduced_input_rate, io_coupling_coefficient)])
+    shape = arguments[0].shape
+    coupling_loss, internal_loss, nonlinear_loss, reduced_kerr, reduced_input_rate, io_coupling_coefficient = [
+        argument.ravel() for argument in arguments]
 
-def choose_max(roots):
-    return np.max(roots[roots.imag == 0].real)
+    def cubic_at(detuning):
+        return photon_number_cubic(detuning=detuning, coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                   nonlinear_loss=nonlinear_loss, reduced_kerr=reduced_kerr,
+                                   reduced_input_rate=reduced_input_rate,
+                                   io_coupling_coefficient=io_coupling_coefficient)
+
+    a, b_0, c_0, d = np.broadcast_arrays(*cubic_at(0))
+    _, b_plus, c_plus, _ = cubic_at(1)
+    _, b_minus, c_minus, _ = cubic_at(-1)
+    b_1 = b_plus - b_0
+    c_1 = (c_plus - c_minus) / 2
+    c_2 = (c_plus + c_minus) / 2 - c_0
+    zero = np.zeros_like(a)
+    # The coefficients of P(n) and of the sextic, in order of decreasing powers of n.
+    p = np.stack((-2 * a, -b_0, zero, d))
+    sextic = np.stack((-a * b_1 ** 2, zero, c_0 * b_1 ** 2, 2 * d * b_1 ** 2, zero, zero, zero))
+    sextic[1:5] += c_1 * b_1 * p
+    for i in range(4):
+        sextic[i:i + 4] += c_2 * p[i] * p
+    valid = (b_1 != 0) & (sextic[0] != 0)
+    roots = np.full((6, a.size), np.nan + 0j)
+    if valid.any():
+        roots[:, valid] = _polynomial_roots(sextic[:, valid])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        real = np.abs(roots.imag) <= 1e-6 * np.abs(roots)
+        n = np.where(real & (roots.real > 0), roots.real, np.nan)
+        value = np.zeros_like(n)
+        slope = np.zeros_like(n)
+        for coefficient in sextic:
+            slope = slope * n + value
+            value = value * n + coefficient
+        polished = n - value / slope
+        n = np.where(np.isfinite(polished), polished, n)
+        x = (((-2 * a * n) - b_0) * n ** 2 + d) / (b_1 * n ** 2)
+        lower = np.nanmin(np.where(np.isnan(x), np.inf, x), axis=0)
+        upper = np.nanmax(np.where(np.isnan(x), -np.inf, x), axis=0)
+    bistable = np.sum(np.isfinite(x), axis=0) >= 2
+    lower = np.where(bistable, lower, np.nan).reshape(shape)
+    upper = np.where(bistable, upper, np.nan).reshape(shape)
+    return lower, upper
+
+
+def _polynomial_roots(coefficients):
+    """
+    Return the complex roots of many polynomials, given an array of coefficients with shape
+    (degree + 1, num_polynomials) in order of decreasing powers, as an array with shape (degree, num_polynomials); the
+    leading coefficients must not be zero.
+    """
+    degree = coefficients.shape[0] - 1
+    companion = np.zeros((coefficients.shape[1], degree, degree))
+    companion[:, 0, :] = -(coefficients[1:] / coefficients[0]).T
+    companion[:, np.arange(1, degree), np.arange(degree - 1)] = 1
+    return np.linalg.eigvals(companion).T
+
+
+def invert(z, coupling_loss, nonlinear_loss, reduced_kerr, reduced_input_rate, io_coupling_coefficient):
+    """
+    Return the detuning and internal loss that correspond to the given values of
+      z = loss_i + loss_n n + 2j (x - k n),
+    which is the quantity in the denominator of the Kerr-loss scattering models, calculated from normalized data as in
+    the `invert` methods of the linear fitters; here n is the photon number and the other variables are those of
+    `photon_number`. Writing loss_i = Re(z) - loss_n n and x = Im(z) / 2 + k n in the cubic of `photon_number_cubic`
+    eliminates both unknowns and leaves a cubic for n alone,
+      (3 loss_n^2 / 4) n^3 - (3 L loss_n / 4) n^2 + [L^2 / 4 + Im(z)^2 / 4] n - g loss_c x_in = 0,
+    with L = loss_c + Re(z). The discriminant of its derivative is -9 loss_n^2 Im(z)^2 / 4, which is never positive, so
+    the cubic is monotonic and has exactly one real root at every point: the data show which branch the resonator was
+    on, and no root needs to be chosen. The roots for all points are calculated at once by `cubic.real_roots`; without
+    nonlinear loss the cubic is linear.
+
+    :param z: a complex or array of complex values of z.
+    :param coupling_loss: the inverse coupling quality factor.
+    :param nonlinear_loss: the nonlinear loss.
+    :param reduced_kerr: the reduced Kerr coefficient.
+    :param reduced_input_rate: the reduced input rate.
+    :param io_coupling_coefficient: the parameter g.
+    :return: detuning, internal_loss; both float or array[float].
+    """
+    total_loss = coupling_loss + z.real
+    n = cubic.real_roots(3 * nonlinear_loss ** 2 / 4, -3 * total_loss * nonlinear_loss / 4,
+                         (total_loss ** 2 + z.imag ** 2) / 4,
+                         -io_coupling_coefficient * coupling_loss * reduced_input_rate)[0]
+    return z.imag / 2 + reduced_kerr * n, z.real - nonlinear_loss * n
+
+
+def photon_number_derivatives(detuning, photon_number, coupling_loss, internal_loss, nonlinear_loss, reduced_kerr,
+                              reduced_input_rate, io_coupling_coefficient):
+    """
+    Return the partial derivatives of a root n of the cubic in `photon_number_cubic` with respect to the detuning and
+    the parameters, calculated by implicit differentiation of the cubic G(n) = 0 at the given root:
+      dn / dp = -(dG / dp) / (dG / dn).
+    This requires only the root, so the derivatives of the root chosen by the model cost a few array operations
+    instead of another solve for each parameter. They diverge at the edges of the bistable region.
+
+    :param detuning: a float or array of floats; the fractional frequency detuning x.
+    :param photon_number: a float or array of floats; the root n at each detuning, as returned by `photon_number`.
+    :param coupling_loss: the inverse coupling quality factor.
+    :param internal_loss: the inverse internal quality factor.
+    :param nonlinear_loss: the nonlinear loss.
+    :param reduced_kerr: the reduced Kerr coefficient.
+    :param reduced_input_rate: the reduced input rate.
+    :param io_coupling_coefficient: the parameter g.
+    :return: dict that maps 'detuning' and the names of the parameters to the derivative of n.
+    """
+    n = photon_number
+    a, b, c, d = photon_number_cubic(detuning=detuning, coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                     nonlinear_loss=nonlinear_loss, reduced_kerr=reduced_kerr,
+                                     reduced_input_rate=reduced_input_rate,
+                                     io_coupling_coefficient=io_coupling_coefficient)
+    d_n = (3 * a * n + 2 * b) * n + c
+    total_loss = coupling_loss + internal_loss
+    # The derivative of the cubic with respect to either loss, except for the term from d.
+    d_loss = (total_loss / 2 - nonlinear_loss * n / 4) * n
+    return {'detuning': -2 * (detuning - reduced_kerr * n) * n / d_n,
+            'coupling_loss': -(d_loss - io_coupling_coefficient * reduced_input_rate) / d_n,
+            'internal_loss': -d_loss / d_n,
+            'nonlinear_loss': -(nonlinear_loss * n / 2 - total_loss / 4) * n ** 2 / d_n,
+            'reduced_kerr': -2 * (reduced_kerr * n - detuning) * n ** 2 / d_n,
+            'reduced_input_rate': io_coupling_coefficient * coupling_loss / d_n}
+
+
+def choose_min(roots, axis=None):
+    """
+    Return the smallest real root: either the minimum over the given axis of an array of real roots with NaN in place
+    of complex roots, as passed by `photon_number`, or the smallest real element of a complex array of the roots of one
+    cubic, as returned by `photon_number_roots`.
+    """
+    if np.iscomplexobj(roots):
+        return np.min(roots[roots.imag == 0].real)
+    return np.nanmin(roots, axis=axis)
+
+
+def choose_max(roots, axis=None):
+    """Return the largest real root; see `choose_min`."""
+    if np.iscomplexobj(roots):
+        return np.max(roots[roots.imag == 0].real)
+    return np.nanmax(roots, axis=axis)
 
 
 class KerrLossFitter(base.ResonatorFitter):
 
     def __init__(self, frequency, data, choose, foreground_model=None, background_model=None, errors=None, params=None,
-                 **fit_kwds):
+                 track=False, **fit_kwds):
         """
         :param choose: a numpy ufunc that chooses a number to return given multiple roots; see `photon_number`; this
           is baked into the model function when the model object is created, so if you want to compare the results of
           using another choose function, create a new fitter.
+        :param track: if True, the foreground model follows a continuous branch of roots in the order of the frequency
+          points; see `photon_number`. This should be the same value that was used to create the foreground model.
         """
         self._choose = choose  # Modifying this will lead to inconsistent results
+        self._track = track
         super(KerrLossFitter, self).__init__(frequency=frequency, data=data, foreground_model=foreground_model,
                                              background_model=background_model, errors=errors, params=params,
                                              **fit_kwds)
 
-    def photon_number(self, input_frequency, choose=None):
+    def photon_number(self, input_frequency, input_rate=None, choose=None, track=None):
+        """
+        Return the average photon number in the resonator at the given input frequency and input rate.
+
+        The arguments broadcast together, so photon_number(frequency, rate[:, np.newaxis]) returns a grid with one row
+        per input rate, calculated by one call to `photon_number`; with track=True, each row is tracked separately in
+        the order of the frequencies.
+
+        :param input_frequency: float or array[float]; the frequency of the input signal, in Hz.
+        :param input_rate: None, to use the fitted input rate, or a float or array[float]; the input photon rate, in
+          photons per second.
+        :param choose: a function used to choose the root; the default is the one used by the fitter.
+        :param track: if True, follow a continuous branch of roots along the last axis; the default is the value used
+          by the fitter.
+        :return: float or array[float]
+        """
         if choose is None:
             choose = self._choose
-        return photon_number(detuning=input_frequency / self.resonance_frequency - 1, coupling_loss=self.coupling_loss,
-                             internal_loss=self.internal_loss, nonlinear_loss=self.nonlinear_loss,
-                             reduced_kerr=self.reduced_kerr, reduced_input_rate=self.reduced_input_rate,
-                             io_coupling_coefficient=self.foreground_model.io_coupling_coefficient, choose=choose)
+        if track is None:
+            track = self._track
+        if input_rate is None:
+            reduced_input_rate = self.reduced_input_rate
+        else:
+            reduced_input_rate = np.asarray(input_rate, dtype='float') / (2 * np.pi * self.resonance_frequency)
+        return photon_number(detuning=np.asarray(input_frequency, dtype='float') / self.resonance_frequency - 1,
+                             coupling_loss=self.coupling_loss, internal_loss=self.internal_loss,
+                             nonlinear_loss=self.nonlinear_loss, reduced_kerr=self.reduced_kerr,
+                             reduced_input_rate=reduced_input_rate,
+                             io_coupling_coefficient=self.foreground_model.io_coupling_coefficient, choose=choose,
+                             track=track)
+
+    def bistable_frequency(self):
+        """
+        Return the lower and upper edges of the frequency interval in which the best-fit model is bistable, which are
+        both NaN if it is not; see `bistable_detuning`.
+
+        :return: tuple[float]
+        """
+        lower, upper = bistable_detuning(coupling_loss=self.coupling_loss, internal_loss=self.internal_loss,
+                                         nonlinear_loss=self.nonlinear_loss, reduced_kerr=self.reduced_kerr,
+                                         reduced_input_rate=self.reduced_input_rate,
+                                         io_coupling_coefficient=self.foreground_model.io_coupling_coefficient)
+        return self.resonance_frequency * (1 + lower), self.resonance_frequency * (1 + upper)
 
     @property
     def kerr_coefficient(self):
@@ -0,0 +1,418 @@
+"""
+A lean least-squares engine that fits the product of a background model and a foreground model directly with
+`scipy.optimize.least_squares`.
+
+In each iteration of an lmfit fit, the minimizer updates a Parameters object, evaluates the composite model through
+lmfit, and flattens the complex residual, and the fit ends by constructing a ModelResult. For data sets with a few
+hundred points this machinery takes most of the time of a fit. The engine in this module maps the varying parameters to
+a plain array once, calls the model functions directly with floats, and returns a LeanResult that contains the same
+parameter names, values, and standard errors that an lmfit fit would produce. The engine is used by a fitter created
+with `engine='lean'`.
+"""
+from __future__ import absolute_import, division, print_function
+
+from copy import deepcopy
+
+import lmfit
+import numpy as np
+from scipy.optimize import least_squares
+
+
+class LeanResult(object):
+    """
+    This class contains the result of a fit by the lean engine. It has the attributes of lmfit.model.ModelResult that
+    the fitters and plotting functions use, such as params, init_params, chisqr, redchi, nfev, and success.
+    """
+
+    method = 'lean'
+
+    def __init__(self, params, init_values, var_names, residual, covar, nfev, njev, success, message):
+        self._initialize(params=params, init_values=init_values, var_names=var_names, chisqr=np.sum(residual ** 2),
+                         ndata=residual.size, covar=covar, nfev=nfev, njev=njev, success=success, message=message)
+        self.residual = residual
+
+    def _initialize(self, params, init_values, var_names, chisqr, ndata, covar, nfev, njev, success, message):
+        # Set every attribute except the residual, from the sum of squares and size of the residual.
+        self.params = params
+        self._init_values = init_values
+        self._init_params = None
+        self.var_names = var_names
+        self.covar = covar
+        self.nfev = nfev
+        self.njev = njev
+        self.success = success
+        self.message = message
+        self.ndata = ndata
+        self.nvarys = len(var_names)
+        self.nfree = self.ndata - self.nvarys
+        self.chisqr = chisqr
+        self.redchi = self.chisqr / max(self.nfree, 1)
+        self.errorbars = covar is not None
+
+    @property
+    def init_params(self):
+        """A lmfit.parameter.Parameters object containing the initial values; it is created on first access."""
+        if self._init_params is None:
+            init_params = deepcopy(self.params)
+            for name, value in self._init_values.items():
+                init_params[name].value = value
+                init_params[name].stderr = None
+            self._init_params = init_params
+        return self._init_params
+
+    def fit_report(self, **kwds):
+        """Return a report of the best-fit parameters; keywords are passed to lmfit.fit_report()."""
+        return lmfit.fit_report(self.params, **kwds)
+
+
+class _Component(object):
+    """
+    One model in the product, with the values of its fixed arguments stored in a dict and the positions of its varying
+    parameters in the array of varying values.
+    """
+
+    def __init__(self, model, params, var_names):
+        self.func = model.func
+        self.derivatives = model.derivatives
+        self.fixed = model.make_funcargs(params=params)
+        self.fixed.pop('frequency', None)
+        self.varying = [(name, var_names.index(model.prefix + name)) for name in list(self.fixed)
+                        if model.prefix + name in var_names]
+        self.prefix = model.prefix
+
+    def kwargs(self, values):
+        kwargs = self.fixed.copy()
+        for name, index in self.varying:
+            kwargs[name] = values[index]
+        return kwargs
+
+
+class Bounds(object):
+    """
+    The transformation between the bounded parameter values and the unbounded internal values used by the minimizer.
+    This is the transformation used by lmfit for the leastsq method, which follows MINUIT: a parameter with two bounds
+    is mapped to the sine of its internal value and a parameter with one bound to a hyperbola. The bounds are arrays
+    with the same shape as the values, so each element can have different bounds.
+    """
+
+    def __init__(self, lower, upper):
+        self.lower = lower
+        self.upper = upper
+        self.both = np.isfinite(lower) & np.isfinite(upper)
+        self.lower_only = np.isfinite(lower) & ~np.isfinite(upper)
+        self.upper_only = ~np.isfinite(lower) & np.isfinite(upper)
+        self.width = upper - lower
+
+    def internal(self, values):
+        values = np.clip(values, self.lower, self.upper)
+        internal = values.copy()
+        both, lower_only, upper_only = self.both, self.lower_only, self.upper_only
+        internal[both] = np.arcsin(2 * (values[both] - self.lower[both]) / self.width[both] - 1)
+        internal[lower_only] = np.sqrt((values[lower_only] - self.lower[lower_only] + 1) ** 2 - 1)
+        internal[upper_only] = np.sqrt((self.upper[upper_only] - values[upper_only] + 1) ** 2 - 1)
+        return internal
+
+    def external(self, internal):
+        values = internal.copy()
+        both, lower_only, upper_only = self.both, self.lower_only, self.upper_only
+        values[both] = self.lower[both] + (np.sin(internal[both]) + 1) * self.width[both] / 2
+        values[lower_only] = self.lower[lower_only] - 1 + np.sqrt(internal[lower_only] ** 2 + 1)
+        values[upper_only] = self.upper[upper_only] + 1 - np.sqrt(internal[upper_only] ** 2 + 1)
+        return values
+
+    def derivative(self, internal):
+        """Return the derivative of the external values with respect to the internal values."""
+        derivative = np.ones_like(internal)
+        both, lower_only, upper_only = self.both, self.lower_only, self.upper_only
+        derivative[both] = np.cos(internal[both]) * self.width[both] / 2
+        derivative[lower_only] = internal[lower_only] / np.sqrt(internal[lower_only] ** 2 + 1)
+        derivative[upper_only] = -internal[upper_only] / np.sqrt(internal[upper_only] ** 2 + 1)
+        return derivative
+
+
+def fit(background_model, foreground_model, params, frequency, data, weights, residual_convention,
+        analytic_jacobian=True, scale_covar=True, projection=False, **least_squares_kwds):
+    """
+    Fit background_model * foreground_model to the data and return a LeanResult.
+
+    :param background_model: the background model instance.
+    :param foreground_model: the foreground model instance.
+    :param params: a lmfit.parameter.Parameters object containing the initial values and bounds; it is modified in place
+      and becomes the params attribute of the result.
+    :param frequency: the frequency array.
+    :param data: the complex data array.
+    :param weights: None or the complex weights array; see base.ResonatorFitter.weights.
+    :param residual_convention: the (sign, complex_weights) tuple returned by base._residual_convention(), which is used
+      so that the residual, and thus chisqr, equals that calculated by lmfit.
+    :param analytic_jacobian: if True and both models implement `derivatives`, use the analytic Jacobian; otherwise, use
+      finite differences.
+    :param scale_covar: if True, scale the covariance matrix by the reduced chi-squared, as lmfit does by default.
+    :param projection: if True and the background model has linear parameters that all vary (see
+      base.BackgroundModel.linear_names), eliminate them from the nonlinear search using variable projection: for each
+      value of the other parameters, the linear parameters are calculated by linear least squares, and the minimizer
+      varies only the other parameters; the Jacobian of the projected residual is the approximation of Kaufman. The
+      bounds of the linear parameters are not used during the fit. The standard errors of all of the parameters are
+      calculated from the Jacobian of the full problem at the best fit, so they equal those of a fit without projection.
+    :param least_squares_kwds: keywords passed directly to scipy.optimize.least_squares.
+    :return: LeanResult
+    """
+    if any(p.expr is not None for p in params.values()):
+        raise ValueError("The lean engine does not support parameters constrained by expressions.")
+    var_names = [name for name, p in params.items() if p.vary]
+    lower = np.array([-np.inf if params[name].min is None else params[name].min for name in var_names], dtype='float')
+    upper = np.array([np.inf if params[name].max is None else params[name].max for name in var_names], dtype='float')
+    init_values = dict((name, params[name].value) for name in var_names)
+    bounds = Bounds(lower=lower, upper=upper)
+    u0 = bounds.internal(np.array([init_values[name] for name in var_names], dtype='float'))
+    background = _Component(model=background_model, params=params, var_names=var_names)
+    foreground = _Component(model=foreground_model, params=params, var_names=var_names)
+    frequency = np.asarray(frequency)
+    data = np.asarray(data, dtype='complex')
+    sign, complex_weights = residual_convention
+    if weights is None:
+        float_weights = None
+    else:
+        weights = np.asarray(weights, dtype='complex')
+        float_weights = None if complex_weights else weights.view('float')
+
+    def weigh(difference):
+        # Apply the lmfit weighting convention to complex values, returning real values.
+        if weights is not None and complex_weights:
+            difference = difference * weights
+        difference = np.ascontiguousarray(difference).view('float')
+        if float_weights is not None:
+            difference = difference * float_weights
+        return difference
+
+    def residual(internal):
+        values = bounds.external(internal)
+        model = (background.func(frequency=frequency, **background.kwargs(values))
+                 * foreground.func(frequency=frequency, **foreground.kwargs(values)))
+        return weigh(sign * (data - model))
+
+    def model_jacobian(values, background_arguments=None):
+        # Return the Jacobian of the residual with respect to the values, with one row per varying parameter; the
+        # values in the given dict replace the corresponding arguments of the background model.
+        background_kwargs = background.kwargs(values)
+        background_kwargs.update(background_arguments or {})
+        foreground_kwargs = foreground.kwargs(values)
+        background_values = background.func(frequency=frequency, **background_kwargs)
+        foreground_values = foreground.func(frequency=frequency, **foreground_kwargs)
+        jac = np.zeros((len(var_names), frequency.size), dtype='complex')
+        for name, derivative in background.derivatives(frequency=frequency, **background_kwargs).items():
+            if background.prefix + name in var_names:
+                jac[var_names.index(background.prefix + name)] += derivative * foreground_values
+        for name, derivative in foreground.derivatives(frequency=frequency, **foreground_kwargs).items():
+            if foreground.prefix + name in var_names:
+                jac[var_names.index(foreground.prefix + name)] += background_values * derivative
+        return np.array([weigh(-sign * row) for row in jac])
+
+    def jacobian(internal):
+        return (model_jacobian(bounds.external(internal)) * bounds.derivative(internal)[:, np.newaxis]).T
+
+    # These are the settings that lmfit uses for the leastsq method: MINPACK with automatic variable scaling.
+    kwds = {'method': 'lm', 'x_scale': 'jac', 'ftol': 1.5e-8, 'xtol': 1.5e-8, 'max_nfev': 2000 * (len(var_names) + 1)}
+    analytic = analytic_jacobian and background.derivatives is not None and foreground.derivatives is not None
+    if analytic:
+        kwds['jac'] = jacobian
+    kwds.update(least_squares_kwds)
+    linear_names = background_model.linear_names
+    if projection and linear_names is not None and all(background.prefix + name in var_names
+                                                       for name in linear_names):
+        projected = _Projection(background_model=background_model, background=background, foreground=foreground,
+                                var_names=var_names, bounds=bounds, frequency=frequency, target=weigh(sign * data),
+                                weigh=lambda difference: weigh(sign * difference), model_jacobian=model_jacobian)
+        if analytic:
+            kwds['jac'] = projected.jacobian
+        else:
+            kwds.pop('jac', None)
+        kwds['max_nfev'] = least_squares_kwds.get('max_nfev', 2000 * (projected.nonlinear.sum() + 1))
+        output = least_squares(projected.residual, u0[projected.nonlinear], **kwds)
+        best_internal = projected.best_internal(output.x, template=u0)
+        for name, value in projected.fixed_values.items():
+            params[name].value = value
+        best_jacobian = jacobian(best_internal) if analytic else _difference_jacobian(residual, best_internal)
+    else:
+        output = least_squares(residual, u0, **kwds)
+        best_internal = output.x
+        best_jacobian = output.jac
+    best_values = bounds.external(best_internal)
+    result_residual = residual(best_internal)
+    try:
+        derivative = bounds.derivative(best_internal)
+        covar = np.linalg.inv(np.dot(best_jacobian.T, best_jacobian)) * np.outer(derivative, derivative)
+    except np.linalg.LinAlgError:
+        covar = None
+    nfree = result_residual.size - len(var_names)
+    if covar is not None and scale_covar and nfree > 0:
+        covar *= np.sum(result_residual ** 2) / nfree
+    for index, name in enumerate(var_names):
+        params[name].init_value = init_values[name]
+        params[name].value = best_values[index]
+        if covar is None or not covar[index, index] > 0:
+            params[name].stderr = None
+        else:
+            params[name].stderr = np.sqrt(covar[index, index])
+    # As in lmfit, parameters that do not vary have a standard error of zero if the covariance could be calculated.
+    for name, p in params.items():
+        if name not in init_values:
+            p.stderr = None if covar is None else 0
+    return LeanResult(params=params, init_values=init_values, var_names=var_names, residual=result_residual,
+                      covar=covar, nfev=output.nfev, njev=output.njev, success=output.success,
+                      message=output.message)
+
+
+class _Projection(object):
+    """
+    The residual and Jacobian of the variable projection problem, in which the linear parameters of the background
+    model are calculated by linear least squares for each value of the other varying parameters; see fit().
+    """
+
+    def __init__(self, background_model, background, foreground, var_names, bounds, frequency, target, weigh,
+                 model_jacobian):
+        self.background_model = background_model
+        self.background = background
+        self.foreground = foreground
+        self.var_names = var_names
+        self.bounds = bounds
+        self.frequency = frequency
+        # The residual is target - weigh(model), as a real array.
+        self.target = target
+        self.weigh = weigh
+        self.model_jacobian = model_jacobian
+        self.linear_names = [background.prefix + name for name in background_model.linear_names]
+        self.nonlinear = np.array([name not in self.linear_names for name in var_names])
+        self.fixed_values = {}
+        self._last = None
+
+    def _solve(self, internal):
+        """
+        Return the full array of internal values, in which the linear values are arbitrary, the coefficients of the
+        linear basis, the orthonormal basis of the weighted columns, and the projected residual.
+        """
+        if self._last is not None and np.array_equal(self._last[0], internal):
+            return self._last[1]
+        full = np.zeros(self.nonlinear.size)
+        full[self.nonlinear] = internal
+        values = self.bounds.external(full)
+        foreground_values = self.foreground.func(frequency=self.frequency, **self.foreground.kwargs(values))
+        columns = np.array([self.weigh(column * foreground_values) for column in self.background_model.linear_basis(
+            frequency=self.frequency, **self.background.kwargs(values))]).T
+        q, r = np.linalg.qr(columns)
+        projection = np.dot(q.T, self.target)
+        coefficients = np.linalg.solve(r, projection)
+        solution = full, coefficients, q, self.target - np.dot(q, projection)
+        self._last = internal.copy(), solution
+        return solution
+
+    def _linear_values(self, values, coefficients):
+        """Return the dict of background parameter values, without prefix, given by the coefficients."""
+        return self.background_model.linear_params(coefficients=coefficients, **self.background.kwargs(values))
+
+    def residual(self, internal):
+        return self._solve(internal)[3]
+
+    def jacobian(self, internal):
+        full, coefficients, q, _ = self._solve(internal)
+        values = self.bounds.external(full)
+        linear_values = self._linear_values(values=values, coefficients=coefficients)
+        rows = (self.model_jacobian(values, background_arguments=linear_values)[self.nonlinear]
+                * self.bounds.derivative(full)[self.nonlinear, np.newaxis])
+        # Project each row onto the orthogonal complement of the column space of the linear basis.
+        rows -= np.dot(np.dot(rows, q), q.T)
+        return rows.T
+
+    def best_internal(self, internal, template):
+        """
+        Return the full array of internal values with the linear values given by the coefficients at the given internal
+        values of the other parameters. Values returned by linear_params for background parameters that do not vary
+        are stored in fixed_values and replace the fixed arguments of the background model.
+        """
+        full, coefficients, _, _ = self._solve(internal)
+        values = self.bounds.external(full)
+        best_values = values.copy()
+        for name, value in self._linear_values(values=values, coefficients=coefficients).items():
+            prefixed = self.background.prefix + name
+            if prefixed in self.var_names:
+                best_values[self.var_names.index(prefixed)] = value
+            else:
+                self.fixed_values[prefixed] = value
+                self.background.fixed[name] = value
+        return self.bounds.internal(best_values)
+
+
+def _difference_jacobian(function, internal):
+    """Return the Jacobian of the function calculated by forward differences, with the step used by least_squares."""
+    value = function(internal)
+    jacobian = np.empty((value.size, internal.size))
+    for index, step in enumerate(np.sqrt(np.finfo('float').eps) * np.maximum(1, np.abs(internal))):
+        shifted = internal.copy()
+        shifted[index] += step
+        jacobian[:, index] = (function(shifted) - value) / step
+    return jacobian
+
+
+# The termination messages of the Levenberg-Marquardt minimizers of the stacked and chunked engines.
+max_iterations_message = "The maximum number of iterations was reached."
+not_finite_message = "The residual at the initial values is not finite."
+
+
+def _damped_steps(jtj, jtr, damping):
+    """
+    Return the Levenberg-Marquardt steps for a batch of N least-squares problems, with Marquardt's scaling of the
+    damping term, and the scales, which are the diagonals of J^T J with non-positive entries replaced by one.
+
+    :param jtj: an array with shape (N, number of varying parameters, number of varying parameters) containing J^T J,
+      where J is the Jacobian of the residual r of each problem.
+    :param jtr: an array with shape (N, number of varying parameters) containing J^T r.
+    :param damping: an array with shape (N,) containing the damping factors.
+    :return: steps, scales; arrays with the shape of jtr.
+    """
+    scale = jtj.diagonal(axis1=1, axis2=2).copy()
+    scale[~(scale > 0)] = 1
+    damped = jtj + (damping[:, np.newaxis] * scale)[:, :, np.newaxis] * np.eye(jtj.shape[-1])
+    return -np.linalg.solve(damped, jtr[:, :, np.newaxis])[:, :, 0], scale
+
+
+def _step_tests(cost, trial_cost, internal, step, scale, damping, ftol, xtol):
+    """
+    Apply the acceptance and termination tests of the Levenberg-Marquardt algorithm to the trial steps of a batch of
+    least-squares problems. A step is accepted if it reduces chi-squared, and then the damping is divided by ten;
+    otherwise the damping is multiplied by ten. A problem has converged if an accepted step reduces chi-squared by at
+    most the fraction ftol, or if the scaled length of the step is at most the fraction xtol of the scaled length of
+    the internal values. If the damping exceeds 1e16 without an accepted step, no step reduces chi-squared, so the
+    problem is at a minimum to within machine precision, unless the residual is not finite even for this short step,
+    in which case the fit has failed.
+
+    :param cost: an array with shape (N,) containing chi-squared at the current internal values.
+    :param trial_cost: an array with shape (N,) containing chi-squared at the trial values.
+    :param internal: an array with shape (N, number of varying parameters) containing the current internal values.
+    :param step: an array with the same shape containing the steps, as returned by `_damped_steps`.
+    :param scale: an array with the same shape containing the scales, as returned by `_damped_steps`.
+    :param damping: an array with shape (N,) containing the damping factors used for the steps.
+    :param ftol: the tolerance for the relative reduction in chi-squared.
+    :param xtol: the tolerance for the relative step size.
+    :return: accepted, damping, done, success, messages; boolean arrays with shape (N,) that are True for the accepted
+      steps, the new damping factors, boolean arrays that are True for the problems that have terminated and for those
+      that have converged, and a list with the termination message of each problem, or None if it has not terminated.
+    """
+    accepted = trial_cost < cost
+    damping = np.where(accepted, damping / 10, damping * 10)
+    small_reduction = accepted & (cost - trial_cost <= ftol * cost)
+    small_step = accepted & (np.sqrt(np.sum(scale * step ** 2, axis=1))
+                             <= xtol * np.sqrt(np.sum(scale * internal ** 2, axis=1)))
+    stalled = ~accepted & (damping > 1e16)
+    minimum = stalled & np.isfinite(trial_cost)
+    success = small_reduction | small_step | minimum
+    done = success | stalled
+    messages = [None] * cost.size
+    for index in np.flatnonzero(done):
+        if small_reduction[index]:
+            messages[index] = "The relative reduction in chi-squared is at most ftol."
+        elif small_step[index]:
+            messages[index] = "The relative step size is at most xtol."
+        elif minimum[index]:
+            messages[index] = "No step reduces chi-squared."
+        else:
+            messages[index] = "The residual is not finite at any trial step."
+    return accepted, damping, done, success, messages
@@ -3,6 +3,8 @@ This module contains models and fitters for resonators that are operated in the
 """
 from __future__ import absolute_import, division, print_function
 
+import functools
+
 import numpy as np
 
 from . import background, base, guess, linear, kerr, kerr_loss
@@ -43,8 +45,18 @@ class LinearReflection(AbstractReflection):
 
         super(LinearReflection, self).__init__(func=linear_reflection, *args, **kwds)
 
-    def guess(self, data=None, frequency=None, **kwds):
-        resonance_frequency, coupling_loss, internal_loss = guess.guess_smooth(frequency=frequency, data=data)
+    @staticmethod
+    def derivatives(frequency, resonance_frequency, coupling_loss, internal_loss):
+        detuning = frequency / resonance_frequency - 1
+        denominator = coupling_loss + internal_loss + 2j * detuning
+        d_detuning = -4j * coupling_loss / denominator ** 2
+        return {'resonance_frequency': -d_detuning * frequency / resonance_frequency ** 2,
+                'coupling_loss': 2 * (internal_loss + 2j * detuning) / denominator ** 2,
+                'internal_loss': -2 * coupling_loss / denominator ** 2}
+
+    def guess(self, data=None, frequency=None, features=None, **kwds):
+        resonance_frequency, coupling_loss, internal_loss = guess.guess_smooth(
+            frequency=frequency, data=data, features=features)
         params = self.make_params()
         params['resonance_frequency'].set(value=resonance_frequency, min=frequency.min(), max=frequency.max())
         params['coupling_loss'].set(value=coupling_loss, min=1e-12, max=1)
@@ -112,33 +124,84 @@ class KerrReflection(AbstractReflection):
     This class models a resonator operated in reflection with a Kerr-type nonlinearity.
     """
 
-    def __init__(self, choose, *args, **kwds):
+    def __init__(self, choose, track=False, table=None, scan=True, *args, **kwds):
         """
         This class can be used directly, like any lmfit Model, but it is easier to use the KerrReflectionFitter wrapper
         class that is defined in this module.
 
         :param choose: a numpy ufunc; see `kerr.kerr_detuning_shift`.
+        :param track: if True, follow a continuous branch of roots in the order of the frequency points; see
+          `kerr.kerr_detuning_shift`.
+        :param table: None, to calculate the shift with `kerr.kerr_detuning_shift`, or a `kerr.DetuningShiftTable`, such
+          as the one returned by `kerr.detuning_shift_table()`, which gives the same values faster; it is not used if
+          track is True.
+        :param scan: the default value of `scan` in guess().
         :param args: arguments passed directly to `lmfit.model.Model.__init__`.
         :param kwds: keywords passed directly to `lmfit.model.Model.__init__`.
         """
 
-        def kerr_reflection(frequency, resonance_frequency, coupling_loss, internal_loss, kerr_input):
+        if table is None or track:
+            detuning_shift = functools.partial(kerr.kerr_detuning_shift, track=track)
+        else:
+            detuning_shift = table
+
+        def detuning_and_shift(frequency, resonance_frequency, coupling_loss, internal_loss, kerr_input):
             detuning = frequency / resonance_frequency - 1
-            shift = kerr.kerr_detuning_shift(detuning=detuning, coupling_loss=coupling_loss,
-                                             internal_loss=internal_loss, kerr_input=kerr_input,
-                                             io_coupling_coefficient=self.io_coupling_coefficient,
-                                             choose=choose)
+            return detuning, detuning_shift(detuning=detuning, coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                            kerr_input=kerr_input, io_coupling_coefficient=self.io_coupling_coefficient,
+                                            choose=choose)
+
+        # The model function and its derivatives share the root solve when they are evaluated with the same parameters.
+        last_detuning_and_shift = base.LastEvaluation(detuning_and_shift)
+
+        def kerr_reflection(frequency, resonance_frequency, coupling_loss, internal_loss, kerr_input):
+            detuning, shift = last_detuning_and_shift(frequency, resonance_frequency, coupling_loss, internal_loss,
+                                                      kerr_input)
             return -1 + (2 / (1 + (internal_loss + 2j * (detuning - shift)) / coupling_loss))
 
+        def kerr_reflection_derivatives(frequency, resonance_frequency, coupling_loss, internal_loss, kerr_input):
+            detuning, shift = last_detuning_and_shift(frequency, resonance_frequency, coupling_loss, internal_loss,
+                                                      kerr_input)
+            d_shift = kerr.detuning_shift_derivatives(detuning=detuning, shift=shift, coupling_loss=coupling_loss,
+                                                      internal_loss=internal_loss, kerr_input=kerr_input,
+                                                      io_coupling_coefficient=self.io_coupling_coefficient)
+            denominator = coupling_loss + internal_loss + 2j * (detuning - shift)
+            # The derivative of the model with respect to the denominator.
+            d_denominator = -2 * coupling_loss / denominator ** 2
+            return {'resonance_frequency': (-2j * d_denominator * (1 - d_shift['detuning'])
+                                            * frequency / resonance_frequency ** 2),
+                    'coupling_loss': 2 / denominator + d_denominator * (1 - 2j * d_shift['coupling_loss']),
+                    'internal_loss': d_denominator * (1 - 2j * d_shift['internal_loss']),
+                    'kerr_input': -2j * d_denominator * d_shift['kerr_input']}
+
         super(KerrReflection, self).__init__(func=kerr_reflection, *args, **kwds)
+        self.derivatives = kerr_reflection_derivatives
+        self.scan = scan
 
-    def guess(self, data=None, frequency=None, **kwds):
-        resonance_frequency, coupling_loss, internal_loss = guess.guess_smooth(frequency=frequency, data=data)
+    def guess(self, data=None, frequency=None, scan=None, features=None, **kwds):
+        """
+        Return initial parameters; if scan is True, kerr_input, the resonance frequency, and the losses are chosen by
+        comparing the data to the model for a grid of values (see `kerr.guess_kerr_input`), and otherwise kerr_input
+        starts at zero. The scan improves the initial values for data near and above bifurcation; it evaluates the model
+        for about a hundred sets of values, which takes a time comparable to a fit of a thousand points. The default of
+        None means to use the value given when the model was created.
+        """
+        if scan is None:
+            scan = self.scan
+        resonance_frequency, coupling_loss, internal_loss = guess.guess_smooth(
+            frequency=frequency, data=data, features=features)
+        kerr_input = 0
+        if scan:
+            resonance_frequency, coupling_loss, internal_loss, kerr_input = kerr.guess_kerr_input(
+                evaluate=lambda f, f_r, l_c, l_i, k: self.func(frequency=f, resonance_frequency=f_r, coupling_loss=l_c,
+                                                               internal_loss=l_i, kerr_input=k),
+                frequency=frequency, data=data, resonance_frequency=resonance_frequency, coupling_loss=coupling_loss,
+                internal_loss=internal_loss, io_coupling_coefficient=self.io_coupling_coefficient)
         params = self.make_params()
         params['resonance_frequency'].set(value=resonance_frequency, min=frequency.min(), max=frequency.max())
         params['coupling_loss'].set(value=coupling_loss, min=1e-12, max=1)
         params['internal_loss'].set(value=internal_loss, min=1e-12, max=1)
-        params['kerr_input'].set(value=0)
+        params['kerr_input'].set(value=kerr_input)
         return params
 
     @classmethod
@@ -152,7 +215,8 @@ class KerrReflectionFitter(kerr.KerrFitter):
     This class fits data from a resonator operated in reflection with a Kerr-type nonlinearity.
     """
 
-    def __init__(self, frequency, data, choose=np.max, background_model=None, errors=None, **fit_kwds):
+    def __init__(self, frequency, data, choose=np.max, background_model=None, errors=None, track=False, table=None,
+                 scan=True, **fit_kwds):
         """
         Fit the given data to a composite model that is the product of a background model and the KerrReflection model.
 
@@ -163,17 +227,30 @@ class KerrReflectionFitter(kerr.KerrFitter):
           resonator; the default of `background.MagnitudePhase()` assumes that this is modeled well by a single complex
           constant at all frequencies.
         :param errors: an array of complex numbers containing the standard errors of the mean of the data points.
+        :param track: if True, the model follows a continuous branch of roots in the order of the frequency points,
+          which should then be the order in which they were measured; see `kerr.kerr_detuning_shift`.
+        :param table: None or a `kerr.DetuningShiftTable` used by the model to calculate the shift faster; see
+          `KerrReflection`.
+        :param scan: if True, the default, the guess scans a grid of nonlinearities, and if False, it starts from the
+          linear guess; see `KerrReflection.guess`.
         :param kwds: keyword arguments passed directly to lmfit.model.Model.fit().
         """
         if background_model is None:
             background_model = background.MagnitudePhase()
         super(KerrReflectionFitter, self).__init__(frequency=frequency, data=data, choose=choose,
-                                                   foreground_model=KerrReflection(choose=choose),
-                                                   background_model=background_model, errors=errors, **fit_kwds)
+                                                   foreground_model=KerrReflection(choose=choose, track=track,
+                                                                                   table=table, scan=scan),
+                                                   background_model=background_model, errors=errors, track=track,
+                                                   **fit_kwds)
 
-    # ToDo: math
     def invert(self, scattering_data):
-        pass
+        """
+        Return the detuning and internal_loss that correspond to the given normalized data, including the Kerr detuning
+        shift at the photon number implied by each data point; see `kerr.invert` and `base.ResonatorFitter.invert`.
+        """
+        z = self.coupling_loss * (2 / (1 + scattering_data) - 1)
+        return kerr.invert(z=z, coupling_loss=self.coupling_loss, kerr_input=self.kerr_input,
+                           io_coupling_coefficient=self.foreground_model.io_coupling_coefficient)
 
 
 # Models and fitters with a Kerr coefficient and nonlinear loss
@@ -183,38 +260,102 @@ class KerrLossReflection(AbstractReflection):
     This class models a resonator operated in reflection with a Kerr-type nonlinearity and nonlinear loss.
     """
 
-    def __init__(self, choose, *args, **kwds):
+    def __init__(self, choose, track=False, scan=True, *args, **kwds):
         """
         This class can be used directly, like any lmfit Model, but it is easier to use the KerrLossReflectionFitter
         wrapper class that is defined in this module.
 
         :param choose: a numpy ufunc; see `kerr_loss.photon_number`.
+        :param track: if True, follow a continuous branch of roots in the order of the frequency points; see
+          `kerr_loss.photon_number`.
+        :param scan: the default value of `scan` in guess().
         :param args: arguments passed directly to `lmfit.model.Model.__init__`.
         :param kwds: keywords passed directly to `lmfit.model.Model.__init__`.
         """
 
+        def detuning_and_photon_number(frequency, resonance_frequency, coupling_loss, internal_loss, nonlinear_loss,
+                                       reduced_kerr, reduced_input_rate):
+            detuning = frequency / resonance_frequency - 1
+            return detuning, kerr_loss.photon_number(detuning=detuning, coupling_loss=coupling_loss,
+                                                     internal_loss=internal_loss, nonlinear_loss=nonlinear_loss,
+                                                     reduced_kerr=reduced_kerr, reduced_input_rate=reduced_input_rate,
+                                                     io_coupling_coefficient=self.io_coupling_coefficient,
+                                                     choose=choose, track=track)
+
+        # The model function and its derivatives share the root solve when they are evaluated with the same parameters.
+        last_detuning_and_photon_number = base.LastEvaluation(detuning_and_photon_number)
+
         def kerr_loss_reflection(frequency, resonance_frequency, coupling_loss, internal_loss, nonlinear_loss,
                                  reduced_kerr, reduced_input_rate):
-            detuning = frequency / resonance_frequency - 1
-            photon_number = kerr_loss.photon_number(detuning=detuning, coupling_loss=coupling_loss,
-                                                    internal_loss=internal_loss, nonlinear_loss=nonlinear_loss,
-                                                    reduced_kerr=reduced_kerr, reduced_input_rate=reduced_input_rate,
-                                                    io_coupling_coefficient=self.io_coupling_coefficient, choose=choose)
+            detuning, photon_number = last_detuning_and_photon_number(
+                frequency, resonance_frequency, coupling_loss, internal_loss, nonlinear_loss, reduced_kerr,
+                reduced_input_rate)
             return -1 + 2 / (1 + ((internal_loss + nonlinear_loss * photon_number
                                    + 2j * (detuning - reduced_kerr * photon_number))
                                   / coupling_loss))
 
+        def kerr_loss_reflection_derivatives(frequency, resonance_frequency, coupling_loss, internal_loss,
+                                             nonlinear_loss, reduced_kerr, reduced_input_rate):
+            detuning, photon_number = last_detuning_and_photon_number(
+                frequency, resonance_frequency, coupling_loss, internal_loss, nonlinear_loss, reduced_kerr,
+                reduced_input_rate)
+            d_photon_number = kerr_loss.photon_number_derivatives(
+                detuning=detuning, photon_number=photon_number, coupling_loss=coupling_loss,
+                internal_loss=internal_loss, nonlinear_loss=nonlinear_loss, reduced_kerr=reduced_kerr,
+                reduced_input_rate=reduced_input_rate, io_coupling_coefficient=self.io_coupling_coefficient)
+            denominator = (coupling_loss + internal_loss + nonlinear_loss * photon_number
+                           + 2j * (detuning - reduced_kerr * photon_number))
+            # The derivatives of the model with respect to the denominator and of the denominator with respect to n.
+            d_denominator = -2 * coupling_loss / denominator ** 2
+            denominator_n = nonlinear_loss - 2j * reduced_kerr
+            return {'resonance_frequency': (-d_denominator * (2j + denominator_n * d_photon_number['detuning'])
+                                            * frequency / resonance_frequency ** 2),
+                    'coupling_loss': (2 / denominator
+                                      + d_denominator * (1 + denominator_n * d_photon_number['coupling_loss'])),
+                    'internal_loss': d_denominator * (1 + denominator_n * d_photon_number['internal_loss']),
+                    'nonlinear_loss': d_denominator * (photon_number
+                                                       + denominator_n * d_photon_number['nonlinear_loss']),
+                    'reduced_kerr': d_denominator * (-2j * photon_number
+                                                     + denominator_n * d_photon_number['reduced_kerr']),
+                    'reduced_input_rate': d_denominator * denominator_n * d_photon_number['reduced_input_rate']}
+
         super(KerrLossReflection, self).__init__(func=kerr_loss_reflection, *args, **kwds)
+        self.derivatives = kerr_loss_reflection_derivatives
+        self.scan = scan
 
-    def guess(self, data=None, frequency=None, **kwds):
-        resonance_frequency, coupling_loss, internal_loss = guess.guess_smooth(frequency=frequency, data=data)
+    def guess(self, data=None, frequency=None, scan=None, features=None, **kwds):
+        """
+        Return initial parameters; if scan is True, reduced_kerr, the resonance frequency, and the losses are chosen by
+        comparing the data to the model for a grid of values, and otherwise reduced_kerr starts at zero. Without
+        nonlinear loss, the Kerr detuning shift depends on the product of reduced_kerr and reduced_input_rate, which
+        plays the role of kerr_input, so the grid is that of `kerr.guess_kerr_input` divided by the guessed input rate.
+        The scan improves the initial values for data near and above bifurcation; it evaluates the model for about a
+        hundred sets of values, which takes a time comparable to a fit of a thousand points. The default of None means
+        to use the value given when the model was created.
+        """
+        if scan is None:
+            scan = self.scan
+        resonance_frequency, coupling_loss, internal_loss = guess.guess_smooth(
+            frequency=frequency, data=data, features=features)
+        nonlinear_loss = coupling_loss * internal_loss
+        reduced_input_rate = coupling_loss * internal_loss
+        reduced_kerr = 0
+        if scan:
+            resonance_frequency, coupling_loss, internal_loss, kerr_input = kerr.guess_kerr_input(
+                evaluate=lambda f, f_r, l_c, l_i, k: self.func(frequency=f, resonance_frequency=f_r, coupling_loss=l_c,
+                                                               internal_loss=l_i, nonlinear_loss=nonlinear_loss,
+                                                               reduced_kerr=k / reduced_input_rate,
+                                                               reduced_input_rate=reduced_input_rate),
+                frequency=frequency, data=data, resonance_frequency=resonance_frequency, coupling_loss=coupling_loss,
+                internal_loss=internal_loss, io_coupling_coefficient=self.io_coupling_coefficient)
+            reduced_kerr = kerr_input / reduced_input_rate
         params = self.make_params()
         params['resonance_frequency'].set(value=resonance_frequency, min=frequency.min(), max=frequency.max())
         params['coupling_loss'].set(value=coupling_loss, min=1e-12, max=1)
         params['internal_loss'].set(value=internal_loss, min=1e-12, max=1)
-        params['nonlinear_loss'].set(value=coupling_loss * internal_loss, min=1e-12, max=1)
-        params['reduced_kerr'].set(value=0)
-        params['reduced_input_rate'].set(value=coupling_loss * internal_loss, min=0)
+        params['nonlinear_loss'].set(value=nonlinear_loss, min=1e-12, max=1)
+        params['reduced_kerr'].set(value=reduced_kerr)
+        params['reduced_input_rate'].set(value=reduced_input_rate, min=0)
         return params
 
 
@@ -223,7 +364,8 @@ class KerrLossReflectionFitter(kerr_loss.KerrLossFitter):
     This class fits data from a resonator operated in reflection with a Kerr-type nonlinearity and nonlinear loss.
     """
 
-    def __init__(self, frequency, data, choose=kerr_loss.choose_min, background_model=None, errors=None, **fit_kwds):
+    def __init__(self, frequency, data, choose=kerr_loss.choose_min, background_model=None, errors=None, track=False,
+                 scan=True, **fit_kwds):
         """
         Fit the given data to a composite model that is the product of a background model and the KerrLossReflection
         model.
@@ -235,15 +377,28 @@ class KerrLossReflectionFitter(kerr_loss.KerrLossFitter):
           resonator; the default of `background.MagnitudePhase()` assumes that this is modeled well by a single complex
           constant at all frequencies.
         :param errors: an array of complex numbers containing the standard errors of the mean of the data points.
+        :param track: if True, the model follows a continuous branch of roots in the order of the frequency points,
+          which should then be the order in which they were measured; see `kerr_loss.photon_number`.
+        :param scan: if True, the default, the guess scans a grid of nonlinearities, and if False, it starts from the
+          linear guess; see `KerrLossReflection.guess`.
         :param kwds: keyword arguments passed directly to lmfit.model.Model.fit().
         """
         if background_model is None:
             background_model = background.MagnitudePhase()
         super(KerrLossReflectionFitter, self).__init__(frequency=frequency, data=data, choose=choose,
-                                                       foreground_model=KerrLossReflection(choose=choose),
-                                                       background_model=background_model, errors=errors, **fit_kwds)
+                                                       foreground_model=KerrLossReflection(choose=choose, track=track,
+                                                                                           scan=scan),
+                                                       background_model=background_model, errors=errors, track=track,
+                                                       **fit_kwds)
 
-    # ToDo: math
     def invert(self, scattering_data):
-        pass
+        """
+        Return the detuning and internal_loss that correspond to the given normalized data, including the Kerr detuning
+        shift and the nonlinear loss at the photon number implied by each data point; see `kerr_loss.invert` and
+        `base.ResonatorFitter.invert`.
+        """
+        z = self.coupling_loss * (2 / (1 + scattering_data) - 1)
+        return kerr_loss.invert(z=z, coupling_loss=self.coupling_loss, nonlinear_loss=self.nonlinear_loss,
+                                reduced_kerr=self.reduced_kerr, reduced_input_rate=self.reduced_input_rate,
+                                io_coupling_coefficient=self.foreground_model.io_coupling_coefficient)
 
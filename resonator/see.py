@@ -50,6 +50,11 @@ photon_number_defaults = {'linestyle': '-',
                           'color': color_cycle[0],
                           'alpha': 1}
 
+bistable_defaults = {'color': 'gray',
+                     'alpha': 0.2,
+                     'linewidth': 0,
+                     'label': 'bistable'}
+
 crosshairs_defaults = {'color': 'gray',
                        'linestyle': ':'}
 
@@ -544,3 +549,22 @@ def photon_number_vs_frequency(resonator, input_power_dBm, axes=None, num_model_
         axes.set_ylabel("photon number")
     if figure is not None:
         return figure, axes
+
+
+def bistable_region(resonator, axes, frequency_scale=1, bistable_settings=None):
+    """
+    Shade the frequency interval in which the best-fit model of a Kerr fitter is bistable, if there is one.
+
+    :param resonator: a fitter with a `bistable_frequency` method, such as a KerrFitter or KerrLossFitter.
+    :param axes: the Axes on which to shade the interval, which should have frequency on the horizontal axis.
+    :param frequency_scale: the scale of the horizontal axis, as in the other functions.
+    :param bistable_settings: a dict of keywords passed to axes.axvspan that override `bistable_defaults`.
+    :return: the patch returned by axes.axvspan, or None if the model is not bistable.
+    """
+    lower, upper = resonator.bistable_frequency()
+    if np.isnan(lower):
+        return None
+    bistable_kwds = bistable_defaults.copy()
+    if bistable_settings is not None:
+        bistable_kwds.update(bistable_settings)
+    return axes.axvspan(frequency_scale * lower, frequency_scale * upper, **bistable_kwds)
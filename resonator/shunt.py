@@ -3,6 +3,8 @@ This module contains models and fitters for resonators that are operated in the
 """
 from __future__ import absolute_import, division, print_function
 
+import functools
+
 import numpy as np
 
 from . import background, base, guess, linear, kerr
@@ -45,8 +47,20 @@ class LinearShunt(AbstractShunt):
 
         super(LinearShunt, self).__init__(func=linear_shunt, *args, **kwds)
 
-    def guess(self, data=None, frequency=None, **kwds):
-        resonance_frequency, coupling_loss, internal_loss = guess.guess_smooth(frequency=frequency, data=data)
+    @staticmethod
+    def derivatives(frequency, resonance_frequency, coupling_loss, internal_loss, asymmetry):
+        detuning = frequency / resonance_frequency - 1
+        denominator = coupling_loss + internal_loss + 2j * detuning
+        numerator = (1 + 1j * asymmetry) * coupling_loss
+        d_detuning = 2j * numerator / denominator ** 2
+        return {'resonance_frequency': -d_detuning * frequency / resonance_frequency ** 2,
+                'coupling_loss': -(1 + 1j * asymmetry) * (internal_loss + 2j * detuning) / denominator ** 2,
+                'internal_loss': numerator / denominator ** 2,
+                'asymmetry': -1j * coupling_loss / denominator}
+
+    def guess(self, data=None, frequency=None, features=None, **kwds):
+        resonance_frequency, coupling_loss, internal_loss = guess.guess_smooth(
+            frequency=frequency, data=data, features=features)
         params = self.make_params()
         params['resonance_frequency'].set(value=resonance_frequency, min=frequency.min(), max=frequency.max())
         params['coupling_loss'].set(value=coupling_loss, min=1e-12, max=1)
@@ -95,33 +109,87 @@ class KerrShunt(AbstractShunt):
     This class models a resonator operated in the shunt-coupled configuration with a Kerr-type nonlinearity.
     """
 
-    def __init__(self, choose, *args, **kwds):
+    def __init__(self, choose, track=False, table=None, scan=True, *args, **kwds):
         """
         This class can be used directly, like any lmfit Model, but it is easier to use the KerrShuntFitter wrapper
         class that is defined in this module.
 
         :param choose: a numpy ufunc; see `kerr.kerr_detuning_shift`.
+        :param track: if True, follow a continuous branch of roots in the order of the frequency points; see
+          `kerr.kerr_detuning_shift`.
+        :param table: None, to calculate the shift with `kerr.kerr_detuning_shift`, or a `kerr.DetuningShiftTable`, such
+          as the one returned by `kerr.detuning_shift_table()`, which gives the same values faster; it is not used if
+          track is True.
+        :param scan: the default value of `scan` in guess().
         :param args: arguments passed directly to lmfit.model.Model.__init__().
         :param kwds: keywords passed directly to lmfit.model.Model.__init__().
         """
 
-        def kerr_shunt(frequency, resonance_frequency, internal_loss, coupling_loss, asymmetry, kerr_input):
+        if table is None or track:
+            detuning_shift = functools.partial(kerr.kerr_detuning_shift, track=track)
+        else:
+            detuning_shift = table
+
+        def detuning_and_shift(frequency, resonance_frequency, coupling_loss, internal_loss, kerr_input):
             detuning = frequency / resonance_frequency - 1
-            shift = kerr.kerr_detuning_shift(detuning=detuning, coupling_loss=coupling_loss,
-                                             internal_loss=internal_loss, kerr_input=kerr_input,
-                                             io_coupling_coefficient=self.io_coupling_coefficient, choose=choose)
+            return detuning, detuning_shift(detuning=detuning, coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                            kerr_input=kerr_input, io_coupling_coefficient=self.io_coupling_coefficient,
+                                            choose=choose)
+
+        # The model function and its derivatives share the root solve when they are evaluated with the same parameters.
+        last_detuning_and_shift = base.LastEvaluation(detuning_and_shift)
+
+        def kerr_shunt(frequency, resonance_frequency, internal_loss, coupling_loss, asymmetry, kerr_input):
+            detuning, shift = last_detuning_and_shift(frequency, resonance_frequency, coupling_loss, internal_loss,
+                                                      kerr_input)
             return 1 - ((1 + 1j * asymmetry) / (1 + (internal_loss + 2j * (detuning - shift)) / coupling_loss))
 
+        def kerr_shunt_derivatives(frequency, resonance_frequency, internal_loss, coupling_loss, asymmetry, kerr_input):
+            detuning, shift = last_detuning_and_shift(frequency, resonance_frequency, coupling_loss, internal_loss,
+                                                      kerr_input)
+            d_shift = kerr.detuning_shift_derivatives(detuning=detuning, shift=shift, coupling_loss=coupling_loss,
+                                                      internal_loss=internal_loss, kerr_input=kerr_input,
+                                                      io_coupling_coefficient=self.io_coupling_coefficient)
+            denominator = coupling_loss + internal_loss + 2j * (detuning - shift)
+            # The derivative of the model with respect to the denominator.
+            d_denominator = (1 + 1j * asymmetry) * coupling_loss / denominator ** 2
+            return {'resonance_frequency': (-2j * d_denominator * (1 - d_shift['detuning'])
+                                            * frequency / resonance_frequency ** 2),
+                    'coupling_loss': (-(1 + 1j * asymmetry) / denominator
+                                      + d_denominator * (1 - 2j * d_shift['coupling_loss'])),
+                    'internal_loss': d_denominator * (1 - 2j * d_shift['internal_loss']),
+                    'asymmetry': -1j * coupling_loss / denominator,
+                    'kerr_input': -2j * d_denominator * d_shift['kerr_input']}
+
         super(KerrShunt, self).__init__(func=kerr_shunt, *args, **kwds)
+        self.derivatives = kerr_shunt_derivatives
+        self.scan = scan
 
-    def guess(self, data=None, frequency=None, **kwds):
-        resonance_frequency, coupling_loss, internal_loss = guess.guess_smooth(frequency=frequency, data=data)
+    def guess(self, data=None, frequency=None, scan=None, features=None, **kwds):
+        """
+        Return initial parameters; if scan is True, kerr_input, the resonance frequency, and the losses are chosen by
+        comparing the data to the model for a grid of values (see `kerr.guess_kerr_input`), and otherwise kerr_input
+        starts at zero. The scan improves the initial values for data near and above bifurcation; it evaluates the model
+        for about a hundred sets of values, which takes a time comparable to a fit of a thousand points. The default of
+        None means to use the value given when the model was created.
+        """
+        if scan is None:
+            scan = self.scan
+        resonance_frequency, coupling_loss, internal_loss = guess.guess_smooth(
+            frequency=frequency, data=data, features=features)
+        kerr_input = 0
+        if scan:
+            resonance_frequency, coupling_loss, internal_loss, kerr_input = kerr.guess_kerr_input(
+                evaluate=lambda f, f_r, l_c, l_i, k: self.func(frequency=f, resonance_frequency=f_r, internal_loss=l_i,
+                                                               coupling_loss=l_c, asymmetry=0, kerr_input=k),
+                frequency=frequency, data=data, resonance_frequency=resonance_frequency, coupling_loss=coupling_loss,
+                internal_loss=internal_loss, io_coupling_coefficient=self.io_coupling_coefficient)
         params = self.make_params()
         params['resonance_frequency'].set(value=resonance_frequency, min=frequency.min(), max=frequency.max())
         params['coupling_loss'].set(value=coupling_loss, min=1e-12, max=1)
         params['internal_loss'].set(value=internal_loss, min=1e-12, max=1)
         params['asymmetry'].set(value=0, min=-10, max=10)
-        params['kerr_input'].set(value=0)
+        params['kerr_input'].set(value=kerr_input)
         return params
 
     @classmethod
@@ -135,7 +203,8 @@ class KerrShuntFitter(kerr.KerrFitter):
     This class fits data from a shunt-coupled resonator with a Kerr-type nonlinearity.
     """
 
-    def __init__(self, frequency, data, choose=np.max, background_model=None, errors=None, **fit_kwds):
+    def __init__(self, frequency, data, choose=np.max, background_model=None, errors=None, track=False, table=None,
+                 scan=True, **fit_kwds):
         """
         Fit the given data to a composite model that is the product of a background model and the KerrShunt model.
 
@@ -146,14 +215,27 @@ class KerrShuntFitter(kerr.KerrFitter):
           resonator; the default of `background.MagnitudePhase()` assumes that this is modeled well by a single complex
           constant at all frequencies.
         :param errors: an array of complex numbers containing the standard errors of the mean of the data points.
+        :param track: if True, the model follows a continuous branch of roots in the order of the frequency points,
+          which should then be the order in which they were measured; see `kerr.kerr_detuning_shift`.
+        :param table: None or a `kerr.DetuningShiftTable` used by the model to calculate the shift faster; see
+          `KerrShunt`.
+        :param scan: if True, the default, the guess scans a grid of nonlinearities, and if False, it starts from the
+          linear guess; see `KerrShunt.guess`.
         :param kwds: keyword arguments passed directly to lmfit.model.Model.fit().
         """
         if background_model is None:
             background_model = background.MagnitudePhase()
         super(KerrShuntFitter, self).__init__(frequency=frequency, data=data, choose=choose,
-                                              foreground_model=KerrShunt(choose=choose),
-                                              background_model=background_model, errors=errors, **fit_kwds)
+                                              foreground_model=KerrShunt(choose=choose, track=track, table=table,
+                                                                          scan=scan),
+                                              background_model=background_model, errors=errors, track=track,
+                                              **fit_kwds)
 
-    # ToDo: math
     def invert(self, scattering_data):
-        pass
+        """
+        Return the detuning and internal_loss that correspond to the given normalized data, including the Kerr detuning
+        shift at the photon number implied by each data point; see `kerr.invert` and `base.ResonatorFitter.invert`.
+        """
+        z = self.coupling_loss * ((1 + 1j * self.asymmetry) / (1 - scattering_data) - 1)
+        return kerr.invert(z=z, coupling_loss=self.coupling_loss, kerr_input=self.kerr_input,
+                           io_coupling_coefficient=self.foreground_model.io_coupling_coefficient)
@@ -0,0 +1,273 @@
+"""
+Functions for fitting many data sets that share one frequency grid simultaneously, such as repeated sweeps of one
+resonator or the resonators of a multiplexed array measured on a common grid.
+
+The fitters in this package fit one data set at a time, so the Python overhead of each iteration of the minimizer is
+paid once per data set. The `fit_stacked` function in this module instead evaluates the model for all N data sets at
+once, with the parameters stored in an array with shape (N, number of varying parameters) that broadcasts against the
+frequency array to produce model arrays with shape (N, number of frequencies). The N least-squares problems are
+independent, so the Jacobian of the stacked problem is block-diagonal; each block is stored separately and the
+Levenberg-Marquardt steps for all of the data sets are calculated together using batched linear algebra. Data sets that
+have converged are removed from the following iterations.
+
+The models must implement `derivatives`, which is true of the linear models and all of the background models except
+`background.Magnitude`.
+"""
+from __future__ import absolute_import, division, print_function
+
+from copy import deepcopy
+
+import numpy as np
+
+from . import base, lean
+
+
+def fit_stacked(fitter_class, frequency, datas, errors=None, params=None, max_iterations=200, ftol=1.5e-8,
+                xtol=1.5e-8, **kwds):
+    """
+    Fit each row of the given data array simultaneously and return a list of fitters in the same order as the rows.
+    The result of each fitter is a lean.LeanResult.
+
+    Example:
+      fitters = fit_stacked(shunt.LinearShuntFitter, frequency=frequency, datas=s21_array)
+      internal_quality_factors = [fitter.Q_i for fitter in fitters]
+
+    :param fitter_class: a ResonatorFitter subclass (not an instance) that is created as
+      fitter_class(frequency=frequency, data=data, errors=errors, lazy=True, **kwds) for each data set; its models must
+      implement `derivatives`.
+    :param frequency: either a single 1D array of frequencies that is used for every data set, or a 2D array with the
+      same shape as datas.
+    :param datas: a 2D array of complex data with shape (number of data sets, number of frequencies).
+    :param errors: None to use equal weights, or an array of complex errors with the same shape as datas.
+    :param params: None or a lmfit.parameter.Parameters object containing initial values that are used for every data
+      set; as in ResonatorFitter.fit(), these overwrite the guessed parameters, and if they include every model
+      parameter then the guessing functions are not called.
+    :param max_iterations: the maximum number of iterations; data sets that have not converged by then have
+      `result.success` equal to False.
+    :param ftol: the fit of a data set has converged when a step reduces its chi-squared by less than this fraction.
+    :param xtol: the fit of a data set has converged when the scaled length of a step is less than this fraction of the
+      scaled length of the parameter vector.
+    :param kwds: keywords passed directly to the fitter class, such as `background_model`.
+    :return: list[ResonatorFitter]
+    """
+    datas = np.asarray(datas)
+    if datas.ndim != 2:
+        raise ValueError("The data must be a 2D array with one data set per row.")
+    frequency = np.asarray(frequency)
+    if frequency.ndim == 2 and frequency.shape != datas.shape:
+        raise ValueError("A 2D frequency array must have the same shape as the data array.")
+    num_data_sets = datas.shape[0]
+    fitters = [fitter_class(frequency=frequency if frequency.ndim == 1 else frequency[index], data=datas[index],
+                            errors=None if errors is None else errors[index], lazy=True, **kwds)
+               for index in range(num_data_sets)]
+    if not fitters:
+        return fitters
+    first = fitters[0]
+    if first.background_model.derivatives is None or first.foreground_model.derivatives is None:
+        raise ValueError("Stacked fitting requires models that implement derivatives.")
+    initial_params = []
+    for fitter in fitters:
+        p = fitter.initial_params(params=params)
+        # Each fitter writes its best-fit values into its own copy.
+        initial_params.append(deepcopy(p) if p is params else p)
+    if any(p.expr is not None for ps in initial_params for p in ps.values()):
+        raise ValueError("Stacked fitting does not support parameters constrained by expressions.")
+    var_names = [name for name, p in initial_params[0].items() if p.vary]
+    if any([name for name, p in ps.items() if p.vary] != var_names for ps in initial_params[1:]):
+        raise ValueError("Every data set must have the same varying parameters.")
+    initial_values = np.array([[ps[name].value for name in var_names] for ps in initial_params], dtype='float')
+    lower = np.array([[-np.inf if ps[name].min is None else ps[name].min for name in var_names]
+                      for ps in initial_params], dtype='float')
+    upper = np.array([[np.inf if ps[name].max is None else ps[name].max for name in var_names]
+                      for ps in initial_params], dtype='float')
+    bounds = lean.Bounds(lower=lower, upper=upper)
+    problem = _StackedProblem(fitters=fitters, params=initial_params, var_names=var_names, frequency=frequency,
+                              datas=datas, bounds=bounds)
+    internal, nfev, njev, success, messages = _levenberg_marquardt(
+        problem=problem, internal=bounds.internal(initial_values), max_iterations=max_iterations, ftol=ftol, xtol=xtol)
+    best_values = bounds.external(internal)
+    all_rows = np.arange(num_data_sets)
+    residuals = problem.residual(internal=internal, rows=all_rows)
+    covariances = _covariances(jacobian=problem.jacobian(internal=internal, rows=all_rows),
+                               derivative=bounds.derivative(internal), residuals=residuals)
+    for index, (fitter, ps) in enumerate(zip(fitters, initial_params)):
+        covar = covariances[index]
+        for column, name in enumerate(var_names):
+            ps[name].init_value = initial_values[index, column]
+            ps[name].value = best_values[index, column]
+            if covar is None or not covar[column, column] > 0:
+                ps[name].stderr = None
+            else:
+                ps[name].stderr = np.sqrt(covar[column, column])
+        for name, p in ps.items():
+            if name not in var_names:
+                p.stderr = None if covar is None else 0
+        fitter.result = lean.LeanResult(params=ps, init_values=dict(zip(var_names, initial_values[index])),
+                                        var_names=var_names, residual=residuals[index], covar=covar,
+                                        nfev=int(nfev[index]), njev=int(njev[index]), success=bool(success[index]),
+                                        message=messages[index])
+    return fitters
+
+
+class _StackedComponent(object):
+    """
+    One model in the product, with the values of its fixed arguments stored in arrays with shape (N, 1) and the columns
+    of its varying parameters in the array of varying values.
+    """
+
+    def __init__(self, model, params, var_names):
+        self.func = model.func
+        self.derivatives = model.derivatives
+        self.prefix = model.prefix
+        funcargs = [model.make_funcargs(params=ps) for ps in params]
+        names = [name for name in funcargs[0] if name != 'frequency']
+        self.fixed = dict((name, np.array([args[name] for args in funcargs])[:, np.newaxis]) for name in names
+                          if model.prefix + name not in var_names)
+        self.varying = [(name, var_names.index(model.prefix + name)) for name in names
+                        if model.prefix + name in var_names]
+
+    def kwargs(self, values, rows):
+        kwargs = dict((name, value[rows]) for name, value in self.fixed.items())
+        for name, column in self.varying:
+            kwargs[name] = values[:, column, np.newaxis]
+        return kwargs
+
+
+class _StackedProblem(object):
+    """
+    The residuals and Jacobians of the stacked problem, calculated for a subset of rows given by an array of indices.
+    The residuals and weights follow the lmfit convention, as in lean.fit().
+    """
+
+    def __init__(self, fitters, params, var_names, frequency, datas, bounds):
+        self.var_names = var_names
+        self.bounds = bounds
+        self.background = _StackedComponent(model=fitters[0].background_model, params=params, var_names=var_names)
+        self.foreground = _StackedComponent(model=fitters[0].foreground_model, params=params, var_names=var_names)
+        self.frequency = frequency
+        self.datas = np.asarray(datas, dtype='complex')
+        self.sign, complex_weights = base._residual_convention()
+        if fitters[0].weights is None:
+            self.complex_weights = self.float_weights = None
+        else:
+            weights = np.array([fitter.weights for fitter in fitters], dtype='complex')
+            self.complex_weights = weights if complex_weights else None
+            self.float_weights = None if complex_weights else weights.view('float')
+
+    def _frequency(self, rows):
+        return self.frequency if self.frequency.ndim == 1 else self.frequency[rows]
+
+    def _weigh(self, difference, rows):
+        # Return a real array with twice as many columns in the last dimension as the given complex array.
+        if self.complex_weights is not None:
+            difference = difference * self.complex_weights[rows].reshape(
+                (len(rows),) + (1,) * (difference.ndim - 2) + (-1,))
+        difference = np.ascontiguousarray(difference).view('float')
+        if self.float_weights is not None:
+            difference = difference * self.float_weights[rows].reshape(
+                (len(rows),) + (1,) * (difference.ndim - 2) + (-1,))
+        return difference
+
+    def residual(self, internal, rows):
+        """Return the residual array with shape (len(rows), 2 * number of frequencies)."""
+        values = self.bounds_for(rows).external(internal)
+        frequency = self._frequency(rows)
+        model = (self.background.func(frequency=frequency, **self.background.kwargs(values=values, rows=rows))
+                 * self.foreground.func(frequency=frequency, **self.foreground.kwargs(values=values, rows=rows)))
+        return self._weigh(self.sign * (self.datas[rows] - model), rows=rows)
+
+    def jacobian(self, internal, rows):
+        """Return the Jacobian array with shape (len(rows), 2 * number of frequencies, number of varying parameters)."""
+        bounds = self.bounds_for(rows)
+        values = bounds.external(internal)
+        frequency = self._frequency(rows)
+        shape = (len(rows), self.datas.shape[1])
+        background_kwargs = self.background.kwargs(values=values, rows=rows)
+        foreground_kwargs = self.foreground.kwargs(values=values, rows=rows)
+        background_values = self.background.func(frequency=frequency, **background_kwargs)
+        foreground_values = self.foreground.func(frequency=frequency, **foreground_kwargs)
+        jacobian = np.zeros((len(rows), len(self.var_names), shape[1]), dtype='complex')
+        for component, other_values, kwargs in [(self.background, foreground_values, background_kwargs),
+                                                (self.foreground, background_values, foreground_kwargs)]:
+            for name, derivative in component.derivatives(frequency=frequency, **kwargs).items():
+                if component.prefix + name in self.var_names:
+                    jacobian[:, self.var_names.index(component.prefix + name)] += np.broadcast_to(
+                        derivative * other_values, shape)
+        jacobian *= -self.sign * bounds.derivative(internal)[:, :, np.newaxis]
+        return self._weigh(jacobian, rows=rows).transpose(0, 2, 1)
+
+    def bounds_for(self, rows):
+        return lean.Bounds(lower=self.bounds.lower[rows], upper=self.bounds.upper[rows])
+
+
+def _levenberg_marquardt(problem, internal, max_iterations, ftol, xtol):
+    """
+    Minimize the sum of squares of the residual of each row of the stacked problem using the Levenberg-Marquardt
+    algorithm with Marquardt's scaling of the damping term; see lean._damped_steps() and lean._step_tests(). Return the
+    internal values, the numbers of function and Jacobian evaluations, the success flags, and the termination messages
+    of the rows.
+    """
+    num_rows, num_vars = internal.shape
+    internal = internal.copy()
+    all_rows = np.arange(num_rows)
+    residual = problem.residual(internal=internal, rows=all_rows)
+    cost = np.sum(residual ** 2, axis=1)
+    jacobian = problem.jacobian(internal=internal, rows=all_rows)
+    damping = np.full(num_rows, 1e-3)
+    nfev = np.ones(num_rows, dtype='int')
+    njev = np.ones(num_rows, dtype='int')
+    success = np.zeros(num_rows, dtype='bool')
+    messages = [lean.max_iterations_message] * num_rows
+    # A row whose residual is not finite at the initial values cannot be fit, and every trial step would be rejected.
+    active = np.isfinite(cost)
+    for row in np.flatnonzero(~active):
+        messages[row] = lean.not_finite_message
+    for iteration in range(max_iterations):
+        rows = np.flatnonzero(active)
+        if not rows.size:
+            break
+        jtj = np.einsum('nij,nik->njk', jacobian[rows], jacobian[rows])
+        jtr = np.einsum('nij,ni->nj', jacobian[rows], residual[rows])
+        step, scale = lean._damped_steps(jtj=jtj, jtr=jtr, damping=damping[rows])
+        trial = internal[rows] + step
+        trial_residual = problem.residual(internal=trial, rows=rows)
+        trial_cost = np.sum(trial_residual ** 2, axis=1)
+        nfev[rows] += 1
+        better, damping[rows], done, converged, row_messages = lean._step_tests(
+            cost=cost[rows], trial_cost=trial_cost, internal=internal[rows], step=step, scale=scale,
+            damping=damping[rows], ftol=ftol, xtol=xtol)
+        accepted = rows[better]
+        internal[accepted] = trial[better]
+        residual[accepted] = trial_residual[better]
+        cost[accepted] = trial_cost[better]
+        if accepted.size:
+            jacobian[accepted] = problem.jacobian(internal=internal[accepted], rows=accepted)
+            njev[accepted] += 1
+        for row, message in zip(rows, row_messages):
+            if message is not None:
+                messages[row] = message
+        success[rows[done]] = converged[done]
+        active[rows[done]] = False
+    return internal, nfev, njev, success, messages
+
+
+def _covariances(jacobian, derivative, residuals):
+    """
+    Return a list containing the covariance matrix of the parameters of each row, scaled by the reduced chi-squared as
+    in lmfit, or None if the matrix is singular.
+    """
+    num_rows, num_points, num_vars = jacobian.shape
+    jtj = np.einsum('nij,nik->njk', jacobian, jacobian)
+    try:
+        inverses = list(np.linalg.inv(jtj))
+    except np.linalg.LinAlgError:
+        inverses = []
+        for matrix in jtj:
+            try:
+                inverses.append(np.linalg.inv(matrix))
+            except np.linalg.LinAlgError:
+                inverses.append(None)
+    nfree = num_points - num_vars
+    redchi = np.sum(residuals ** 2, axis=1) / max(nfree, 1)
+    return [None if inverse is None else inverse * np.outer(d, d) * (r if nfree > 0 else 1)
+            for inverse, d, r in zip(inverses, derivative, redchi)]
@@ -0,0 +1,315 @@
+"""
+A compact on-disk store for the results of many fits, such as those returned by `batch.fit_many` or `sweep.fit_map`.
+
+A store is a directory that contains one raw binary file per column, written with plain NumPy, and a JSON file of
+metadata. Each row is one fit. There is one column for the best-fit value of each model parameter, one column for its
+standard error, named with an `_error` suffix as on the fitters, columns for its lower and upper bounds, named with
+`_min` and `_max` suffixes, and columns for chisqr, redchi, nfev, and the success flag. The bounds are stored per row
+because they can depend on the data; for example, the resonance frequency is bounded by the frequency range of each data
+set. The metadata contains the names of the fitter, foreground model, and background model classes, the `choose`
+function and `track` setting of Kerr fitters, the column names and data types, and the number of rows. Rows are
+appended by appending to the column files, and the columns are read as read-only memory maps, so reading one column of
+a large store does not load the others.
+
+Missing values, such as the standard errors of a fit that could not estimate them or the values of a fit that raised
+an exception, are stored as NaN.
+
+The best-fit parameters of any row can be turned back into a fitter for the original data without fitting again using
+ResultStore.fitter(), which calls ResonatorFitter.from_params(); the rebuilt fitter can be used for evaluation,
+inversion, and the plots in `see.py`. A rebuilt Kerr fitter uses the stored `choose` function and `track` setting, so
+it follows the same branch of photon numbers as the fit that produced the row; a `choose` function that cannot be
+imported by its qualified name, such as a lambda, is not stored and must be passed to ResultStore.fitter().
+"""
+from __future__ import absolute_import, division, print_function
+
+import importlib
+import inspect
+import io
+import json
+import os
+
+import lmfit
+import numpy as np
+
+from . import base
+
+format_version = 3
+metadata_filename = 'metadata.json'
+column_extension = '.bin'
+error_suffix = '_error'
+min_suffix = '_min'
+max_suffix = '_max'
+
+# The columns of fit statistics that follow the parameter columns, with their little-endian data types.
+statistic_columns = [('chisqr', '<f8'),
+                     ('redchi', '<f8'),
+                     ('nfev', '<i8'),
+                     ('success', '|b1')]
+
+
+class ResultStore(object):
+    """
+    This class reads and writes a directory of fit results; see the module docstring.
+
+    Example:
+      store = ResultStore('results')
+      store.append(batch.fit_many(shunt.LinearShuntFitter, frequencies=frequency, datas=s21_array),
+                   fitter_class=shunt.LinearShuntFitter)
+      internal_quality_factors = 1 / store['internal_loss'][store['success']]
+      fitter = store.fitter(row=10, frequency=frequency, data=s21_array[10])
+    """
+
+    def __init__(self, path):
+        """
+        Open the store in the given directory, which is created when the first rows are appended if it does not exist.
+
+        :param path: the path of the store directory.
+        """
+        self.path = path
+        metadata_path = os.path.join(path, metadata_filename)
+        if os.path.exists(metadata_path):
+            with io.open(metadata_path, 'r', encoding='utf-8') as f:
+                self.metadata = json.load(f)
+            if self.metadata['format_version'] > format_version:
+                raise ValueError("Store format version {} is newer than the supported version {}.".format(
+                    self.metadata['format_version'], format_version))
+        else:
+            self.metadata = None
+
+    def __len__(self):
+        return 0 if self.metadata is None else self.metadata['num_rows']
+
+    def __getitem__(self, column):
+        return self.column(column)
+
+    def __repr__(self):
+        if self.metadata is None:
+            return '{}({!r}): empty'.format(self.__class__.__name__, self.path)
+        return '{}({!r}): {} rows of {}'.format(self.__class__.__name__, self.path, len(self),
+                                                self.metadata['fitter_class'])
+
+    @property
+    def parameter_names(self):
+        """The names of the model parameters, in the order of the columns."""
+        return [] if self.metadata is None else [p['name'] for p in self.metadata['parameters']]
+
+    @property
+    def columns(self):
+        """The names of all columns, in order."""
+        return [] if self.metadata is None else [name for name, dtype in self.metadata['columns']]
+
+    @property
+    def fitter_class(self):
+        """The ResonatorFitter subclass that produced the results."""
+        return _resolve(self.metadata['fitter_class'])
+
+    @property
+    def background_class(self):
+        """The background model class, or None if it was not recorded."""
+        name = self.metadata['background_model']
+        return None if name is None else _resolve(name)
+
+    def column(self, name):
+        """
+        Return the given column as a read-only array with one element per row; it is a memory map of the column file
+        unless the store is empty.
+
+        :param name: a column name, such as 'resonance_frequency', 'resonance_frequency_error', or 'chisqr'.
+        :return: numpy.ndarray
+        """
+        dtypes = dict(self.metadata['columns']) if self.metadata is not None else {}
+        if name not in dtypes:
+            raise KeyError("Unknown column: {}".format(name))
+        num_rows = len(self)
+        if num_rows == 0:
+            empty = np.zeros(0, dtype=dtypes[name])
+            empty.flags.writeable = False
+            return empty
+        return np.memmap(self._column_path(name), dtype=dtypes[name], mode='r', shape=(num_rows,))
+
+    def append(self, results, fitter_class=None, background_model=None, choose=None, track=None):
+        """
+        Append one row per result to the store.
+
+        :param results: a sequence of ResonatorFitter objects or batch.FitOutcome objects; a failed FitOutcome produces
+          a row of NaN values with success False.
+        :param fitter_class: the ResonatorFitter subclass that produced the results; this is required when the first
+          rows appended to a new store are FitOutcome objects, and otherwise it is taken from the fitters.
+        :param background_model: the background model instance used for the fits, if they are FitOutcome objects and
+          the fitter class was not created with its default background model.
+        :param choose: the `choose` function used for the fits, if they are FitOutcome objects from a Kerr fitter class
+          that was not created with its default `choose`; otherwise, it is taken from the fitters.
+        :param track: the `track` value used for the fits, if they are FitOutcome objects from a Kerr fitter class that
+          was not created with its default `track`; otherwise, it is taken from the fitters.
+        :return: None
+        """
+        results = list(results)
+        if not results:
+            return
+        if self.metadata is None:
+            self.metadata = _new_metadata(results=results, fitter_class=fitter_class,
+                                          background_model=background_model, choose=choose, track=track)
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+        rows = [_row(result=result, parameter_names=self.parameter_names) for result in results]
+        num_rows = len(self)
+        for column, (name, dtype) in enumerate(self.metadata['columns']):
+            values = np.array([row[column] for row in rows], dtype=dtype)
+            with io.open(self._column_path(name), 'ab') as f:
+                # Discard anything written after the last complete append, such as by an interrupted append.
+                f.truncate(num_rows * np.dtype(dtype).itemsize)
+                f.seek(0, os.SEEK_END)
+                values.tofile(f)
+        self.metadata['num_rows'] = num_rows + len(rows)
+        self._write_metadata()
+
+    def params(self, row):
+        """
+        Return a lmfit.parameter.Parameters object containing the best-fit values, standard errors, and bounds of the
+        given row. Stores written before the bounds were recorded produce unbounded parameters.
+
+        :param row: the row index.
+        :return: lmfit.parameter.Parameters
+        """
+        params = lmfit.Parameters()
+        columns = self.columns
+        for p in self.metadata['parameters']:
+            bounds = {}
+            if p['name'] + min_suffix in columns:
+                bounds = {'min': _bound(self.column(p['name'] + min_suffix)[row], -np.inf),
+                          'max': _bound(self.column(p['name'] + max_suffix)[row], np.inf)}
+            params.add(p['name'], value=float(self.column(p['name'])[row]), vary=p['vary'], **bounds)
+            error = float(self.column(p['name'] + error_suffix)[row])
+            params[p['name']].stderr = None if np.isnan(error) else error
+        return params
+
+    def fitter(self, row, frequency, data, **kwds):
+        """
+        Return a fitter for the given data that uses the stored parameters of the given row as its result, without
+        fitting; see ResonatorFitter.from_params().
+
+        :param row: the row index.
+        :param frequency: the frequency array of the data that produced the row.
+        :param data: the complex data array that produced the row.
+        :param kwds: keywords passed directly to the fitter class, such as `errors` or keywords that the fitter class
+          requires; unless given here, a background model of the stored class is created and passed to fitter classes
+          that accept `background_model`, and the stored `choose` and `track` values are passed to fitter classes that
+          accept them.
+        :return: ResonatorFitter
+        """
+        if not -len(self) <= row < len(self):
+            raise IndexError("Row {} is out of range for a store with {} rows.".format(row, len(self)))
+        fitter_class = self.fitter_class
+        background_class = self.background_class
+        if ('background_model' not in kwds and background_class is not None
+                and 'background_model' in inspect.signature(fitter_class.__init__).parameters):
+            kwds['background_model'] = background_class()
+        settings = self.metadata.get('settings', {})
+        if 'choose' in settings and 'choose' not in kwds:
+            if settings['choose'] is None:
+                raise ValueError("The choose function of this store could not be stored, so it must be given.")
+            kwds['choose'] = _resolve(settings['choose'])
+        if 'track' in settings and 'track' not in kwds:
+            kwds['track'] = settings['track']
+        return fitter_class.from_params(params=self.params(row), frequency=frequency, data=data, **kwds)
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + column_extension)
+
+    def _write_metadata(self):
+        metadata_path = os.path.join(self.path, metadata_filename)
+        temporary_path = metadata_path + '.tmp'
+        with io.open(temporary_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self.metadata, indent=2))
+        os.replace(temporary_path, metadata_path)
+
+
+def _qualified_name(cls):
+    return '{}.{}'.format(cls.__module__, cls.__name__)
+
+
+def _resolve(qualified_name):
+    module_name, class_name = qualified_name.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _function_name(function):
+    """Return the qualified name of the given function, or None if the function cannot be imported by that name."""
+    name = '{}.{}'.format(getattr(function, '__module__', None), getattr(function, '__qualname__', None))
+    try:
+        resolved = _resolve(name)
+    except (ImportError, AttributeError, ValueError):
+        return None
+    return name if resolved is function else None
+
+
+def _bound(value, default):
+    """Return the given stored bound, or the default if it is NaN, as it is for a failed fit."""
+    return default if np.isnan(value) else float(value)
+
+
+def _settings(fitter_class, fitter, choose, track):
+    """Return the choose and track settings of a Kerr fitter, or an empty dict for fitter classes without them."""
+    if fitter is not None:
+        if not hasattr(fitter, '_choose'):
+            return {}
+        choose, track = fitter._choose, fitter._track
+    else:
+        defaults = inspect.signature(fitter_class.__init__).parameters
+        if 'choose' not in defaults:
+            return {}
+        if choose is None:
+            choose = defaults['choose'].default
+        if track is None:
+            track = defaults['track'].default
+    return {'choose': _function_name(choose), 'track': bool(track)}
+
+
+def _new_metadata(results, fitter_class, background_model, choose, track):
+    fitters = [result for result in results if isinstance(result, base.ResonatorFitter)]
+    if fitters:
+        first = fitters[0]
+        fitter_class = first.__class__
+        foreground_name = _qualified_name(first.foreground_model.__class__)
+        background_name = _qualified_name(first.background_model.__class__)
+        params = first.result.params
+        settings = _settings(fitter_class=fitter_class, fitter=first, choose=None, track=None)
+    else:
+        if fitter_class is None:
+            raise ValueError("The fitter class is required to store FitOutcome objects in a new store.")
+        foreground_name = None
+        background_name = None if background_model is None else _qualified_name(background_model.__class__)
+        params = next((result.params for result in results if result.params is not None), None)
+        if params is None:
+            raise ValueError("The parameter names cannot be determined because every fit failed.")
+        settings = _settings(fitter_class=fitter_class, fitter=None, choose=choose, track=track)
+    parameters = [{'name': name, 'vary': bool(p.vary)} for name, p in params.items()]
+    columns = []
+    for p in parameters:
+        columns.extend([(p['name'], '<f8'), (p['name'] + error_suffix, '<f8'), (p['name'] + min_suffix, '<f8'),
+                        (p['name'] + max_suffix, '<f8')])
+    columns.extend(statistic_columns)
+    return {'format_version': format_version,
+            'fitter_class': _qualified_name(fitter_class),
+            'foreground_model': foreground_name,
+            'background_model': background_name,
+            'parameters': parameters,
+            'settings': settings,
+            'columns': columns,
+            'num_rows': 0}
+
+
+def _row(result, parameter_names):
+    """Return a list of the values of one row, in column order."""
+    if isinstance(result, base.ResonatorFitter):
+        result = result.result
+    params = result.params
+    row = []
+    for name in parameter_names:
+        if params is None:
+            row.extend([np.nan, np.nan, np.nan, np.nan])
+        else:
+            p = params[name]
+            row.extend([p.value, np.nan if p.stderr is None else p.stderr, p.min, p.max])
+    row.extend([result.chisqr, result.redchi, result.nfev, bool(result.success)])
+    return row
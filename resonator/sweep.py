@@ -0,0 +1,185 @@
+"""
+Functions for fitting sweeps of data sets in which neighboring data sets differ only slightly, such as a resonance
+measured at a series of input powers or magnetic fluxes.
+
+Instead of guessing initial values for every data set, each fit starts from the best-fit parameters of the neighboring
+data set that has already been fit. This skips the guessing functions entirely and usually needs fewer function
+evaluations because the initial values are close to the best-fit values. If a warm-started fit fails a quality check,
+the data set is fit again using the usual guess.
+"""
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import traceback
+
+import numpy as np
+
+from . import batch
+
+# Settings shared by every row that a worker process fits; see _initialize_worker().
+_worker_settings = {}
+
+
+def fit_sweep(fitter_class, frequency, datas, errors=None, start=0, max_redchi_ratio=2, **kwds):
+    """
+    Fit each data set in a sweep using initial values equal to the best-fit parameters of the neighboring data set, and
+    return a list of fitters in the same order as the data sets.
+
+    The data set with index `start` is fit using the usual guess. The data sets with higher indices are then fit in
+    increasing order, each starting from the best-fit parameters of the previous data set, and the data sets with lower
+    indices are fit in decreasing order in the same way. A warm-started fit is accepted if the lmfit success flag is True
+    and its reduced chi-squared is at most `max_redchi_ratio` times that of the neighboring fit; otherwise, the data set
+    is fit again using the usual guess and the fit with the lower chi-squared is kept.
+
+    :param fitter_class: a ResonatorFitter subclass (not an instance) that is created as
+      fitter_class(frequency=frequency, data=data, errors=errors, params=params, **kwds) for each data set.
+    :param frequency: either a single 1D array of frequencies that is used for every data set, or a 2D array with one
+      row per data set.
+    :param datas: a 2D array of complex data with shape (number of data sets, number of frequencies), ordered by the
+      swept quantity.
+    :param errors: None to use equal weights, or an array of complex errors with the same shape as datas.
+    :param start: the index of the data set that is fit first; choosing a data set with a clear resonance helps.
+    :param max_redchi_ratio: the maximum ratio of reduced chi-squared values of a warm-started fit and its neighbor.
+    :param kwds: keywords passed directly to the fitter class; these may not include `params`.
+    :return: list[ResonatorFitter]
+    """
+    fitters, _ = _fit_sweep(fitter_class=fitter_class, frequency=frequency, datas=datas, errors=errors, start=start,
+                            max_redchi_ratio=max_redchi_ratio, kwds=kwds, raise_errors=True)
+    return fitters
+
+
+def fit_map(fitter_class, frequency, datas, errors=None, start=0, max_redchi_ratio=2, processes=None, **kwds):
+    """
+    Fit a two-dimensional map of data sets, such as a resonance measured at every combination of input power and
+    magnetic flux, by fitting each row as a sweep using `fit_sweep`. The rows are independent, so they are fit in
+    parallel on a pool of processes. Return a list of lists of batch.FitOutcome objects with the same shape as the map;
+    an exception raised while fitting one data set is recorded in the corresponding outcome.
+
+    :param fitter_class: a ResonatorFitter subclass (not an instance); see `fit_sweep`.
+    :param frequency: either a single 1D array of frequencies that is used for every data set, or an array with the
+      same shape as datas.
+    :param datas: a 3D array of complex data with shape (number of rows, number of data sets per row, number of
+      frequencies); each row is a sweep ordered by the swept quantity.
+    :param errors: None to use equal weights, or an array of complex errors with the same shape as datas.
+    :param start: the index of the data set in each row that is fit first; see `fit_sweep`.
+    :param max_redchi_ratio: see `fit_sweep`.
+    :param processes: the number of worker processes; the default of None uses `multiprocessing.cpu_count()`, and 1
+      fits the rows in the current process without creating a pool.
+    :param kwds: keywords passed directly to the fitter class; see `batch.fit_many` for restrictions.
+    :return: list[list[batch.FitOutcome]]
+    """
+    frequency = np.asarray(frequency)
+    shared_frequency = frequency.ndim == 1
+    num_rows = len(datas)
+    settings = {'fitter_class': fitter_class, 'start': start, 'max_redchi_ratio': max_redchi_ratio, 'kwds': kwds}
+    rows = [(frequency if shared_frequency else frequency[row], datas[row], None if errors is None else errors[row])
+            for row in range(num_rows)]
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes == 1 or num_rows <= 1:
+        _initialize_worker(settings)
+        try:
+            return [_fit_row(row) for row in rows]
+        finally:
+            _worker_settings.clear()
+    pool = multiprocessing.Pool(processes=processes, initializer=_initialize_worker, initargs=(settings,))
+    try:
+        return pool.map(_fit_row, rows, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def warm_start_params(params, frequency):
+    """
+    Return a copy of the given best-fit parameters that can be used as initial values for a fit to data at the given
+    frequencies: the bounds on the resonance frequency are set to the frequency range, as they are by the guessing
+    functions, and the standard errors are removed.
+
+    :param params: a lmfit.parameter.Parameters object, typically the best-fit parameters of a neighboring fit.
+    :param frequency: the frequency array of the data to be fit.
+    :return: lmfit.parameter.Parameters
+    """
+    params = params.copy()
+    for p in params.values():
+        p.stderr = None
+        p.correl = None
+    if 'resonance_frequency' in params:
+        resonance_frequency = params['resonance_frequency']
+        resonance_frequency.set(value=np.clip(resonance_frequency.value, frequency.min(), frequency.max()),
+                                min=frequency.min(), max=frequency.max())
+    return params
+
+
+def _sweep_order(num_data_sets, start):
+    """Yield (index, neighbor index) pairs in the order in which a sweep is fit; the first neighbor index is None."""
+    yield start, None
+    for index in range(start + 1, num_data_sets):
+        yield index, index - 1
+    for index in range(start - 1, -1, -1):
+        yield index, index + 1
+
+
+def _fit_sweep(fitter_class, frequency, datas, errors, start, max_redchi_ratio, kwds, raise_errors):
+    frequency = np.asarray(frequency)
+    num_data_sets = len(datas)
+    fitters = [None] * num_data_sets
+    tracebacks = [None] * num_data_sets
+    for index, neighbor_index in _sweep_order(num_data_sets=num_data_sets, start=start):
+        # If the neighbor failed, start from the last successful fit in the same direction.
+        neighbor = None
+        if neighbor_index is not None:
+            neighbor = fitters[neighbor_index]
+            if neighbor is None:
+                neighbor = _nearest_neighbor(fitters=fitters, index=index, direction=neighbor_index - index)
+        try:
+            fitters[index] = _fit_data_set(
+                fitter_class=fitter_class, frequency=frequency if frequency.ndim == 1 else frequency[index],
+                data=datas[index], errors=None if errors is None else errors[index], neighbor=neighbor,
+                max_redchi_ratio=max_redchi_ratio, kwds=kwds)
+        except Exception:
+            if raise_errors:
+                raise
+            tracebacks[index] = traceback.format_exc()
+    return fitters, tracebacks
+
+
+def _nearest_neighbor(fitters, index, direction):
+    neighbor_index = index + direction
+    while 0 <= neighbor_index < len(fitters):
+        if fitters[neighbor_index] is not None:
+            return fitters[neighbor_index]
+        neighbor_index += direction
+    return None
+
+
+def _fit_data_set(fitter_class, frequency, data, errors, neighbor, max_redchi_ratio, kwds):
+    warm = None
+    if neighbor is not None:
+        try:
+            warm = fitter_class(frequency=frequency, data=data, errors=errors,
+                                params=warm_start_params(params=neighbor.result.params, frequency=frequency), **kwds)
+        except Exception:  # For example, the model produced NaN values; fall back to the usual guess.
+            warm = None
+        if (warm is not None and warm.result.success
+                and warm.result.redchi <= max_redchi_ratio * neighbor.result.redchi):
+            return warm
+    fresh = fitter_class(frequency=frequency, data=data, errors=errors, **kwds)
+    if warm is not None and warm.result.chisqr < fresh.result.chisqr:
+        return warm
+    return fresh
+
+
+def _initialize_worker(settings):
+    _worker_settings.clear()
+    _worker_settings.update(settings)
+
+
+def _fit_row(row):
+    frequency, datas, errors = row
+    fitters, tracebacks = _fit_sweep(fitter_class=_worker_settings['fitter_class'], frequency=frequency, datas=datas,
+                                     errors=errors, start=_worker_settings['start'],
+                                     max_redchi_ratio=_worker_settings['max_redchi_ratio'],
+                                     kwds=_worker_settings['kwds'], raise_errors=False)
+    return [batch.failed_outcome(error=error) if fitter is None else batch.outcome(fitter)
+            for fitter, error in zip(fitters, tracebacks)]
@@ -7,16 +7,17 @@ Because there is no fixed reference point, more information must be provided in
 existing models are thus less-developed than those for the other configurations. The current limitations are
 - the existing fitters all use hardcoded background models;
 - the existing models assume that both ports have equal coupling losses;
-- the Kerr nonlinear models are not yet implemented;
 - the example notebooks have not been created yet.
 
 If you need to fit resonators in this configuration, ask!
 """
 from __future__ import absolute_import, division, print_function
 
+import functools
+
 import numpy as np
 
-from . import background, base, guess, linear
+from . import background, base, guess, kerr, linear
 
 
 class AbstractSymmetricTransmission(base.ResonatorModel):
@@ -32,6 +33,23 @@ class AbstractSymmetricTransmission(base.ResonatorModel):
     io_coupling_coefficient = 1
 
 
+def _guess_peak(data, frequency):
+    """
+    Return the resonance frequency, the total loss, and the ratio of the internal loss to the coupling loss guessed
+    from the position, width, and height of the peak in the magnitude of the normalized data.
+    """
+    smoothed_magnitude = guess.smooth(np.abs(data))
+    peak_index = np.argmax(smoothed_magnitude)
+    resonance_frequency = frequency[peak_index]  # guess that the resonance is the highest point
+    power_minus_half_max = smoothed_magnitude ** 2 - smoothed_magnitude[peak_index] ** 2 / 2
+    f1 = np.interp(0, power_minus_half_max[:peak_index], frequency[:peak_index])
+    f2 = np.interp(0, -power_minus_half_max[peak_index:], frequency[peak_index:])
+    linewidth = f2 - f1
+    internal_plus_coupling = linewidth / resonance_frequency
+    internal_over_coupling = (1 / np.abs(data[peak_index]) - 1)
+    return resonance_frequency, internal_plus_coupling, internal_over_coupling
+
+
 # Linear models and fitters
 
 class LinearSymmetricTransmission(AbstractSymmetricTransmission):
@@ -57,27 +75,30 @@ class LinearSymmetricTransmission(AbstractSymmetricTransmission):
 
         super(LinearSymmetricTransmission, self).__init__(func=symmetric_transmission, *args, **kwargs)
 
+    @staticmethod
+    def derivatives(frequency, resonance_frequency, coupling_loss, internal_loss):
+        detuning = frequency / resonance_frequency - 1
+        denominator = coupling_loss + internal_loss + 2j * detuning
+        d_detuning = -2j * coupling_loss / denominator ** 2
+        return {'resonance_frequency': -d_detuning * frequency / resonance_frequency ** 2,
+                'coupling_loss': (internal_loss + 2j * detuning) / denominator ** 2,
+                'internal_loss': -coupling_loss / denominator ** 2}
+
     #ToDo: implement and test guess.guess_smooth
-    def guess(self, data, frequency=None, coupling_loss=None):
+    def guess(self, data, frequency=None, coupling_loss=None, **kwds):
         """
         Return a lmfit.Parameters object containing reasonable initial values generated from the given data.
 
         :param data: an array of complex transmission data.
         :param frequency: an array of real frequencies at which the data was measured.
         :param coupling_loss: if not None, the coupling loss is set to the given value and is not varied in the fit.
+        :param kwds: currently ignored, such as the `features` keyword passed by `ResonatorFitter.guess`.
         :return: lmfit.Parameters
         """
         params = self.make_params()
-        smoothed_magnitude = guess.smooth(np.abs(data))
-        peak_index = np.argmax(smoothed_magnitude)
-        resonance_frequency_guess = frequency[peak_index]  # guess that the resonance is the highest point
+        resonance_frequency_guess, internal_plus_coupling, internal_over_coupling = _guess_peak(data=data,
+                                                                                             frequency=frequency)
         params['resonance_frequency'].set(value=resonance_frequency_guess, min=frequency.min(), max=frequency.max())
-        power_minus_half_max = smoothed_magnitude ** 2 - smoothed_magnitude[peak_index] ** 2 / 2
-        f1 = np.interp(0, power_minus_half_max[:peak_index], frequency[:peak_index])
-        f2 = np.interp(0, -power_minus_half_max[peak_index:], frequency[peak_index:])
-        linewidth = f2 - f1
-        internal_plus_coupling = linewidth / resonance_frequency_guess
-        internal_over_coupling = (1 / np.abs(data[peak_index]) - 1)
         if coupling_loss is None:
             params['coupling_loss'].set(value=internal_plus_coupling / (1 + internal_over_coupling),
                                         min=1e-12, max=1)
@@ -162,3 +183,155 @@ class CCxSTFitterKnownCoupling(linear.LinearResonatorFitter):
                                                         self.background_model.eval(params=params, frequency=frequency)),
                                                   frequency=frequency, coupling_loss=self.known_coupling_loss))
         return params
+
+
+# Kerr models and fitters
+
+class KerrSymmetricTransmission(AbstractSymmetricTransmission):
+    """
+    This class models a resonator operated in transmission with a Kerr-type nonlinearity, where the two ports have
+    equal coupling losses.
+    """
+
+    def __init__(self, choose, track=False, table=None, scan=True, *args, **kwds):
+        """
+        This class can be used directly, like any lmfit Model, but it is easier to use the
+        KerrSymmetricTransmissionFitter wrapper class that is defined in this module.
+
+        :param choose: a numpy ufunc; see `kerr.kerr_detuning_shift`.
+        :param track: if True, follow a continuous branch of roots in the order of the frequency points; see
+          `kerr.kerr_detuning_shift`.
+        :param table: None, to calculate the shift with `kerr.kerr_detuning_shift`, or a `kerr.DetuningShiftTable`, such
+          as the one returned by `kerr.detuning_shift_table()`, which gives the same values faster; it is not used if
+          track is True.
+        :param scan: the default value of `scan` in guess().
+        :param args: arguments passed directly to `lmfit.model.Model.__init__`.
+        :param kwds: keywords passed directly to `lmfit.model.Model.__init__`.
+        """
+
+        if table is None or track:
+            detuning_shift = functools.partial(kerr.kerr_detuning_shift, track=track)
+        else:
+            detuning_shift = table
+
+        def detuning_and_shift(frequency, resonance_frequency, coupling_loss, internal_loss, kerr_input):
+            detuning = frequency / resonance_frequency - 1
+            return detuning, detuning_shift(detuning=detuning, coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                            kerr_input=kerr_input, io_coupling_coefficient=self.io_coupling_coefficient,
+                                            choose=choose)
+
+        # The model function and its derivatives share the root solve when they are evaluated with the same parameters.
+        last_detuning_and_shift = base.LastEvaluation(detuning_and_shift)
+
+        def kerr_symmetric_transmission(frequency, resonance_frequency, coupling_loss, internal_loss, kerr_input):
+            detuning, shift = last_detuning_and_shift(frequency, resonance_frequency, coupling_loss, internal_loss,
+                                                      kerr_input)
+            return 1 / (1 + (internal_loss + 2j * (detuning - shift)) / coupling_loss)
+
+        def kerr_symmetric_transmission_derivatives(frequency, resonance_frequency, coupling_loss, internal_loss,
+                                                    kerr_input):
+            detuning, shift = last_detuning_and_shift(frequency, resonance_frequency, coupling_loss, internal_loss,
+                                                      kerr_input)
+            d_shift = kerr.detuning_shift_derivatives(detuning=detuning, shift=shift, coupling_loss=coupling_loss,
+                                                      internal_loss=internal_loss, kerr_input=kerr_input,
+                                                      io_coupling_coefficient=self.io_coupling_coefficient)
+            denominator = coupling_loss + internal_loss + 2j * (detuning - shift)
+            # The derivative of the model with respect to the denominator.
+            d_denominator = -coupling_loss / denominator ** 2
+            return {'resonance_frequency': (-2j * d_denominator * (1 - d_shift['detuning'])
+                                            * frequency / resonance_frequency ** 2),
+                    'coupling_loss': 1 / denominator + d_denominator * (1 - 2j * d_shift['coupling_loss']),
+                    'internal_loss': d_denominator * (1 - 2j * d_shift['internal_loss']),
+                    'kerr_input': -2j * d_denominator * d_shift['kerr_input']}
+
+        super(KerrSymmetricTransmission, self).__init__(func=kerr_symmetric_transmission, *args, **kwds)
+        self.derivatives = kerr_symmetric_transmission_derivatives
+        self.scan = scan
+
+    def guess(self, data=None, frequency=None, scan=None, **kwds):
+        """
+        Return initial parameters; the losses are first guessed from the peak as for the linear model, and then, if scan
+        is True, kerr_input, the resonance frequency, and the losses are chosen by comparing the data to the model for a
+        grid of values (see `kerr.guess_kerr_input`); otherwise kerr_input starts at zero. The scan improves the initial
+        values for data near and above bifurcation; it evaluates the model for about a hundred sets of values, which
+        takes a time comparable to a fit of a thousand points. The default of None means to use the value given when the
+        model was created.
+        """
+        if scan is None:
+            scan = self.scan
+        resonance_frequency, total_loss, internal_over_coupling = _guess_peak(data=data, frequency=frequency)
+        coupling_loss = total_loss / (1 + internal_over_coupling)
+        internal_loss = total_loss - coupling_loss
+        kerr_input = 0
+        if scan:
+            resonance_frequency, coupling_loss, internal_loss, kerr_input = kerr.guess_kerr_input(
+                evaluate=lambda f, f_r, l_c, l_i, k: self.func(frequency=f, resonance_frequency=f_r, coupling_loss=l_c,
+                                                               internal_loss=l_i, kerr_input=k),
+                frequency=frequency, data=data, resonance_frequency=resonance_frequency, coupling_loss=coupling_loss,
+                internal_loss=internal_loss, io_coupling_coefficient=self.io_coupling_coefficient)
+        params = self.make_params()
+        params['resonance_frequency'].set(value=resonance_frequency, min=frequency.min(), max=frequency.max())
+        params['coupling_loss'].set(value=coupling_loss, min=1e-12, max=1)
+        params['internal_loss'].set(value=internal_loss, min=1e-12, max=1)
+        params['kerr_input'].set(value=kerr_input)
+        return params
+
+    @classmethod
+    def absolute_kerr_input_at_bifurcation(cls, coupling_loss, internal_loss):
+        return kerr.absolute_kerr_input_at_bifurcation(coupling_loss=coupling_loss, internal_loss=internal_loss,
+                                                       io_coupling_coefficient=cls.io_coupling_coefficient)
+
+
+class KerrSymmetricTransmissionFitter(kerr.KerrFitter):
+    """
+    This class fits a composite model that is the product of the MagnitudePhase background model and the
+    KerrSymmetricTransmission model.
+
+    As for CCxSTFitterKnownMagnitude, the magnitude of the background response must be known and the cable delay must
+    have been calibrated so that the background phase is constant across the band, but it will fit for a constant phase
+    offset.
+    """
+
+    def __init__(self, frequency, data, background_magnitude, choose=np.max, errors=None, track=False, table=None,
+                 scan=True, **fit_kwds):
+        """
+        Fit the given data.
+
+        :param frequency: an array of real frequencies at which the data was measured.
+        :param data: an array of complex transmission data.
+        :param background_magnitude: the value of the transmission in the absence of the resonator, in the same units
+          as the data meaning NOT in dB.
+        :param choose: a numpy ufunc; see `kerr.kerr_detuning_shift`.
+        :param errors: an array of complex numbers that are the standard errors of the mean of the data points; the
+          errors for the real and imaginary parts may be different; if no errors are provided then all points will be
+          weighted equally.
+        :param track: if True, the model follows a continuous branch of roots in the order of the frequency points,
+          which should then be the order in which they were measured; see `kerr.kerr_detuning_shift`.
+        :param table: None or a `kerr.DetuningShiftTable` used by the model to calculate the shift faster; see
+          `KerrSymmetricTransmission`.
+        :param scan: if True, the default, the guess scans a grid of nonlinearities, and if False, it starts from the
+          linear guess; see `KerrSymmetricTransmission.guess`.
+        :param fit_kwds: keyword arguments passed directly to lmfit.model.Model.fit().
+        """
+        self.background_magnitude = background_magnitude
+        super(KerrSymmetricTransmissionFitter, self).__init__(
+            frequency=frequency, data=data, choose=choose,
+            foreground_model=KerrSymmetricTransmission(choose=choose, track=track, table=table, scan=scan),
+            background_model=background.MagnitudePhase(), errors=errors, track=track, **fit_kwds)
+
+    def guess(self, frequency, data):
+        phase_guess = np.angle(data[np.argmax(np.abs(data))])
+        params = self.background_model.make_params(magnitude=self.background_magnitude, phase=phase_guess)
+        params['magnitude'].vary = False
+        background_values = self.background_model.eval(params=params, frequency=frequency)
+        params.update(self.foreground_model.guess(data=data / background_values, frequency=frequency))
+        return params
+
+    def invert(self, scattering_data):
+        """
+        Return the detuning and internal_loss that correspond to the given normalized data, including the Kerr detuning
+        shift at the photon number implied by each data point; see `kerr.invert` and `base.ResonatorFitter.invert`.
+        """
+        z = self.coupling_loss * (1 / scattering_data - 1)
+        return kerr.invert(z=z, coupling_loss=self.coupling_loss, kerr_input=self.kerr_input,
+                           io_coupling_coefficient=self.foreground_model.io_coupling_coefficient)